@@ -1,22 +1,86 @@
 import click
 
-from mc_benchmark.benchmark import Benchmark
-from mc_benchmark.analysis import run_analysis
+from mc_benchmark import DEFAULT_PORT
+
+# the commands import what they need themselves, so e.g. list does not load any backend
 
 @click.group()
 def cli():
     pass
 
+@cli.command(name='list')
+def list_scenarios():
+    from mc_benchmark import scenario_folder
+    from mc_benchmark.calculators import calculator_types
+    for path in sorted(scenario_folder.glob('*.yml')):
+        print(path.stem)
+    print(f"Calculator types: {', '.join(calculator_types())}")
+
 @cli.command()
 @click.option('-s', '--scenario', required=True)
-def benchmark(scenario):
-    b = Benchmark.from_yaml(scenario)
+@click.option('--cores', type=int, default=None, help='Number of cores to schedule scenarios on (default: all available).')
+@click.option('--memory-budget', type=float, default=None, help='MiB shared by concurrently running scenarios (default: physical memory).')
+@click.option('--serial', is_flag=True, help='Run one scenario at a time.')
+@click.option('--force', is_flag=True, help='Rerun scenarios that already have a cached result.')
+@click.option('--warm', is_flag=True, help='Reuse one warm worker process per backend instead of a new process per scenario.')
+@click.option('--timeout', type=float, default=None, help='Seconds a scenario may take, unless it sets its own timeout.')
+@click.option('--max-memory', type=float, default=None, help='Address space cap in MiB for a scenario, unless it sets its own max_memory.')
+@click.option('--workers', default=None, help='Comma separated host:port of workers to run the scenarios on instead of this machine.')
+@click.option('--retries', type=int, default=3, help='Times to reconnect to a worker that fails before giving up on it.')
+@click.option('--conformance', type=click.Choice(['flag', 'exclude', 'off']), default='flag', help='Check backends\' outputs first, and flag or exclude those that are wrong.')
+def benchmark(scenario, cores, memory_budget, serial, force, warm, timeout, max_memory, workers, retries, conformance):
+    from mc_benchmark.benchmark import Benchmark, available_cores
+    from mc_benchmark.distributed import RemoteWorker
+    b = Benchmark.from_yaml(
+        scenario,
+        cores=available_cores()[:cores] if cores is not None else None,
+        memory_budget=memory_budget,
+        serial=serial,
+        force=force,
+        warm=warm,
+        timeout=timeout,
+        max_memory=max_memory,
+        workers=[RemoteWorker(address, retries=retries) for address in workers.split(",")] if workers else None,
+        conformance=conformance,
+    )
     b.process_scenarios()
 
+@cli.command()
+@click.option('--host', default='localhost', help='Interface to listen on, e.g. 0.0.0.0 for every interface.')
+@click.option('--port', type=int, default=DEFAULT_PORT)
+@click.option('--cores', type=int, default=None, help='Number of cores to offer coordinators (default: all available).')
+def worker(host, port, cores):
+    from mc_benchmark.benchmark import available_cores
+    from mc_benchmark.distributed import serve
+    try:
+        serve(host, port, cores=available_cores()[:cores] if cores is not None else None)
+    except ValueError as error:
+        raise click.UsageError(str(error))
+
 @cli.command()
 @click.option('-s', '--scenario', required=True)
-def analyze(scenario):
-    run_analysis(scenario)
+@click.option('--run-id', default=None, help='Only analyse this run (default: the latest result of every scenario).')
+@click.option('--target-error', type=float, default=1e-4, help='Standard error to project the time to reach for.')
+def analyze(scenario, run_id, target_error):
+    from mc_benchmark.analysis import run_analysis
+    run_analysis(scenario, run_id, target_error)
+
+@cli.command()
+@click.option('-s', '--scenario', default=None, help='Compare the latest two runs of this scenario.')
+@click.option('--baseline', default=None, help='Run id to compare against.')
+@click.option('--candidate', default=None, help='Run id to check for regressions.')
+@click.option('--threshold', type=float, default=0.25, help='Relative change the confidence interval of the median has to clear to count as a regression.')
+@click.option('--alpha', type=float, default=0.001, help='Significance level of the Mann-Whitney test.')
+@click.option('--min-runs', type=int, default=10, help='Runs each side needs before a metric can count as a regression.')
+def compare(scenario, baseline, candidate, threshold, alpha, min_runs):
+    from mc_benchmark.compare import run_compare
+    report = run_compare(scenario, baseline, candidate, threshold=threshold, alpha=alpha, min_runs=min_runs)
+    columns = ['type', 'function', 'extra_arguments', 'num_samples', 'turn_limit', 'metric', 'baseline_median', 'candidate_median', 'change', 'p_slower', 'verdict']
+    print(report[columns].sort_values('change', ascending=False).to_string(index=False))
+    regressions = report[report['verdict'] == 'regression']
+    if len(regressions):
+        click.echo(f'{len(regressions)} regression(s) above {threshold:.0%}', err=True)
+        raise SystemExit(1)
 
 if __name__ == '__main__':
     cli()
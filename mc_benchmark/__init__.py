@@ -3,3 +3,7 @@ import pathlib
 benchmark_results_folder = pathlib.Path(__file__).parent.parent / "benchmark_results"
 scenario_folder = pathlib.Path(__file__).parent / "scenarios"
 analysis_folder = pathlib.Path(__file__).parent.parent / "analysis_data"
+queries_folder = pathlib.Path(__file__).parent.parent / "queries"
+store_folder = benchmark_results_folder / "store"
+# of `bm.py worker`, see distributed.py
+DEFAULT_PORT = 6000
@@ -1,94 +1,493 @@
+import math
+import typing
+
 import duckdb
+import pandas
+import pyarrow as pa
 
-from mc_benchmark import benchmark_results_folder, analysis_folder
+from mc_benchmark import analysis_folder, benchmark_results_folder, store_folder
+from mc_benchmark.store import MEASUREMENTS_GLOB
 
 
-def run_analysis(scenario: str):
-    if (duckdb_path := benchmark_results_folder / f"{scenario}.duckdb").exists():
-        con = duckdb.connect(str(duckdb_path))
-        file_path = None
-    elif (file_path := benchmark_results_folder / f"{scenario}.parquet").exists() or (file_path := benchmark_results_folder / f"{scenario}.csv").exists():
-        con = duckdb.connect()
-    else:
+def non_conforming_keys(scenario: str) -> list[str]:
+    """Cache keys of scenario's scenarios whose latest conformance check failed (see conformance.py)."""
+    if not (duckdb_path := benchmark_results_folder / f"{scenario}.duckdb").exists():
+        return []
+    con = duckdb.connect(str(duckdb_path), read_only=True)
+    try:
+        return [key for (key,) in con.execute("select cache_key from conformance where status in ('failed', 'error')").fetchall()]
+    except duckdb.CatalogException:
+        return []
+    finally:
+        con.close()
+
+
+def load_measurements(con, scenario: str, run_id: typing.Optional[str] = None) -> None:
+    """
+    Create the measurements view over the store (see store.py): the long format rows of the latest
+    run of each of scenario's scenarios, or only those of run_id, leaving out scenarios that did
+    not conform. Nothing is read up front, the scenario_name filter is pushed down into the
+    parquet scan and run_id prunes whole partitions.
+    """
+    if not any(store_folder.glob(MEASUREMENTS_GLOB)):
         raise FileNotFoundError(f"No benchmark output found for {scenario}.")
+    run_filter = f"and run_id = '{run_id}'" if run_id is not None else ""
+    if excluded := non_conforming_keys(scenario):
+        print(f"Leaving out {len(excluded)} scenarios that did not conform")
+        run_filter += f" and cache_key not in ({', '.join(repr(key) for key in excluded)})"
+    con.execute(
+        f"""
+        create or replace view measurements as
+        select *
+        from read_parquet('{store_folder / MEASUREMENTS_GLOB}', hive_partitioning = true)
+        where scenario_name = '{scenario}' {run_filter}
+        qualify dense_rank() over (partition by cache_key order by run_id desc) = 1
+        """
+    )
+    if con.execute("select count(*) from measurements").fetchone()[0] == 0:
+        raise FileNotFoundError(f"No benchmark output found for {scenario}.")
+
+
+def standard_errors(scenario: str) -> pandas.DataFrame:
+    """
+    The statistical error each scenario that kept its output (retain_output) achieved: the standard
+    error of the final turn's average value for aggregated casino scenarios, and the returned error
+    estimate of pi_calculator_variance_reduced.
+    """
+    rows = []
+    if (duckdb_path := benchmark_results_folder / f"{scenario}.duckdb").exists():
+        con = duckdb.connect(str(duckdb_path), read_only=True)
+        outputs = con.execute(
+            """
+            select type, function, num_samples, function_arguments.roulette_sim.turn_limit, extra_arguments, output_paths
+            from results
+            where output_paths is not null
+                and (function like 'casino_simulation_aggregated%' or function = 'pi_calculator_variance_reduced')
+            """
+        ).fetchall()
+        con.close()
+        for type, function, num_samples, turn_limit, extra_arguments, paths in outputs:
+            if len(paths) > 1:
+                # tuple outputs get a file per element, the error comes last: (estimate, standard error)
+                # for pi_calculator_variance_reduced, (turns, averages, standard errors) for numba
+                table, column = pa.ipc.open_file(paths[-1]).read_all(), "value"
+            else:
+                table = pa.ipc.open_file(paths[0]).read_all()
+                # duckdb and polars name the column, numpy returns (turn, average, samples, error) columns
+                column = "avg_value_error" if "avg_value_error" in table.column_names else "column_3"
+            if column in table.column_names and table.num_rows:
+                rows.append((type, function, num_samples, turn_limit, extra_arguments, table[column][-1].as_py()))
+    return pandas.DataFrame(
+        rows, columns=["type", "function", "num_samples", "turn_limit", "extra_arguments", "standard_error"],
+    )
+
+
+def run_analysis(scenario: str, run_id: typing.Optional[str] = None, target_error: float = 1e-4):
+    con = duckdb.connect()
+    load_measurements(con, scenario, run_id)
 
     time_analysis = con.execute(
         f"""
         copy (
-        with time_unnest as (
+        select
+            type,
+            function,
+            num_samples,
+            turn_limit,
+            total_time,
+            stop_reason,
+            warmup_runs,
+            relative_ci,
+            count(*) as num_runs,
+            avg(value) as average_time_taken,
+            var_samp(value) as average_time_error,
+            median(value) as median_time_taken
+        from measurements
+        where scenario_type = 'time' and metric = 'time'
+        group by all
+        order by
+            num_samples desc,
+            turn_limit desc,
+            median_time_taken asc
+        ) to '{analysis_folder}/{scenario}_time.csv'
+        """
+    )
+
+    memory_analysis = con.execute(
+        f"""
+        copy (
+        with peaks as (
             select
-                type,
-                function,
-                num_samples,
-                function_arguments.roulette_sim.turn_limit,
-                total_time,
-                unnest(result.time_result) as time_taken
-            from results
-            where scenario_type = 'time'
+                cache_key,
+                iteration,
+                max(value) filter (where metric = 'peak_rss') as peak_rss,
+                max(value) filter (where metric = 'traced_peak') as traced_peak
+            from measurements
+            where scenario_type = 'memory'
+            group by all
         )
 
         select
+            scenario_number,
             type,
             function,
             num_samples,
             turn_limit,
             total_time,
-            avg(time_taken) as average_time_taken,
-            var_samp(time_taken) as average_time_error
-        from time_unnest
+            iteration as function_iteration,
+            peaks.peak_rss,
+            peaks.traced_peak,
+            value as memory_taken,
+            time_s
+        from measurements
+        inner join peaks using (cache_key, iteration)
+        where scenario_type = 'memory' and metric = 'rss_mib'
+        order by scenario_number, function_iteration, time_s
+        ) to '{analysis_folder}/{scenario}_memory.csv'
+        """
+    )
+
+    startup_analysis = con.execute(
+        f"""
+        copy (
+        select
+            type,
+            function,
+            num_samples,
+            turn_limit,
+            profiler_arguments,
+            count(*) filter (where metric = 'process_total') as num_runs,
+            avg(value) filter (where metric = 'library_import') as average_library_import,
+            avg(value) filter (where metric = 'calculator_import') as average_calculator_import,
+            avg(value) filter (where metric = 'first_call') as average_first_call,
+            avg(value) filter (where metric = 'jit_compile') as average_jit_compile,
+            avg(value) filter (where metric = 'second_call') as average_second_call,
+            avg(value) filter (where metric = 'process_total') as average_process_total
+        from measurements
+        where scenario_type = 'startup' and metric is not null
         group by all
         order by
             num_samples desc,
             turn_limit desc,
-            average_time_taken asc
-        ) to '{analysis_folder}/{scenario}_time.csv'
+            average_process_total asc
+        ) to '{analysis_folder}/{scenario}_startup.csv'
         """
     )
 
-    memory_analysis = con.execute(
+    cpu_analysis = con.execute(
         f"""
         copy (
-        with initial_unnest as (
+        with cpu_averages as (
             select
-                scenario_number,
                 type,
                 function,
                 num_samples,
-                function_arguments.roulette_sim.turn_limit,
-                total_time,
-                unnest(result.memory_result) as memory_data
-            from results
-            where scenario_type = 'memory'
-        ),
+                coalesce(num_threads, 1) as num_threads,
+                turn_limit,
+                count(*) filter (where metric = 'wall_time') as num_runs,
+                avg(value) filter (where metric = 'wall_time') as average_wall_time,
+                avg(value) filter (where metric = 'user_time') as average_user_time,
+                avg(value) filter (where metric = 'system_time') as average_system_time,
+                avg(value) filter (where metric = 'voluntary_switches') as average_voluntary_switches,
+                avg(value) filter (where metric = 'involuntary_switches') as average_involuntary_switches,
+                avg(value) filter (where metric = 'minor_faults') as average_minor_faults,
+                avg(value) filter (where metric = 'major_faults') as average_major_faults,
+                max(value) filter (where metric = 'peak_threads') as peak_threads,
+                sum(value) filter (where metric = 'instructions')
+                    / sum(value) filter (where metric = 'cycles') as instructions_per_cycle,
+                avg(value) filter (where metric = 'cache_misses') as average_cache_misses,
+                avg(value) filter (where metric = 'branch_misses') as average_branch_misses
+            from measurements
+            where scenario_type = 'cpu' and metric is not null
+            group by all
+        )
 
-        memory_measurement_unnest as (
+        select
+            *,
+            -- how many cores were busy on average, and that as a share of the threads asked for
+            (average_user_time + average_system_time) / average_wall_time as cores_used,
+            (average_user_time + average_system_time) / (average_wall_time * num_threads) as cpu_utilisation,
+            -- speedup over the single threaded run of the same function and arguments, per thread
+            max(case when num_threads = 1 then average_wall_time end) over same_work
+                / (average_wall_time * num_threads) as parallel_efficiency
+        from cpu_averages
+        window same_work as (partition by type, function, num_samples, turn_limit)
+        order by
+            type,
+            function,
+            num_samples desc,
+            turn_limit desc,
+            num_threads asc
+        ) to '{analysis_folder}/{scenario}_cpu.csv'
+        """
+    )
+
+    # per configuration medians the report, scaling fits and crossovers are built from, so a slow
+    # outlier run (a page fault storm, a late jit compilation) doesn't move the rankings
+    con.execute(
+        """
+        create temporary view time_stats as
+        select
+            type,
+            function,
+            extra_arguments,
+            num_samples,
+            turn_limit,
+            coalesce(num_threads, 1) as num_threads,
+            median(value) as median_time
+        from measurements
+        where scenario_type = 'time' and metric = 'time'
+        group by all
+        """
+    )
+    con.execute(
+        """
+        create temporary view memory_stats as
+        with iterations as (
             select
-                scenario_number,
                 type,
                 function,
+                extra_arguments,
                 num_samples,
                 turn_limit,
-                total_time,
-                memory_data.function_iteration,
-                unnest(memory_data.data) as memory_taken,
-            from initial_unnest
-        ),
+                coalesce(num_threads, 1) as num_threads,
+                cache_key,
+                iteration,
+                max(value) filter (where metric = 'peak_rss') as peak_rss,
+                -- resident memory when the call started
+                arg_min(value, time_s) filter (where metric = 'rss_mib') as start_rss
+            from measurements
+            where scenario_type = 'memory' and metric is not null
+            group by all
+        )
 
-        include_row_number as (
+        select
+            type,
+            function,
+            extra_arguments,
+            num_samples,
+            turn_limit,
+            num_threads,
+            median(peak_rss) as peak_rss,
+            median(peak_rss - start_rss) as memory_increase
+        from iterations
+        group by all
+        """
+    )
+    con.execute(
+        """
+        create temporary view cpu_stats as
+        with iterations as (
             select
-                scenario_number,
                 type,
                 function,
+                extra_arguments,
                 num_samples,
                 turn_limit,
-                total_time,
-                function_iteration,
-                memory_taken,
-                0.1 * row_number() over (partition by scenario_number, function_iteration) as time_s
-            from memory_measurement_unnest
+                coalesce(num_threads, 1) as num_threads,
+                cache_key,
+                iteration,
+                sum(value) as cpu_seconds
+            from measurements
+            where scenario_type = 'cpu' and metric in ('user_time', 'system_time')
+            group by all
         )
 
-        select * from include_row_number
-        ) to '{analysis_folder}/{scenario}_memory.csv'
+        select type, function, extra_arguments, num_samples, turn_limit, num_threads, median(cpu_seconds) as cpu_seconds
+        from iterations
+        group by all
+        """
+    )
+    con.register("standard_errors", standard_errors(scenario))
+
+    def same_configuration(
+            left: str,
+            right: str,
+            columns=("type", "function", "extra_arguments", "num_samples", "turn_limit", "num_threads"),
+        ) -> str:
+        return " and ".join(f"{left}.{column} is not distinct from {right}.{column}" for column in columns)
+
+    con.execute(
+        f"""
+        create temporary view configurations as
+        select
+            t.*,
+            t.num_samples / t.median_time as samples_per_second,
+            t.num_samples * t.turn_limit / t.median_time as sample_turns_per_second,
+            m.peak_rss,
+            m.memory_increase * 1048576 / t.num_samples as bytes_per_sample,
+            -- measured in cpu scenarios, otherwise every thread is assumed busy
+            coalesce(c.cpu_seconds, t.median_time * t.num_threads) as cpu_seconds,
+            coalesce(
+                e.standard_error,
+                -- each point lands in the circle with probability pi / 4
+                case when t.function like 'pi%' then 4 * sqrt({math.pi / 4} * (1 - {math.pi / 4}) / t.num_samples) end
+            ) as standard_error
+        from time_stats as t
+        left join memory_stats as m on {same_configuration("t", "m")}
+        left join cpu_stats as c on {same_configuration("t", "c")}
+        left join standard_errors as e
+            on {same_configuration("t", "e", ("type", "function", "extra_arguments", "num_samples", "turn_limit"))}
+        """
+    )
+    report_analysis = con.execute(
+        f"""
+        copy (
+        select
+            *,
+            -- the error one cpu second of this configuration would reach, errors shrink as 1 / sqrt(work)
+            standard_error * sqrt(cpu_seconds) as error_per_cpu_second,
+            rank() over workload as time_rank,
+            rank() over (partition by num_samples, turn_limit order by bytes_per_sample) as memory_rank,
+            rank() over (partition by num_samples, turn_limit order by standard_error * sqrt(cpu_seconds)) as efficiency_rank
+        from configurations
+        window workload as (partition by num_samples, turn_limit order by median_time)
+        order by
+            num_samples desc,
+            turn_limit desc,
+            time_rank
+        ) to '{analysis_folder}/{scenario}_report.csv'
+        """
+    )
+
+    # log-log fits of time and memory against each swept size, per backend and fixed other size
+    con.execute(
+        """
+        create temporary view scaling as
+        with points as (
+            select type, function, extra_arguments, num_threads, 'time' as metric, 'num_samples' as axis, turn_limit as fixed_value, num_samples as x, median_time as y
+            from time_stats
+            union all
+            select type, function, extra_arguments, num_threads, 'time', 'turn_limit', num_samples, turn_limit, median_time
+            from time_stats
+            where turn_limit is not null
+            union all
+            select type, function, extra_arguments, num_threads, 'memory', 'num_samples', turn_limit, num_samples, memory_increase
+            from memory_stats
+            union all
+            select type, function, extra_arguments, num_threads, 'memory', 'turn_limit', num_samples, turn_limit, memory_increase
+            from memory_stats
+            where turn_limit is not null
+            union all
+            select type, function, extra_arguments, num_threads, 'standard_error', 'num_samples', turn_limit, num_samples, standard_error
+            from configurations
+        )
+
+        select
+            type,
+            function,
+            extra_arguments,
+            num_threads,
+            metric,
+            axis,
+            fixed_value,
+            count(*) as points,
+            min(x) as min_x,
+            max(x) as max_x,
+            -- y ~ exp(log_intercept) * x ^ exponent
+            regr_slope(ln(y), ln(x)) as exponent,
+            regr_intercept(ln(y), ln(x)) as log_intercept,
+            regr_r2(ln(y), ln(x)) as r2
+        from points
+        where x > 0 and y > 0
+        group by all
+        having count(distinct x) >= 2
+        """
+    )
+    scaling_analysis = con.execute(
+        f"""
+        copy (
+        select * from scaling
+        order by metric desc, axis, fixed_value, exponent
+        ) to '{analysis_folder}/{scenario}_scaling.csv'
+        """
+    )
+
+    # where two backends' fitted curves cross, below it the one with the steeper curve wins
+    crossover_analysis = con.execute(
+        f"""
+        copy (
+        with crossovers as (
+            select
+                a.metric,
+                a.axis,
+                a.fixed_value,
+                a.num_threads,
+                a.type as type_a,
+                a.function as function_a,
+                a.extra_arguments as extra_arguments_a,
+                b.type as type_b,
+                b.function as function_b,
+                b.extra_arguments as extra_arguments_b,
+                exp((b.log_intercept - a.log_intercept) / (a.exponent - b.exponent)) as crossover,
+                greatest(a.min_x, b.min_x) as min_x,
+                least(a.max_x, b.max_x) as max_x,
+                case when a.exponent > b.exponent then a.type || '.' || a.function else b.type || '.' || b.function end as better_below,
+                case when a.exponent > b.exponent then b.type || '.' || b.function else a.type || '.' || a.function end as better_above
+            from scaling as a
+            inner join scaling as b
+                on a.metric = b.metric
+                and a.metric != 'standard_error'
+                and a.axis = b.axis
+                and a.fixed_value is not distinct from b.fixed_value
+                and a.num_threads = b.num_threads
+                and (a.type, a.function, a.extra_arguments) < (b.type, b.function, b.extra_arguments)
+                and a.exponent != b.exponent
+        )
+
+        select
+            *,
+            crossover between min_x and max_x as within_measured_range
+        from crossovers
+        order by metric desc, axis, fixed_value, crossover
+        ) to '{analysis_folder}/{scenario}_crossover.csv'
+        """
+    )
+
+    # time and cpu seconds each configuration needs to bring its standard error down to target_error,
+    # extrapolated from its largest measured run along its fitted error curve (plain monte carlo
+    # error shrinks as num_samples ^ -0.5 when there is no fit) with time linear in num_samples
+    accuracy_analysis = con.execute(
+        f"""
+        copy (
+        with largest as (
+            select *
+            from configurations
+            where standard_error > 0
+            qualify row_number() over (
+                partition by type, function, extra_arguments, turn_limit, num_threads order by num_samples desc
+            ) = 1
+        ),
+
+        projected as (
+            select
+                l.type,
+                l.function,
+                l.extra_arguments,
+                l.turn_limit,
+                l.num_threads,
+                l.num_samples as measured_samples,
+                l.standard_error as measured_error,
+                l.median_time as measured_time,
+                l.cpu_seconds as measured_cpu_seconds,
+                coalesce(e.exponent, -0.5) as error_exponent,
+                -- standard_error * (n / num_samples) ^ error_exponent = target_error
+                l.num_samples * pow({target_error} / l.standard_error, 1 / coalesce(e.exponent, -0.5)) as target_samples
+            from largest as l
+            left join scaling as e
+                on {same_configuration("l", "e", ("type", "function", "extra_arguments", "num_threads"))}
+                and e.metric = 'standard_error' and e.axis = 'num_samples' and e.fixed_value is not distinct from l.turn_limit
+        )
+
+        select
+            *,
+            {target_error} as target_error,
+            measured_time * target_samples / measured_samples as time_to_target,
+            measured_cpu_seconds * target_samples / measured_samples as cpu_seconds_to_target,
+            measured_error <= {target_error} as target_reached,
+            rank() over (partition by turn_limit order by measured_cpu_seconds * target_samples / measured_samples) as cost_rank
+        from projected
+        order by turn_limit desc, cost_rank
+        ) to '{analysis_folder}/{scenario}_accuracy.csv'
         """
     )
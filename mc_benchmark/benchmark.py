@@ -1,18 +1,37 @@
+import contextlib
 import enum
 import itertools
+import json
+import os
 import pathlib
+import pickle
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
 import time
 import typing
 import multiprocessing
+import multiprocessing.connection
 
 import yaml
-import pandas
+import numpy
 import duckdb
-
-from memory_profiler import memory_usage
+import pyarrow as pa
 
 from mc_benchmark import benchmark_results_folder, scenario_folder
-from mc_benchmark.calculators import NumpyCalculator, DuckDBCalculator, NumbaCalculator, PolarsCalculator
+from mc_benchmark.cache import scenario_key
+from mc_benchmark.conformance import function_family, run_conformance, validation_arguments
+from mc_benchmark.cpu import cpu_usage
+from mc_benchmark.memory import MIB, memory_usage
+from mc_benchmark.calculators import get_calculator
+from mc_benchmark.calculators.base_calculator import BaseCalculator
+from mc_benchmark.calculators.parallel import ProcessPoolFunction
+from mc_benchmark.stopping import AdaptiveStopping, relative_ci
+from mc_benchmark.store import ResultStore
+from mc_benchmark.transport import read_table, write_output, write_result
 
 MIN_RUNS_PER_PROFILE = 5
 MIN_TIME_PER_PROFILE = 10  # seconds
@@ -22,6 +41,8 @@ class ScenarioType(str, enum.Enum):
     NONE = "none"
     MEMORY = "memory"
     TIME = "time"
+    STARTUP = "startup"
+    CPU = "cpu"
 
     @property
     def profiler(self):
@@ -29,56 +50,326 @@ class ScenarioType(str, enum.Enum):
             ScenarioType.NONE: ScenarioType.no_profiler,
             ScenarioType.MEMORY: ScenarioType.memory_profiler,
             ScenarioType.TIME: ScenarioType.time_profiler,
+            ScenarioType.STARTUP: ScenarioType.startup_profiler,
+            ScenarioType.CPU: ScenarioType.cpu_profiler,
         }
         return mappings[self]
 
     @staticmethod
-    def no_profiler(function, arguments, config={}):
-        return function(**arguments)
+    def no_profiler(function, arguments, config={}, max_time=None):
+        # nothing to record beyond the total time, retain_output keeps the output itself
+        function(**arguments)
+        return None, {}
 
     @staticmethod
-    def memory_profiler(function, arguments, config={}):
+    def repeat(
+            run_once: typing.Callable,
+            metric: typing.Callable = float,
+            adaptive: typing.Optional[AdaptiveStopping] = None,
+            max_time: typing.Optional[float] = None,
+        ):
+        """
+        Call run_once repeatedly, returning the (iteration number, result) pairs that were kept and
+        a dict saying why it stopped. metric turns a result into the number the stopping rule uses.
+
+        Without an adaptive rule the number of runs comes from the first run's duration against
+        MIN_TIME_PER_PROFILE, MIN_RUNS_PER_PROFILE and MAX_RUNS_PER_PROFILE, and every run is kept.
+        max_time (seconds) caps the time spent either way, once the first run is done.
+        """
         results = []
         start = time.perf_counter()
-        result = memory_usage((function, tuple(), arguments), **config)
-        end = time.perf_counter()
-        results.append({"function_iteration": 1, "data": result})
+        results.append(run_once())
+        first_run = time.perf_counter() - start
 
-        projected_min_runs = MIN_TIME_PER_PROFILE / (end - start)
-        for i in range(
-            min(MAX_RUNS_PER_PROFILE, max(MIN_RUNS_PER_PROFILE - 1, round(projected_min_runs)))
-        ):
-            result = {"function_iteration": i+2, "data": memory_usage((function, tuple(), arguments), **config)}
-            results.append(result)
-        return results
+        if adaptive is None:
+            min_time = MIN_TIME_PER_PROFILE if max_time is None else min(MIN_TIME_PER_PROFILE, max_time)
+            projected_min_runs = round(min_time / first_run)
+            num_runs = min(MAX_RUNS_PER_PROFILE, max(MIN_RUNS_PER_PROFILE - 1, projected_min_runs))
+            for _ in range(num_runs):
+                if max_time is not None and time.perf_counter() - start + first_run > max_time:
+                    break
+                results.append(run_once())
+            if len(results) < num_runs + 1:
+                stop_reason = "max_time"
+            elif num_runs == MAX_RUNS_PER_PROFILE:
+                stop_reason = "max_runs"
+            elif num_runs == MIN_RUNS_PER_PROFILE - 1:
+                stop_reason = "min_runs"
+            else:
+                stop_reason = "min_time"
+            warmup = 0
+            ci = relative_ci([metric(r) for r in results])
+        else:
+            values = [metric(results[0])]
+            while True:
+                elapsed = time.perf_counter() - start
+                stop_reason, warmup, ci = adaptive.check(values, elapsed)
+                if stop_reason is None and max_time is not None and elapsed >= max_time:
+                    stop_reason = "max_time"
+                if stop_reason is not None:
+                    break
+                results.append(run_once())
+                values.append(metric(results[-1]))
+
+        profile = {"stop_reason": stop_reason, "warmup_runs": warmup, "relative_ci": ci}
+        return list(enumerate(results, start=1))[warmup:], profile
 
     @staticmethod
-    def time_profiler(function, arguments, config={}):
-        results = []
-        start = time.perf_counter()
-        function(**arguments)
-        end = time.perf_counter()
-        results.append(end-start)
+    def memory_profiler(function, arguments, config={}, max_time=None):
+        config = dict(config)
+        adaptive = AdaptiveStopping.from_config(config.pop("adaptive", None))
+        # the rest of the config is for memory.memory_usage: interval (seconds) and trace_allocations
+        runs, profile = ScenarioType.repeat(
+            lambda: memory_usage(function, arguments, **config), lambda r: r["peak_rss"], adaptive, max_time
+        )
+        results = [{"function_iteration": i, **usage} for i, usage in runs]
+        return results, profile
 
-        projected_min_runs = MIN_TIME_PER_PROFILE / (end - start)
-        for _ in range(
-            min(MAX_RUNS_PER_PROFILE, max(MIN_RUNS_PER_PROFILE - 1, round(projected_min_runs)))
-        ):
+    @staticmethod
+    def time_profiler(function, arguments, config={}, max_time=None):
+        def run_once():
             start = time.perf_counter()
             function(**arguments)
             end = time.perf_counter()
-            results.append(end-start)
-        return results
+            return end - start
 
+        adaptive = AdaptiveStopping.from_config(config.get("adaptive"))
+        runs, profile = ScenarioType.repeat(run_once, float, adaptive, max_time)
+        results = [time_taken for _, time_taken in runs]
+        return results, profile
 
-def scenario_wrapper(function, function_arguments, queue, profiler, profiler_arguments):
-    start_time = time.time()
-    if not profiler:
-        result = function(**function_arguments)
+    @staticmethod
+    def cpu_profiler(function, arguments, config={}, max_time=None):
+        config = dict(config)
+        adaptive = AdaptiveStopping.from_config(config.pop("adaptive", None))
+        # the rest of the config is for cpu.cpu_usage: interval (seconds) and perf
+        runs, profile = ScenarioType.repeat(
+            lambda: cpu_usage(function, arguments, **config), lambda r: r["wall_time"], adaptive, max_time
+        )
+        results = [{"function_iteration": i, **usage} for i, usage in runs]
+        return results, profile
+
+    @staticmethod
+    def startup_profiler(function, arguments, config={}, max_time=None):
+        """
+        Cold start of a calculator: every run is a fresh interpreter (see startup.py) timing the
+        imports, the first call with its jit compilation and a second call. With numba_cache set,
+        numba caches compiled functions in a directory shared by the runs, so only the first run
+        compiles and the rest load from the cache.
+        """
+        library = calculator_library(function)
+        payload = pickle.dumps((function, arguments))
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = {
+                **os.environ,
+                "PYTHONPATH": os.pathsep.join(filter(None, [str(pathlib.Path(__file__).parent.parent), os.environ.get("PYTHONPATH")])),
+                "MC_BENCHMARK_NUMBA_CACHE": "1" if config.get("numba_cache") else "0",
+                "NUMBA_CACHE_DIR": cache_dir,
+            }
+
+            def run_once():
+                start = time.perf_counter()
+                process = subprocess.run(
+                    [sys.executable, "-m", "mc_benchmark.startup", *filter(None, [library])],
+                    input=payload,
+                    capture_output=True,
+                    env=env,
+                )
+                end = time.perf_counter()
+                if process.returncode != 0:
+                    raise RuntimeError(f"Startup run failed:\n{process.stderr.decode()}")
+                timings = json.loads(process.stdout.decode().splitlines()[-1])
+                return {**timings, "process_total": end - start}
+
+            adaptive = AdaptiveStopping.from_config(config.get("adaptive"))
+            runs, profile = ScenarioType.repeat(run_once, lambda r: r["process_total"], adaptive, max_time)
+        results = [{"function_iteration": i, **timings} for i, timings in runs]
+        return results, profile
+
+
+def calculator_library(function) -> typing.Optional[str]:
+    """The LIBRARY of the calculator a function (or query, or process pool of either) belongs to."""
+    module = sys.modules[getattr(function, "function", function).__module__]
+    for calculator in vars(module).values():
+        if isinstance(calculator, type) and issubclass(calculator, BaseCalculator) and calculator.__module__ == module.__name__:
+            return calculator.LIBRARY
+    return None
+
+
+# profilers measuring a warmed up function, see run_scenario
+STEADY_STATE_PROFILERS = (ScenarioType.time_profiler, ScenarioType.memory_profiler, ScenarioType.cpu_profiler)
+
+
+def available_cores() -> list[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def pin_to_cores(cores) -> None:
+    if not hasattr(os, "sched_setaffinity"):
+        return
+    # sched_setaffinity only moves the calling thread, so also move thread pools a warm
+    # worker already started (numba, duckdb, polars) rather than only the threads started later
+    thread_ids = [0]
+    if os.path.isdir("/proc/self/task"):
+        thread_ids = [int(tid) for tid in os.listdir("/proc/self/task")]
+    for tid in thread_ids:
+        try:
+            os.sched_setaffinity(tid, cores)
+        except ProcessLookupError:
+            pass
+
+
+def physical_memory() -> typing.Optional[float]:
+    """MiB of RAM on this machine, None where it can't be found."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / MIB
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def estimated_memory(function_arguments: dict) -> float:
+    """
+    Expected peak MiB of a scenario that does not declare its memory: a float64 per sample and turn
+    (the size of a casino simulation's full output), or nothing for functions without turns.
+    """
+    if "num_samples" not in function_arguments or "turn_limit" not in function_arguments:
+        return 0
+    return function_arguments["num_samples"] * (function_arguments["turn_limit"] + 1) * 8 / MIB
+
+
+def limit_memory(max_memory: typing.Optional[float]) -> None:
+    """Cap this process' address space at max_memory MiB (RLIMIT_AS), or lift the cap for None."""
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if max_memory is None:
+        limit = hard
     else:
-        result = profiler(function, function_arguments)
-    end_time = time.time()
-    queue.put((result, end_time - start_time))
+        limit = int(max_memory * MIB)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+    # only the soft limit, so a warm worker can raise it again for its next scenario
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _out_of_memory(error: Exception) -> bool:
+    # numpy raises MemoryError, duckdb its own OutOfMemoryException
+    return isinstance(error, MemoryError) or "OutOfMemory" in type(error).__name__
+
+
+def run_scenario(
+        function,
+        function_arguments,
+        profiler,
+        profiler_arguments,
+        cores=None,
+        max_memory=None,
+        result_path=None,
+        output_path=None,
+        timeout=None,
+    ):
+    """
+    Run and profile one scenario. With result_path the result is written there as an Arrow IPC
+    file and the path is returned in its place, with output_path the function is called once more,
+    outside the profiling, and its output kept there (see transport.py). With a timeout the
+    profiler repeats the function for at most half of it, leaving the rest for the process to start
+    and for the untimed calls, so a timeout only catches scenarios whose calls are too slow.
+    """
+    if cores is not None:
+        pin_to_cores(cores)
+    limit_memory(max_memory)
+    start_time = time.time()
+    try:
+        # one-off setup (e.g. planning a prepared query) is kept out of the timings
+        if hasattr(function, "prepare"):
+            function.prepare(function_arguments.get("num_threads", 1))
+        # an untimed call first, so jit compilation and first-call caches don't land in the first
+        # profiled run, cold start is what startup scenarios measure
+        if profiler in STEADY_STATE_PROFILERS:
+            function(**function_arguments)
+        start_time = time.time()
+        if not profiler:
+            result, profile = function(**function_arguments), {}
+        else:
+            max_time = timeout / 2 if timeout is not None else None
+            result, profile = profiler(function, function_arguments, profiler_arguments, max_time)
+        end_time = time.time()
+        if output_path is not None:
+            profile["output_paths"] = write_output(function(**function_arguments), pathlib.Path(output_path))
+    except Exception as error:
+        if not _out_of_memory(error):
+            raise
+        result, profile = None, {"stop_reason": "memory_limit"}
+        end_time = time.time()
+    if result_path is not None and result is not None:
+        write_result(result, pathlib.Path(result_path))
+        result = str(result_path)
+    return result, end_time - start_time, profile
+
+
+def scenario_wrapper(connection, task):
+    # own process group, so a timeout also kills any process pool the scenario started
+    os.setpgid(0, 0)
+    connection.send(run_scenario(*task))
+    connection.close()
+
+
+def warm_worker(connection):
+    """Run scenarios sent over connection until it is closed, keeping imports and jitted code warm."""
+    os.setpgid(0, 0)
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        connection.send(run_scenario(*task))
+    connection.close()
+
+
+def kill_scenario_process(process: multiprocessing.Process) -> None:
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        # killed before it made its process group
+        process.kill()
+    process.join()
+
+
+@contextlib.contextmanager
+def exit_on_termination():
+    """
+    Raise SystemExit on SIGTERM and SIGHUP (e.g. from timeout or a cancelled CI job), so the
+    finally blocks that kill the scenarios' process groups run instead of leaving them behind.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        # signal handlers can only be set from the main thread
+        yield
+        return
+
+    def terminate(signum, frame):
+        raise SystemExit(128 + signum)
+
+    previous = {signum: signal.signal(signum, terminate) for signum in (signal.SIGTERM, signal.SIGHUP)}
+    try:
+        yield
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+
+def sweep_values(value) -> list:
+    """Values of one function argument: a list, {logrange: [start, stop, num]} or a single value."""
+    if isinstance(value, dict) and "logrange" in value:
+        # floats, so yaml's 1e9 (a string to yaml) works too
+        start, stop, num = (float(v) for v in value["logrange"])
+        values = [int(round(v)) for v in numpy.geomspace(start, stop, int(num))]
+        return list(dict.fromkeys(values))
+    if isinstance(value, list):
+        return value
+    return [value]
 
 
 class Scenario:
@@ -89,6 +380,14 @@ class Scenario:
             function_arguments: dict,
             scenario_type: str,
             profiler_arguments: dict = {},
+            isolated: bool = False,
+            memory: typing.Optional[float] = None,
+            timeout: typing.Optional[float] = None,
+            max_memory: typing.Optional[float] = None,
+            sweep_number: typing.Optional[int] = None,
+            prune_on: list[str] = [],
+            retain_output: bool = False,
+            family: typing.Optional[str] = None,
         ) -> None:
         self.type = type
         self.function = function
@@ -96,11 +395,62 @@ class Scenario:
         self.scenario_type = ScenarioType(scenario_type)
         self.profiler = self.scenario_type.profiler
         self.profiler_arguments = profiler_arguments
+        # isolated scenarios never share the machine with another scenario
+        self.isolated = isolated
+        # expected peak memory in MiB, checked against the benchmark's memory budget
+        self.memory = memory if memory is not None else estimated_memory(function_arguments)
+        # hard budgets: wall clock seconds and address space MiB (RLIMIT_AS)
+        self.timeout = timeout
+        self.max_memory = max_memory
+        # scenarios expanded from the same yaml entry share a sweep_number, and prune_on names
+        # the arguments that make one of them bigger than another (see is_bigger_than)
+        self.sweep_number = sweep_number
+        self.prune_on = prune_on
+        # keep the function's own output, to compare backends against each other
+        self.retain_output = retain_output
+        # what the function simulates (pi, casino or elo), for its conformance check
+        self.family = family if family is not None else function_family(function.__name__)
+        # the dict this scenario was made from, which is what gets sent to remote workers
+        self.spec = None
+
+    def is_bigger_than(self, other: "Scenario") -> bool:
+        """True if this is the same sweep as other, with every prune_on argument at least as big and the rest equal."""
+        if self.sweep_number is None or self.sweep_number != other.sweep_number:
+            return False
+        for k in set(self.function_arguments) | set(other.function_arguments):
+            value, other_value = self.function_arguments.get(k), other.function_arguments.get(k)
+            if k in self.prune_on and isinstance(value, (int, float)) and isinstance(other_value, (int, float)):
+                if value < other_value:
+                    return False
+            elif value != other_value:
+                return False
+        return True
+
+    @property
+    def num_cores(self) -> int:
+        num_cores = self.function_arguments.get("num_threads", 1)
+        return num_cores * getattr(self.function, "num_processes", 1)
+
+    @property
+    def cache_key(self) -> str:
+        return scenario_key(
+            self.type, self.function, self.function_arguments, self.scenario_type.value, self.profiler_arguments
+        )
 
-    def to_process(self, queue):
-        return multiprocessing.Process(
-            target=scenario_wrapper,
-            args=(self.function, self.function_arguments, queue, self.profiler, self.profiler_arguments)
+    def to_process(self, connection, **kwargs):
+        return multiprocessing.Process(target=scenario_wrapper, args=(connection, self.to_task(**kwargs)))
+
+    def to_task(self, cores=None, max_memory=None, result_path=None, output_path=None, timeout=None):
+        return (
+            self.function,
+            self.function_arguments,
+            self.profiler,
+            self.profiler_arguments,
+            cores,
+            max_memory,
+            result_path,
+            output_path,
+            timeout,
         )
     
     def __repr__(self) -> str:
@@ -113,62 +463,439 @@ class Scenario:
     
     @classmethod
     def from_dict(cls, data: dict):
-        if data["type"] == "duckdb":
-            calc = DuckDBCalculator
-        elif data["type"] == "numpy":
-            calc = NumpyCalculator
-        elif data["type"] == "numba":
-            calc = NumbaCalculator
-        elif data["type"] == "polars":
-            calc = PolarsCalculator
-        function = getattr(calc, data["function"])
-        return cls(
+        if "query" in data:
+            # a sql file under queries/, e.g. query: roulette/reccte
+            from mc_benchmark.calculators.duckdb_calculator import PreparedQuery
+            function = PreparedQuery(data["query"])
+        else:
+            # only the backends a suite uses get imported
+            function = getattr(get_calculator(data["type"]), data["function"])
+        if "process_pool" in data:
+            # e.g. process_pool: {num_processes: 8, merge: mean, seed: 42}
+            function = ProcessPoolFunction(function, **data["process_pool"])
+        scenario = cls(
             type=data["type"],
             function=function,
             function_arguments=data.get("function_arguments", {}),
             scenario_type=data["scenario_type"],
             profiler_arguments=data.get("profiler_arguments", {}),
+            isolated=data.get("isolated", False),
+            memory=data.get("memory"),
+            timeout=data.get("timeout"),
+            max_memory=data.get("max_memory"),
+            sweep_number=data.get("sweep_number"),
+            prune_on=data.get("prune_on", []),
+            retain_output=data.get("retain_output", False),
+            family=data.get("family"),
         )
+        scenario.spec = data
+        return scenario
     
     @staticmethod
     def extend_dict(data: list[dict]) -> list[dict]:
-        """Unnest list values under special keys of a dictionary into other dicitonaries."""
-        extendable_keys = ["num_samples", "num_threads", "turn_limit"]
+        """
+        Expand every yaml entry into one scenario per combination of its function arguments.
+
+        Any argument can take several values, as a list or as {logrange: [start, stop, num]}
+        (num log spaced integers). Arguments are combined as a cartesian product, apart from the
+        groups under zip (e.g. zip: [[num_samples, turn_limit]]) whose values are paired in order.
+        prune_on defaults to every swept argument except num_threads.
+        """
         updated_data = []
-        for dict_item in data:
-            for k in extendable_keys:
-                if k in dict_item.get("function_arguments", {}) and not isinstance(dict_item["function_arguments"][k], list):
-                    dict_item["function_arguments"][k] = [dict_item["function_arguments"][k]]
-            updated_data.extend(
-                [
+        for sweep_number, dict_item in enumerate(data):
+            arguments = {k: sweep_values(v) for k, v in dict_item.get("function_arguments", {}).items()}
+            zipped = dict_item.get("zip", [])
+            # every axis is (argument names, list of value tuples)
+            axes = []
+            for group in zipped:
+                if len({len(arguments[k]) for k in group}) > 1:
+                    raise ValueError(f"Can't zip arguments of different lengths: {group}")
+                axes.append((group, list(zip(*(arguments[k] for k in group)))))
+            zipped_keys = {k for group in zipped for k in group}
+            axes.extend(((k,), [(v,) for v in values]) for k, values in arguments.items() if k not in zipped_keys)
+
+            swept = [k for k, values in arguments.items() if len(values) > 1]
+            prune_on = dict_item.get("prune_on", [k for k in swept if k != "num_threads"])
+            for combination in itertools.product(*(values for _, values in axes)):
+                function_arguments = {
+                    k: v for (keys, _), values in zip(axes, combination) for k, v in zip(keys, values)
+                }
+                updated_data.append(
                     {
                         **dict_item,
-                        "function_arguments": {
-                            **dict_item["function_arguments"],
-                            **{extendable_keys[i]: val for i, val in enumerate(unnested_tuple) if val is not None}
-                        }
+                        "function_arguments": function_arguments,
+                        "sweep_number": sweep_number,
+                        "prune_on": prune_on,
                     }
-                    for unnested_tuple in itertools.product(*(dict_item["function_arguments"].get(k, [None]) for k in extendable_keys))
-                ]
-            )
+                )
         return updated_data
 
+
+# one row per scenario, status is ok, failed, error or unchecked (see conformance.py)
+CONFORMANCE_SCHEMA = """
+    cache_key text,
+    type text,
+    function text,
+    validation_arguments text,
+    status text,
+    max_z double,
+    detail text
+"""
+
+
+def _outputs_exist(output_paths: typing.Optional[list[str]]) -> bool:
+    # a scenario cached before it had retain_output set has no outputs to reuse
+    return bool(output_paths) and all(os.path.exists(path) for path in output_paths)
+
+
 class Benchmark:
     def __init__(
             self,
             scenarios: list[Scenario],
-            name: str
+            name: str,
+            cores: typing.Optional[list[int]] = None,
+            memory_budget: typing.Optional[float] = None,
+            serial: bool = False,
+            force: bool = False,
+            warm: bool = False,
+            timeout: typing.Optional[float] = None,
+            max_memory: typing.Optional[float] = None,
+            workers: typing.Optional[list] = None,
+            conformance: str = "flag",
         ) -> None:
 
         self.scenarios = scenarios
         self.name = name
-        self.queue: multiprocessing.Queue = multiprocessing.Queue()
+        self.cores = cores if cores is not None else available_cores()
+        # MiB shared by the scenarios running at once on a machine, all of its RAM by default
+        self.memory_budget = memory_budget if memory_budget is not None else physical_memory()
+        self.serial = serial
+        # rerun scenarios even if their result is already cached
+        self.force = force
+        # reuse one interpreter per backend across scenarios instead of a new process for each,
+        # startup scenarios always measure a fresh interpreter themselves
+        self.warm = warm
+        self._idle_workers: dict[str, list] = {}
+        # default budgets for scenarios that do not set their own
+        self.timeout = timeout
+        self.max_memory = max_memory
+        # retained outputs, one Arrow IPC file per scenario named by its cache key
+        self.outputs_folder = benchmark_results_folder / f"{name}_outputs"
+        # RemoteWorkers (see distributed.py) to run scenarios on instead of this machine
+        self.workers = workers
+        # check every backend's output before benchmarking it (see conformance.py): flag records
+        # the outcome next to the results, exclude also leaves non-conforming scenarios out
+        if conformance not in ("flag", "exclude", "off"):
+            raise ValueError(f"conformance is flag, exclude or off, not {conformance}")
+        self.conformance = conformance
+
+    def _runs_alone(self, scenario: Scenario) -> bool:
+        return (
+            self.serial
+            or scenario.isolated
+            or (self.memory_budget is not None and scenario.memory > self.memory_budget)
+        )
+
+    def _hosts(self) -> list:
+        """Where scenarios can run: this machine (None), or the workers that are connected."""
+        if not self.workers:
+            return [None]
+        return [worker for worker in self.workers if worker.connect()]
+
+    def _host_cores(self, host) -> list[int]:
+        return self.cores if host is None else host.cores
+
+    def _start_scenarios(self, pending: list, running: dict) -> None:
+        """
+        Start pending scenarios, in order, on cores not used by a running one.
+
+        A scenario takes num_threads cores (times num_processes for process pools), capped at the
+        cores available, so independent single threaded scenarios run side by side. A scenario
+        that runs alone waits for everything before it to finish and blocks everything after it
+        (on its worker, with workers).
+        """
+        hosts = self._hosts()
+        if not hosts and not running and all(worker.given_up for worker in self.workers):
+            raise RuntimeError(f"No workers left to run the {len(pending)} remaining scenarios on")
+        free_cores, used_memory, busy, blocked = {}, {}, set(), set()
+        for host in hosts:
+            runs = [run for run in running.values() if run["host"] is host]
+            used_cores = {core for run in runs for core in run["cores"]}
+            free_cores[host] = [core for core in self._host_cores(host) if core not in used_cores]
+            used_memory[host] = sum(run["scenario"].memory for run in runs)
+            if runs:
+                busy.add(host)
+            if any(run["alone"] for run in runs):
+                blocked.add(host)
+
+        # a bigger scenario of a sweep waits for the smaller ones, so it can be pruned if they go over budget
+        waiting = [run["scenario"] for run in running.values()]
+        for i, scenario in list(pending):
+            if any(scenario.is_bigger_than(other) for other in waiting):
+                waiting.append(scenario)
+                continue
+            waiting.append(scenario)
+            alone = self._runs_alone(scenario)
+            for host in hosts:
+                if host in blocked:
+                    continue
+                if alone:
+                    if host in busy:
+                        continue
+                    cores = self._host_cores(host)
+                else:
+                    num_cores = min(scenario.num_cores, len(self._host_cores(host)))
+                    fits_memory = self.memory_budget is None or used_memory[host] + scenario.memory <= self.memory_budget
+                    if len(free_cores[host]) < num_cores or not fits_memory:
+                        continue
+                    cores, free_cores[host] = free_cores[host][:num_cores], free_cores[host][num_cores:]
+                    used_memory[host] += scenario.memory
+                break
+            else:
+                if alone:
+                    break
+                continue
+            busy.add(host)
+            if alone:
+                blocked.add(host)
+
+            timeout = scenario.timeout if scenario.timeout is not None else self.timeout
+            max_memory = scenario.max_memory if scenario.max_memory is not None else self.max_memory
+            paths = {
+                "result_path": self._transport_folder / f"{i}.arrow",
+                "output_path": self.outputs_folder / f"{scenario.cache_key}.arrow" if scenario.retain_output else None,
+            }
+            print(f"Running scenario {i} on cores {cores}" + (f" of worker {host}:" if host is not None else ":"))
+            print(scenario)
+            if host is not None:
+                p, receiver = None, host.connection
+                host.run(i, scenario, cores, max_memory, timeout)
+            elif self.warm:
+                p, receiver = self._warm_worker(scenario.type)
+                receiver.send(scenario.to_task(cores, max_memory, timeout=timeout, **paths))
+            else:
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                p = scenario.to_process(sender, cores=cores, max_memory=max_memory, timeout=timeout, **paths)
+                p.start()
+                sender.close()
+            pending.remove((i, scenario))
+            running[i] = {
+                "scenario": scenario,
+                "host": host,
+                "process": p,
+                "receiver": receiver,
+                "cores": cores,
+                "alone": alone,
+                "start": time.monotonic(),
+                "deadline": time.monotonic() + timeout if timeout is not None else None,
+                "max_memory": max_memory,
+                "paths": paths,
+            }
+
+    def _warm_worker(self, type: str):
+        idle = self._idle_workers.setdefault(type, [])
+        if idle:
+            return idle.pop()
+        connection, worker_connection = multiprocessing.Pipe()
+        p = multiprocessing.Process(target=warm_worker, args=(worker_connection,))
+        p.start()
+        worker_connection.close()
+        return p, connection
+
+    def _stop_warm_workers(self):
+        for workers in self._idle_workers.values():
+            for p, connection in workers:
+                connection.send(None)
+                connection.close()
+                p.join()
+        self._idle_workers = {}
+
+    def _record_result(self, con, i: int, scenario: Scenario, cache_key: str, result, exec_time, profile: dict, status: str):
+        """Insert a scenario's row into result_cache. result is the path of its Arrow IPC result file, or None."""
+        function_arguments = dict(scenario.function_arguments)
+        num_samples = function_arguments.pop("num_samples", None)
+        num_threads = function_arguments.pop("num_threads", None)
+        parameters = {
+            "cache_key": cache_key,
+            "type": scenario.type,
+            "scenario_number": i,
+            "scenario_type": scenario.scenario_type.value,
+            "function": scenario.function.__name__,
+            "num_samples": num_samples,
+            "num_threads": num_threads,
+            # anything else passed to the function (seed, compact, chunk_size, ...)
+            "extra_arguments": json.dumps({k: v for k, v in function_arguments.items() if k != "turn_limit"}),
+            "profiler_arguments": json.dumps(scenario.profiler_arguments),
+            "total_time": exec_time,
+            "stop_reason": profile.get("stop_reason"),
+            "warmup_runs": profile.get("warmup_runs"),
+            "relative_ci": profile.get("relative_ci"),
+            "output_paths": profile.get("output_paths"),
+            "status": status,
+        }
+        if "turn_limit" in function_arguments:
+            parameters["turn_limit"] = function_arguments.pop("turn_limit")
+            tagged_arguments = "union_value(roulette_sim := {'turn_limit': $turn_limit})"
+        else:
+            tagged_arguments = "union_value(pi_calc := cast(map() as map(integer, integer)))"
+        if result is None:
+            tagged_result, source = "cast(null as double[])", "(select 1)"
+        else:
+            # the arrow file is memory mapped and scanned by duckdb without going through python objects,
+            # the result is tagged explicitly as memory and startup results are both lists of structs
+            con.register("result_table", read_table(result))
+            tagged_result, source = f"union_value({scenario.scenario_type.value}_result := result)", "result_table"
+        con.execute("begin transaction")
+        con.execute("delete from result_cache where cache_key = $cache_key", {"cache_key": cache_key})
+        con.execute(
+            f"""
+            insert into result_cache
+            select
+                $cache_key,
+                $type,
+                $scenario_number,
+                $scenario_type,
+                $function,
+                $num_samples,
+                $num_threads,
+                {tagged_arguments},
+                $extra_arguments,
+                $profiler_arguments,
+                $total_time,
+                {tagged_result},
+                $stop_reason,
+                $warmup_runs,
+                $relative_ci,
+                $output_paths,
+                $status
+            from {source}
+            """,
+            parameters,
+        )
+        con.execute("commit")
+        if result is not None:
+            con.unregister("result_table")
+            os.remove(result)
+        self._store.append(con, cache_key)
+
+    def _run_pending(self, con, pending: list, running: dict, over_budget: list, cache_keys: list):
+        """Run pending scenarios until none are left, recording each result as it comes in."""
+        while pending or running:
+            for i, scenario in list(pending):
+                if any(scenario.is_bigger_than(other) for other in over_budget):
+                    print(f"Scenario {i} is bigger than one that went over budget, skipping")
+                    pending.remove((i, scenario))
+                    over_budget.append(scenario)
+                    self._record_result(con, i, scenario, cache_keys[i], None, None, {"stop_reason": "pruned"}, "over budget")
+            self._start_scenarios(pending, running)
+            # workers waiting to be reconnected to are retried without holding up running scenarios
+            retries = [worker.next_attempt for worker in self.workers or [] if worker.next_attempt is not None]
+            if not running:
+                if retries:
+                    time.sleep(max(0, min(retries) - time.monotonic()))
+                continue
+
+            deadlines = [run["deadline"] for run in running.values() if run["deadline"] is not None]
+            deadlines.extend(retries)
+            # scenarios on the same worker share its connection, which is closed if the worker was lost
+            receivers = list({run["receiver"]: None for run in running.values() if run["receiver"] is not None and not run["receiver"].closed})
+            if len(receivers) < len({id(run["receiver"]) for run in running.values()}):
+                deadlines.append(time.monotonic())
+            ready = multiprocessing.connection.wait(
+                receivers,
+                timeout=max(0, min(deadlines) - time.monotonic()) if deadlines else None,
+            )
+            for worker in {run["host"] for run in running.values() if run["host"] is not None}:
+                if worker.connection in ready:
+                    worker.receive()
+            for i, run in list(running.items()):
+                scenario = run["scenario"]
+                host = run["host"]
+                if host is not None and i not in host.finished and run["receiver"] is not host.connection:
+                    print(f"Lost scenario {i} with worker {host}, running it again")
+                    running.pop(i)
+                    pending.append((i, scenario))
+                    pending.sort(key=lambda item: item[0])
+                    continue
+                if not (i in host.finished if host is not None else run["receiver"] in ready):
+                    if run["deadline"] is not None and time.monotonic() >= run["deadline"]:
+                        print(f"Scenario {i} went over its {run['deadline'] - run['start']} second timeout")
+                        if host is not None:
+                            host.kill(i)
+                        else:
+                            kill_scenario_process(run["process"])
+                            run["receiver"].close()
+                        running.pop(i)
+                        over_budget.append(scenario)
+                        exec_time = time.monotonic() - run["start"]
+                        self._record_result(con, i, scenario, cache_keys[i], None, exec_time, {"stop_reason": "timeout"}, "over budget")
+                    continue
+
+                running.pop(i)
+                if host is not None:
+                    result, exec_time, profile, exited = host.collect(i, **run["paths"])
+                    if exited:
+                        exec_time = time.monotonic() - run["start"]
+                else:
+                    try:
+                        result, exec_time, profile = run["receiver"].recv()
+                        exited = False
+                    except EOFError:
+                        result, exec_time, profile = None, time.monotonic() - run["start"], {}
+                        exited = True
+                    if self.warm and not exited:
+                        self._idle_workers[scenario.type].append((run["process"], run["receiver"]))
+                    else:
+                        run["receiver"].close()
+                        run["process"].join()
+                # with an address space cap, a process that died most likely failed to allocate
+                if exited and run["max_memory"] is not None:
+                    profile = {"stop_reason": "memory_limit"}
+
+                if profile.get("stop_reason") == "memory_limit":
+                    print(f"Scenario {i} went over its {run['max_memory']} MiB memory limit")
+                    over_budget.append(scenario)
+                    self._record_result(con, i, scenario, cache_keys[i], None, exec_time, profile, "over budget")
+                elif exited:
+                    print(f"Scenario {i} exited without a result, skipping")
+                else:
+                    print(f"Finished scenario {i} in {exec_time} seconds")
+                    self._record_result(con, i, scenario, cache_keys[i], result, exec_time, profile, "ok")
+
+    def _check_conformance(self, con, cache_keys: list[str]) -> set:
+        """
+        Run the conformance checks of every scenario, distinct ones once, into the conformance
+        table, and return the cache keys of scenarios that did not conform.
+        """
+        checks = {}
+        keys = []
+        for scenario in self.scenarios:
+            name = scenario.function.__name__
+            arguments = validation_arguments(scenario.family, scenario.function_arguments)
+            key = (scenario.type, name, json.dumps(arguments, sort_keys=True))
+            checks[key] = (scenario.function, scenario.family, arguments)
+            keys.append(key)
+        print(f"Checking conformance of {len(checks)} backend, function and argument combinations")
+        results = run_conformance(checks, max_workers=len(self.cores))
+        rows = [
+            (cache_key, *key, results[key]["status"], results[key]["max_z"], results[key]["detail"])
+            for cache_key, key in zip(cache_keys, keys)
+        ]
+        con.execute(f"create or replace table conformance ({CONFORMANCE_SCHEMA})")
+        if rows:
+            con.executemany("insert into conformance values (?, ?, ?, ?, ?, ?, ?)", rows)
+        for key, result in results.items():
+            if result["status"] in ("failed", "error"):
+                print(f"{key[0]}.{key[1]} {key[2]} did not conform ({result['status']}): {result['detail']}")
+        return {row[0] for row in rows if row[4] in ("failed", "error")}
 
     def process_scenarios(self):
         print("Starting benchmarking!")
         con = duckdb.connect(str(benchmark_results_folder / f"{self.name}.duckdb"))
-        con.sql("""
-        create or replace table results (
+        # every finished scenario is kept in result_cache under its cache key (see cache.py), so
+        # an interrupted run picks up where it stopped and unchanged scenarios are not rerun
+        schema = """
+            cache_key text,
             type text,
             scenario_number integer,
             scenario_type text,
@@ -180,50 +907,129 @@ class Benchmark:
                 pi_calc map(integer, integer),
                 roulette_sim struct(turn_limit integer)
             ),
+            -- anything else passed to the function (seed, compact, chunk_size, ...) as json
+            extra_arguments text,
             profiler_arguments text,
             total_time double,
             result union(
                 time_result double[],
-                memory_result struct(function_iteration integer, data double[])[]
-            )
-        )
-        """)
-        for i, scenario in enumerate(self.scenarios):
-            p = scenario.to_process(self.queue)
-            print("Running scenario:")
-            print(scenario)
-            p.start()
-            p.join()
-            result, exec_time = self.queue.get()
-            print(f"Finished scenario in {exec_time} seconds")
-            print("Sleeping...")
-            time.sleep(3)
-            try:
-                num_samples = scenario.function_arguments.pop("num_samples")
-            except KeyError:
-                num_samples = None
-            try:
-                num_threads = scenario.function_arguments.pop("num_threads")
-            except KeyError:
-                num_threads = None
-            result_data = {
-                "type": [scenario.type],
-                "scenario_number": [i],
-                "scenario_type": [scenario.scenario_type.value],
-                "function": [scenario.function.__name__],
-                "num_samples": [num_samples],
-                "num_threads": [num_threads],
-                "function_arguments": [scenario.function_arguments],
-                "profiler_arguments": [scenario.profiler_arguments],
-                "total_time": [exec_time],
-                "result": [result],
-            }
-            scenario_result = pandas.DataFrame(result_data)
-            con.execute("insert into results select * from scenario_result")
+                -- data is resident MiB sampled at timestamps (seconds since the call started)
+                memory_result struct(
+                    function_iteration integer,
+                    data double[],
+                    timestamps double[],
+                    peak_rss double,
+                    traced_peak double
+                )[],
+                startup_result struct(
+                    function_iteration integer,
+                    library_import double,
+                    calculator_import double,
+                    first_call double,
+                    jit_compile double,
+                    second_call double,
+                    process_total double
+                )[],
+                -- times in seconds, counters are null where perf_event is unavailable
+                cpu_result struct(
+                    function_iteration integer,
+                    wall_time double,
+                    user_time double,
+                    system_time double,
+                    voluntary_switches bigint,
+                    involuntary_switches bigint,
+                    minor_faults bigint,
+                    major_faults bigint,
+                    peak_threads integer,
+                    cycles bigint,
+                    instructions bigint,
+                    cache_misses bigint,
+                    branch_misses bigint
+                )[]
+            ),
+            -- how the profiler decided it had enough runs (min_time, min_runs, max_runs,
+            -- converged or max_time), and how many leading runs it dropped as warm up
+            stop_reason text,
+            warmup_runs integer,
+            relative_ci double,
+            -- arrow ipc files of the function's output, for scenarios with retain_output
+            output_paths text[],
+            -- ok or over budget, stop_reason then says which: timeout, memory_limit or pruned
+            -- (a bigger size of a sweep that already went over budget, which was not run)
+            status text
+        """
+        con.execute(f"create table if not exists result_cache ({schema})")
+        con.execute(f"create or replace temporary table expected_schema ({schema})")
+        cached_columns = [column[:2] for column in con.execute("describe result_cache").fetchall()]
+        if cached_columns != [column[:2] for column in con.execute("describe expected_schema").fetchall()]:
+            print("Cached results were made with a different results schema, discarding them")
+            con.execute(f"create or replace table result_cache ({schema})")
+
+        cache_keys = [scenario.cache_key for scenario in self.scenarios]
+        non_conforming = set()
+        if self.conformance != "off":
+            non_conforming = self._check_conformance(con, cache_keys)
+        else:
+            con.execute(f"create table if not exists conformance ({CONFORMANCE_SCHEMA})")
+        # over budget scenarios are retried, budgets or code may have changed since
+        cached = {
+            key: output_paths
+            for key, output_paths in con.execute("select cache_key, output_paths from result_cache where status = 'ok'").fetchall()
+        }
+        # each run adds its measurements to the long format store (see store.py)
+        self._store = ResultStore(self.name)
+        self._store.start_run(con)
+        stored = self._store.stored_keys(con)
+        pending = []
+        for i, (scenario, key) in enumerate(zip(self.scenarios, cache_keys)):
+            if self.conformance == "exclude" and key in non_conforming:
+                print(f"Scenario {i} did not conform, skipping")
+            elif key in cached and not self.force and not (scenario.retain_output and not _outputs_exist(cached[key])):
+                print(f"Scenario {i} is cached, skipping")
+                # cached before the store existed
+                if key not in stored:
+                    self._store.append(con, key)
+            else:
+                pending.append((i, scenario))
+        running = {}
+        over_budget = []
+        # results come back as arrow files in here, only their paths go through the pipes
+        transport_folder = tempfile.TemporaryDirectory(prefix=f"{self.name}_")
+        self._transport_folder = pathlib.Path(transport_folder.name)
+        try:
+            with exit_on_termination():
+                self._run_pending(con, pending, running, over_budget, cache_keys)
+        finally:
+            # scenarios run in their own process groups, so they would outlive e.g. a ctrl-c here
+            for run in running.values():
+                if run["host"] is None:
+                    kill_scenario_process(run["process"])
+            # a worker kills the scenarios it is running when its coordinator goes away
+            for worker in self.workers or []:
+                worker.disconnect()
+            self._stop_warm_workers()
+            transport_folder.cleanup()
         print("Benchmarking done!")
         print("Outputting data...")
-        con.execute(f"copy (select * from results) to '{benchmark_results_folder}/{self.name}.csv'")
-        con.execute(f"copy (select * from results) to '{benchmark_results_folder}/{self.name}.parquet'")
+        # results only holds this suite's scenarios, numbered as in the yaml, whichever run made them,
+        # with the outcome of their latest conformance check
+        current = pa.table({"cache_key": pa.array(cache_keys, pa.string()), "current_number": list(range(len(cache_keys)))})
+        excluded = "where conformance.status is null or conformance.status not in ('failed', 'error')" if self.conformance == "exclude" else ""
+        con.execute(
+            f"""
+            create or replace table results as
+            select
+                result_cache.* replace (current.current_number as scenario_number),
+                conformance.status as conformance
+            from result_cache
+            inner join current using (cache_key)
+            left join conformance using (cache_key)
+            {excluded}
+            order by scenario_number
+            """
+        )
+        con.execute(f"copy (select * from results order by scenario_number) to '{benchmark_results_folder}/{self.name}.csv'")
+        con.execute(f"copy (select * from results order by scenario_number) to '{benchmark_results_folder}/{self.name}.parquet'")
         return
 
     def memory_benchmark():
@@ -233,10 +1039,10 @@ class Benchmark:
         pass
 
     @classmethod
-    def from_yaml(cls, scenario: str):
+    def from_yaml(cls, scenario: str, **kwargs):
         file = scenario_folder / (scenario+".yml")
         with open(file) as f:
             data = yaml.safe_load(f)
         cleaned_input = Scenario.extend_dict(data)
         scenarios = [Scenario.from_dict(d) for d in cleaned_input]
-        return cls(scenarios, name=scenario)
+        return cls(scenarios, name=scenario, **kwargs)
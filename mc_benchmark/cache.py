@@ -0,0 +1,118 @@
+import ast
+import functools
+import hashlib
+import importlib.metadata
+import importlib.util
+import inspect
+import json
+import pathlib
+import platform
+import sys
+import typing
+
+from mc_benchmark import queries_folder
+from mc_benchmark.calculators import parallel
+from mc_benchmark.calculators.parallel import ProcessPoolFunction
+
+LIBRARIES = ["numpy", "numba", "duckdb", "polars", "pyarrow", "pandas"]
+# the scenario runner and the profilers, a change to them changes what a result measured
+MEASUREMENT_MODULES = [
+    "mc_benchmark.benchmark",
+    "mc_benchmark.cpu",
+    "mc_benchmark.memory",
+    "mc_benchmark.startup",
+    "mc_benchmark.stopping",
+]
+
+
+@functools.lru_cache(maxsize=None)
+def library_versions() -> dict:
+    versions = {"python": platform.python_version()}
+    for library in LIBRARIES:
+        try:
+            versions[library] = importlib.metadata.version(library)
+        except importlib.metadata.PackageNotFoundError:
+            versions[library] = None
+    return versions
+
+
+def _module_file(name: str) -> typing.Optional[str]:
+    try:
+        spec = importlib.util.find_spec(name)
+    except ModuleNotFoundError:
+        return None
+    return spec.origin if spec is not None else None
+
+
+@functools.lru_cache(maxsize=None)
+def _imported_modules(name: str) -> tuple[str, ...]:
+    """The mc_benchmark modules module name imports directly, from its source so nothing gets imported."""
+    tree = ast.parse(pathlib.Path(_module_file(name)).read_text())
+    imported = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imported.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module is not None:
+            is_package = (_module_file(node.module) or "").endswith("__init__.py")
+            for alias in node.names:
+                # from mc_benchmark.calculators import elo imports a module, not a name
+                submodule = f"{node.module}.{alias.name}"
+                imported.add(submodule if is_package and _module_file(submodule) is not None else node.module)
+    return tuple(sorted(m for m in imported if m.split(".")[0] == "mc_benchmark" and _module_file(m) is not None))
+
+
+def module_sources(names: list[str]) -> str:
+    """The source of modules names and of every mc_benchmark module they import, directly or not."""
+    seen, stack = set(), list(names)
+    while stack:
+        name = stack.pop()
+        if name not in seen:
+            seen.add(name)
+            stack.extend(_imported_modules(name))
+    return "".join(pathlib.Path(_module_file(name)).read_text() for name in sorted(seen))
+
+
+def _is_query(function) -> bool:
+    # a PreparedQuery only exists once duckdb_calculator is imported, so that is not imported to check
+    module = sys.modules.get("mc_benchmark.calculators.duckdb_calculator")
+    return module is not None and isinstance(function, module.PreparedQuery)
+
+
+def function_source(function: typing.Callable) -> str:
+    """
+    The source a scenario's result depends on. For calculator methods this is their whole module and
+    the mc_benchmark modules it imports (e.g. elo.py, or numpy_calculator's helpers for numba), so a
+    change to a shared helper invalidates every backend using it but no other.
+    """
+    if _is_query(function):
+        sql = (queries_folder / f"{function.query}.sql").read_text()
+        return sql + module_sources([type(function).__module__])
+    if isinstance(function, ProcessPoolFunction):
+        settings = f"{function.num_processes} {function.merge} {function.seed}"
+        return settings + inspect.getsource(parallel) + function_source(function.function)
+    return module_sources([inspect.getmodule(function).__name__])
+
+
+@functools.lru_cache(maxsize=None)
+def measurement_source() -> str:
+    return "".join(pathlib.Path(_module_file(name)).read_text() for name in MEASUREMENT_MODULES)
+
+
+def scenario_key(
+        type: str,
+        function: typing.Callable,
+        function_arguments: dict,
+        scenario_type: str,
+        profiler_arguments: dict,
+    ) -> str:
+    key = {
+        "type": type,
+        "function": function.__name__,
+        "source": hashlib.sha256(function_source(function).encode()).hexdigest(),
+        "measurement": hashlib.sha256(measurement_source().encode()).hexdigest(),
+        "function_arguments": function_arguments,
+        "scenario_type": scenario_type,
+        "profiler_arguments": profiler_arguments,
+        "libraries": library_versions(),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
@@ -1,4 +1,68 @@
-from mc_benchmark.calculators.duckdb_calculator import DuckDBCalculator
-from mc_benchmark.calculators.numpy_calculator import NumpyCalculator
-from mc_benchmark.calculators.numba_calculator import NumbaCalculator
-from mc_benchmark.calculators.polars_calculator import PolarsCalculator
+"""
+Calculators by scenario type, imported on first use so a suite only pays for the backends it runs.
+
+Other packages add calculators with an entry point in the mc_benchmark.calculators group, named by
+the scenario type, e.g. in their pyproject.toml:
+
+    [tool.poetry.plugins."mc_benchmark.calculators"]
+    jax = "my_package.jax_calculator:JaxCalculator"
+
+after which scenarios can use type: jax. Built in types take precedence over entry points.
+"""
+import functools
+import importlib
+import importlib.metadata
+
+ENTRY_POINT_GROUP = "mc_benchmark.calculators"
+
+# scenario type -> module:class
+CALCULATORS = {
+    "duckdb": "mc_benchmark.calculators.duckdb_calculator:DuckDBCalculator",
+    "numpy": "mc_benchmark.calculators.numpy_calculator:NumpyCalculator",
+    "numba": "mc_benchmark.calculators.numba_calculator:NumbaCalculator",
+    "polars": "mc_benchmark.calculators.polars_calculator:PolarsCalculator",
+    "exact": "mc_benchmark.calculators.exact_calculator:ExactCalculator",
+}
+
+# the package's other public names, also imported on first use
+_LAZY_NAMES = {
+    **{path.rpartition(":")[2]: path for path in CALCULATORS.values()},
+    "PreparedQuery": "mc_benchmark.calculators.duckdb_calculator:PreparedQuery",
+}
+
+
+def _load(path: str):
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+@functools.lru_cache(maxsize=None)
+def _entry_points() -> dict:
+    entry_points = importlib.metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        group = entry_points.select(group=ENTRY_POINT_GROUP)
+    else:
+        # python 3.9 returns a dict of groups
+        group = entry_points.get(ENTRY_POINT_GROUP, [])
+    return {entry_point.name: entry_point for entry_point in group}
+
+
+def calculator_types() -> list[str]:
+    """Every scenario type that has a calculator, built in or from an entry point."""
+    return sorted({*CALCULATORS, *_entry_points()})
+
+
+@functools.lru_cache(maxsize=None)
+def get_calculator(type: str):
+    """The calculator class of a scenario type, importing its module if need be."""
+    if type in CALCULATORS:
+        return _load(CALCULATORS[type])
+    if type in _entry_points():
+        return _entry_points()[type].load()
+    raise ValueError(f"Unknown calculator type {type}, expected one of {', '.join(calculator_types())}.")
+
+
+def __getattr__(name: str):
+    if name in _LAZY_NAMES:
+        return _load(_LAZY_NAMES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
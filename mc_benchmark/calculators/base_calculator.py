@@ -1,18 +1,21 @@
-from abc import ABC, abstractmethod
+from abc import ABC
 
 class BaseCalculator(ABC):
+    """
+    The functions a calculator type can provide, all static methods. A calculator implements the
+    ones its backend has, the others raise NotImplementedError (e.g. exact has no pi or elo).
+    """
+    # the library a calculator is built on, imported on its own first by startup scenarios
+    LIBRARY = None
 
     @staticmethod
-    @abstractmethod
     def pi_calculator():
         raise NotImplementedError
 
     # @staticmethod
-    # @abstractmethod
     # def casino_simulation():
     #     raise NotImplementedError
 
-    # @staticmethod
-    # @abstractmethod
-    # def elo_calculator():
-    #     raise NotImplementedError
+    @staticmethod
+    def elo_calculator():
+        raise NotImplementedError
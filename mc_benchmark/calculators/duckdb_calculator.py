@@ -1,10 +1,125 @@
 import concurrent.futures
+import itertools
+import typing
 
 import duckdb
 
+from mc_benchmark import queries_folder
+from mc_benchmark.calculators import elo
 from mc_benchmark.calculators.base_calculator import BaseCalculator
+from mc_benchmark.calculators.parallel import split_samples
+
+
+def _connect(num_threads: int = 1, memory_limit: typing.Optional[str] = None):
+    # one database instance per call, so every query below shares duckdb's
+    # own task scheduler and buffer manager instead of competing instances
+    con = duckdb.connect()
+    con.execute(f"set threads = {num_threads}")
+    if memory_limit is not None:
+        con.execute(f"set memory_limit = '{memory_limit}'")
+    return con
+
+
+def _create_elo_macros(con: duckdb.DuckDBPyConnection):
+    # elo.prob_win and elo.prob_draw as sql macros; python udfs called from the
+    # round queries could deadlock duckdb's worker threads on the gil
+    con.execute(
+        f"""
+        create or replace macro expected_score(elo, opponent_elo) as
+            1 / (1 + pow(10, (opponent_elo - elo) / 400));
+        create or replace macro prob_draw(elo, opponent_elo) as
+            {elo.MAX_DRAW_PROBABILITY} * (1 - abs(2 * expected_score(elo, opponent_elo) - 1));
+        create or replace macro prob_win(elo, opponent_elo) as
+            expected_score(elo, opponent_elo) - prob_draw(elo, opponent_elo) / 2;
+        """
+    )
+
+
+def _casino_window_query(num_samples: int, turn_limit: int, starting_value: int, win_loss_diff: int):
+    # every sample is an independent partition, so duckdb can spread the
+    # window computation over its threads (unlike the recursive cte, which
+    # has to iterate turn by turn)
+    return f"""
+    with steps as (
+        select
+            samples.range + 1 as sample,
+            turns.range as turn,
+            case
+                when turns.range = 0 then 0
+                when floor(random() * (37)) >= 19 then {win_loss_diff}
+                else -{win_loss_diff}
+            end as value_diff
+        from range({num_samples}) as samples
+        cross join range({turn_limit} + 1) as turns
+    ),
+
+    walk as (
+        select
+            sample,
+            turn,
+            {starting_value} + cast(sum(value_diff) over w as bigint) as value
+        from steps
+        window w as (partition by sample order by turn rows between unbounded preceding and current row)
+    ),
+
+    casino as (
+        select
+            sample,
+            turn,
+            -- once a sample has hit 0 it stays there
+            case when min(value) over w <= 0 then 0 else value end as value
+        from walk
+        window w as (partition by sample order by turn rows between unbounded preceding and current row)
+    )
+    """
+
+def _sql_literal(value):
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return repr(value)
+
+
+class PreparedQuery:
+    """
+    Run a sql file from queries/ as a prepared statement.
+
+    query is the file's path under queries/ without the .sql suffix, e.g. "roulette/reccte".
+    Templates take named parameters ($num_samples, $turn_limit, ...) that are filled from the
+    function arguments, apart from num_threads which is a connection setting. prepare() plans the
+    statement once per connection, after which a call only runs EXECUTE.
+    """
+    def __init__(self, query: str, memory_limit: typing.Optional[str] = None) -> None:
+        self.query = query
+        self.memory_limit = memory_limit
+        self.__name__ = query
+        self._con = None
+        self._num_threads = None
+
+    def __getstate__(self):
+        return {**self.__dict__, "_con": None, "_num_threads": None}
+
+    def prepare(self, num_threads: int = 1):
+        if self._con is None:
+            sql = (queries_folder / f"{self.query}.sql").read_text().strip().rstrip(";")
+            self._con = _connect(num_threads, self.memory_limit)
+            self._num_threads = num_threads
+            self._con.execute(f"prepare query as {sql}")
+        elif num_threads != self._num_threads:
+            self._con.execute(f"set threads = {num_threads}")
+            self._num_threads = num_threads
+        return self._con
+
+    def __call__(self, num_threads: int = 1, **parameters):
+        con = self.prepare(num_threads)
+        arguments = ", ".join(f"{k} := {_sql_literal(v)}" for k, v in parameters.items())
+        return con.execute(f"execute query({arguments})").arrow()
+
 
 class DuckDBCalculator(BaseCalculator):
+    LIBRARY = "duckdb"
+
     @staticmethod
     def pi_calculator(num_samples: int = 1000, num_threads: int = 1):
         if num_threads == 1:
@@ -27,8 +142,8 @@ class DuckDBCalculator(BaseCalculator):
             with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
                 # Using a dictionary comprehension to map future to its sequence number
                 future_to_number = {
-                    executor.submit(_run_query, num_samples // num_threads): number
-                    for number in range(1, num_threads + 1)
+                    executor.submit(_run_query, samples): number
+                    for number, samples in enumerate(split_samples(num_samples, num_threads), start=1)
                 }
 
                 dict_data = {}
@@ -49,6 +164,22 @@ class DuckDBCalculator(BaseCalculator):
             ).arrow()
         return data[0][0].as_py()
 
+    @staticmethod
+    def pi_calculator_native(num_samples: int = 1000, num_threads: int = 1, memory_limit: typing.Optional[str] = None):
+        con = _connect(num_threads, memory_limit)
+        # a range() is scanned by a single thread, so range(num_samples) is a union of one range per
+        # thread: each is its own pipeline, which duckdb's scheduler runs on its threads in parallel
+        bounds = [0, *itertools.accumulate(split_samples(num_samples, num_threads))]
+        ranges = " union all ".join(f"select range from range({start}, {stop})" for start, stop in zip(bounds, bounds[1:]))
+        num_in_circle = con.execute(
+            f"""
+            select count(*) filter (where random()**2 + random()**2 < 1) as num_in_circle
+            from ({ranges})
+            """
+        ).fetchone()[0]
+        con.close()
+        return 4 * num_in_circle / num_samples
+
 
     @staticmethod
     def casino_simulation(num_samples: int = 1000, turn_limit: int = 1000, starting_value: int = 1000, win_loss_diff: int = 10):
@@ -65,7 +196,8 @@ class DuckDBCalculator(BaseCalculator):
                     casino.sample,
                     case
                         when casino.value = 0 then 0
-                    else casino.value + (case when floor(random() * (37)) >= 19 then {win_loss_diff} else -{win_loss_diff} end)
+                    -- a bet bigger than what is left takes it to 0, not below
+                    else greatest(casino.value + (case when floor(random() * (37)) >= 19 then {win_loss_diff} else -{win_loss_diff} end), 0)
                     end as value,
                     casino.turn + 1 as turn
                 from casino
@@ -92,7 +224,8 @@ class DuckDBCalculator(BaseCalculator):
                     casino.sample,
                     case
                         when casino.value = 0 then 0
-                    else casino.value + (case when floor(random() * (37)) >= 19 then {win_loss_diff} else -{win_loss_diff} end)
+                    -- a bet bigger than what is left takes it to 0, not below
+                    else greatest(casino.value + (case when floor(random() * (37)) >= 19 then {win_loss_diff} else -{win_loss_diff} end), 0)
                     end as value,
                     casino.turn + 1 as turn
                 from casino
@@ -113,11 +246,54 @@ class DuckDBCalculator(BaseCalculator):
         ).arrow()
         return data
 
+    @staticmethod
+    def casino_simulation_aggregated_active_set(num_samples: int = 1000, turn_limit: int = 1000, starting_value: int = 1000, win_loss_diff: int = 10):
+        data = duckdb.execute(
+            f"""
+            with recursive casino as (
+                select
+                    generate_series as sample,
+                    {starting_value} as value,
+                    0 as turn
+                from generate_series(1, {num_samples})
+                union all
+                select
+                    casino.sample,
+                    casino.value + (case when floor(random() * (37)) >= 19 then {win_loss_diff} else -{win_loss_diff} end) as value,
+                    casino.turn + 1 as turn
+                from casino
+                -- busted samples stop recursing, they are 0 from here on
+                where casino.value > 0 and casino.turn < {turn_limit}
+            ),
+
+            turn_sums as (
+                select
+                    turn,
+                    sum(greatest(value, 0)) as value_sum,
+                    sum(greatest(value, 0)**2) as value_sum_sq
+                from casino
+                group by all
+            )
+
+            -- every sample missing from a turn is a busted one, worth 0
+            select
+                turns.range as turn,
+                coalesce(value_sum, 0) / {num_samples} as avg_value,
+                sqrt(
+                    (coalesce(value_sum_sq, 0)/{num_samples} - (coalesce(value_sum, 0) / {num_samples})**2)/{num_samples}
+                ) as avg_value_error
+            from range({turn_limit} + 1) as turns
+            left join turn_sums on turn_sums.turn = turns.range
+            order by turn asc
+            """
+        ).arrow()
+        return data
+
     @staticmethod
     def casino_simulation_window_function(num_samples: int = 1000, turn_limit: int = 1000, starting_value: int = 1000, win_loss_diff: int = 10):
         data = duckdb.execute(
             f"""
-            with casino as (
+            with walk as (
                 select
                     samples.generate_series as sample,
                     turns.generate_series as turn,
@@ -128,6 +304,15 @@ class DuckDBCalculator(BaseCalculator):
                     ) as value
                 from generate_series(1, {num_samples}) as samples
                 cross join generate_series(1, {turn_limit}) as turns
+            ),
+
+            casino as (
+                select
+                    sample,
+                    turn,
+                    -- 0 from the first turn the walk gets to 0
+                    case when min(value) over (partition by sample order by turn) <= 0 then 0 else value end as value
+                from walk
             )
 
             select
@@ -142,7 +327,91 @@ class DuckDBCalculator(BaseCalculator):
         return data
 
 
+    @staticmethod
+    def casino_simulation_native(
+        num_samples: int = 1000,
+        turn_limit: int = 1000,
+        starting_value: int = 1000,
+        win_loss_diff: int = 10,
+        num_threads: int = 1,
+        memory_limit: typing.Optional[str] = None,
+    ):
+        con = _connect(num_threads, memory_limit)
+        data = con.execute(
+            f"""
+            {_casino_window_query(num_samples, turn_limit, starting_value, win_loss_diff)}
+
+            select * from casino
+            """
+        ).arrow()
+        con.close()
+        return data
+
+    @staticmethod
+    def casino_simulation_aggregated_native(
+        num_samples: int = 1000,
+        turn_limit: int = 1000,
+        starting_value: int = 1000,
+        win_loss_diff: int = 10,
+        num_threads: int = 1,
+        memory_limit: typing.Optional[str] = None,
+    ):
+        con = _connect(num_threads, memory_limit)
+        data = con.execute(
+            f"""
+            {_casino_window_query(num_samples, turn_limit, starting_value, win_loss_diff)}
 
-# TODO: threaded version(s)
-    
-    # how can we make it so that aggregated version is summable easily on the way out
+            select
+                turn,
+                avg(value) as avg_value,
+                sqrt(
+                    (sum(value*value)/count(*) - avg(value)**2)/count(*)
+                ) as avg_value_error
+            from casino
+            group by all
+            order by turn asc
+            """
+        ).arrow()
+        con.close()
+        return data
+
+    @staticmethod
+    def elo_calculator(num_samples: int = 1000, num_players: int = 200, num_rounds: int = 6):
+        con = duckdb.connect()
+        _create_elo_macros(con)
+
+        con.execute(
+            f"""
+            create table players as
+            select
+                samples.range as tournament,
+                players.range as player_id,
+                {elo.INITIAL_ELO} + random() * {elo.ELO_RANGE} as elo,
+                cast(0 as double) as score
+            from range({num_samples}) as samples
+            cross join range({num_players}) as players
+            """
+        )
+
+        round_query = (queries_folder / "chess" / "lead_grouping.sql").read_text()
+        for _ in range(num_rounds):
+            con.execute(
+                f"""
+                create or replace table players as
+                with score_diffs as (
+                    {round_query}
+                )
+
+                select
+                    players.tournament,
+                    players.player_id,
+                    players.elo,
+                    players.score + score_diffs.score_diff as score
+                from players
+                inner join score_diffs using (tournament, player_id)
+                """
+            )
+
+        data = con.execute("select * from players order by tournament, player_id").arrow()
+        con.close()
+        return data
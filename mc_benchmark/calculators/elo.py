@@ -0,0 +1,34 @@
+"""
+Game model shared by the elo_calculator implementations.
+
+Players start with an elo drawn uniformly from [INITIAL_ELO, INITIAL_ELO + ELO_RANGE). Each round
+of a Swiss tournament sorts players by score then elo, splits every score group in half and pairs
+the i-th player of the top half with the i-th player of the bottom half; an unpaired player gets a
+bye worth a win. These functions work elementwise on floats, numpy arrays and polars expressions,
+so they can also be jitted by numba; duckdb has them as sql macros (see duckdb_calculator).
+"""
+import numpy as np
+
+INITIAL_ELO = 800
+ELO_RANGE = 400
+# chance of a draw between two equally rated players
+MAX_DRAW_PROBABILITY = 0.3
+
+
+def expected_score(elo, opponent_elo):
+    return 1 / (1 + 10 ** ((opponent_elo - elo) / 400))
+
+
+# prob_draw and prob_win repeat the expected score formula rather than calling
+# expected_score, so numba can compile them on their own
+
+def prob_draw(elo, opponent_elo):
+    # draws get less likely the more lopsided the game
+    score = 1 / (1 + 10 ** ((opponent_elo - elo) / 400))
+    return MAX_DRAW_PROBABILITY * (1 - np.abs(2 * score - 1))
+
+
+def prob_win(elo, opponent_elo):
+    # keeps win + draw / 2 equal to the expected score
+    score = 1 / (1 + 10 ** ((opponent_elo - elo) / 400))
+    return score - MAX_DRAW_PROBABILITY * (1 - np.abs(2 * score - 1)) / 2
@@ -0,0 +1,67 @@
+import numpy as np
+
+from mc_benchmark.calculators.base_calculator import BaseCalculator
+
+# a spin wins on 18 of the 37 pockets, as in the simulations' outcomes >= 19 of randint(0, 37)
+WIN_PROBABILITY = 18 / 37
+
+
+def casino_value_distributions(turn_limit: int = 1000, starting_value: int = 1000, win_loss_diff: int = 10):
+    """
+    Yield (values, probabilities) of the casino value at each turn, turn 0 included, for
+    turn_limit turns. values are the solvent values starting_value + win_loss_diff * m; the
+    missing probability is that of having gone bust (value 0, absorbing).
+    """
+    # solvent states, from the lowest value above 0 to the highest reachable one
+    lowest = -((starting_value - 1) // win_loss_diff) if starting_value > 0 else 1
+    values = starting_value + win_loss_diff * np.arange(lowest, turn_limit + 1, dtype=np.float64)
+    probabilities = np.zeros(len(values))
+    if starting_value > 0:
+        probabilities[-lowest] = 1.0
+    for turn in range(turn_limit):
+        yield values, probabilities
+        # only states within turn steps of the start can hold probability
+        first = max(-lowest - turn - 1, 0)
+        last = min(-lowest + turn + 2, len(values))
+        window = probabilities[first:last].copy()
+        probabilities[first:last] = 0.0
+        probabilities[first + 1:last] += WIN_PROBABILITY * window[:last - first - 1]
+        # the lowest state's losses go bust and leave the vector
+        probabilities[first:last - 1] += (1 - WIN_PROBABILITY) * window[1:]
+
+
+def casino_value_moments(turn_limit: int = 1000, starting_value: int = 1000, win_loss_diff: int = 10):
+    """Mean and standard deviation of the casino value at each turn, turn 0 included."""
+    means = np.empty(turn_limit)
+    deviations = np.empty(turn_limit)
+    for turn, (values, probabilities) in enumerate(casino_value_distributions(turn_limit, starting_value, win_loss_diff)):
+        mean = probabilities @ values
+        # bust samples are 0, (0 - mean) ** 2 weighted by the bust probability
+        variance = probabilities @ np.square(values - mean) + (1 - probabilities.sum()) * mean**2
+        means[turn] = mean
+        deviations[turn] = np.sqrt(max(variance, 0.0))
+    return means, deviations
+
+
+class ExactCalculator(BaseCalculator):
+    """
+    Exact results of the models that have them, computed instead of simulated, as a reference for
+    the other backends. num_samples only sets the standard error the simulations would have.
+    """
+
+    # no library of its own, importing numpy is part of importing the calculator
+    LIBRARY = None
+
+    @staticmethod
+    def casino_simulation_aggregated(
+        num_samples=1,
+        turn_limit=1000,
+        starting_value=1000,
+        win_loss_diff=10,
+    ):
+        # the casino is a gambler's ruin random walk: iterate its value distribution turn by turn,
+        # O(turn_limit * states) whatever num_samples is
+        avg_values, deviations = casino_value_moments(turn_limit, starting_value, win_loss_diff)
+        sem = deviations / np.sqrt(num_samples)
+
+        return np.column_stack((np.arange(turn_limit), avg_values, np.full(turn_limit, num_samples), sem))
@@ -1,15 +1,401 @@
 import random
 import math
+import os
 
 import numba as nb
 import numpy as np
 
+from mc_benchmark.calculators import elo
 from mc_benchmark.calculators.base_calculator import BaseCalculator
+from mc_benchmark.calculators.numpy_calculator import (
+    DEFAULT_QMC_REPLICATES,
+    WIN_PROBABILITY_BITS,
+    _WIN_THRESHOLD,
+    check_pi_arguments,
+    compact_value_dtype,
+    pi_from_qmc_replicates,
+)
+
+# MC_BENCHMARK_NUMBA_CACHE=1 caches compiled functions on disk (under NUMBA_CACHE_DIR if set),
+# so a new process loads them instead of compiling, see the startup scenario type
+NUMBA_CACHE = os.environ.get("MC_BENCHMARK_NUMBA_CACHE", "0") == "1"
+
+# points per independently seeded block in the parallel pi kernel
+PI_BLOCK_SIZE = 1 << 16
+
+
+@nb.njit(inline="always", cache=NUMBA_CACHE)
+def _splitmix64(state):
+    # small counter based generator, so every sample / block gets its own stream
+    # and results do not depend on how prange schedules work across threads
+    state = state + np.uint64(0x9E3779B97F4A7C15)
+    z = state
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return state, z ^ (z >> np.uint64(31))
+
+
+@nb.njit(inline="always", cache=NUMBA_CACHE)
+def _stream_state(seed, stream):
+    state, _ = _splitmix64(np.uint64(seed) + np.uint64(stream) * np.uint64(0xD1B54A32D192ED03))
+    return state
+
+
+@nb.njit(inline="always", cache=NUMBA_CACHE)
+def _to_uniform(z):
+    # top 53 bits -> float in [0, 1)
+    return (z >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+
+@nb.njit(parallel=True, cache=NUMBA_CACHE)
+def _pi_kernel(num_samples, seed):
+    num_blocks = (num_samples + PI_BLOCK_SIZE - 1) // PI_BLOCK_SIZE
+    num_in_circle = 0
+    for block in nb.prange(num_blocks):
+        state = _stream_state(seed, block)
+        block_in_circle = 0
+        for _ in range(block * PI_BLOCK_SIZE, min(num_samples, (block + 1) * PI_BLOCK_SIZE)):
+            state, z = _splitmix64(state)
+            x = _to_uniform(z)
+            state, z = _splitmix64(state)
+            y = _to_uniform(z)
+            if x * x + y * y < 1:
+                block_in_circle += 1
+        num_in_circle += block_in_circle
+    return 4 * num_in_circle / num_samples
+
+
+@nb.njit(parallel=True, cache=NUMBA_CACHE)
+def _pi_antithetic_kernel(num_pairs, seed):
+    num_blocks = (num_pairs + PI_BLOCK_SIZE - 1) // PI_BLOCK_SIZE
+    total = 0.0
+    total_squares = 0.0
+    for block in nb.prange(num_blocks):
+        state = _stream_state(seed, block)
+        block_total = 0.0
+        block_squares = 0.0
+        for _ in range(block * PI_BLOCK_SIZE, min(num_pairs, (block + 1) * PI_BLOCK_SIZE)):
+            state, z = _splitmix64(state)
+            x = _to_uniform(z)
+            state, z = _splitmix64(state)
+            y = _to_uniform(z)
+            pair = 0.0
+            if x * x + y * y < 1:
+                pair += 0.5
+            if (1 - x) * (1 - x) + (1 - y) * (1 - y) < 1:
+                pair += 0.5
+            block_total += pair
+            block_squares += pair * pair
+        total += block_total
+        total_squares += block_squares
+    mean = total / num_pairs
+    variance = (total_squares - num_pairs * mean * mean) / (num_pairs - 1)
+    return 4 * mean, 4 * math.sqrt(variance / num_pairs)
+
+
+@nb.njit(parallel=True, cache=NUMBA_CACHE)
+def _pi_stratified_kernel(k, seed):
+    # two points in each cell of a k by k grid, a stream per row of cells
+    inside = 0
+    different = 0
+    for row in nb.prange(k):
+        state = _stream_state(seed, row)
+        row_inside = 0
+        row_different = 0
+        for column in range(k):
+            cell_inside = 0
+            for _ in range(2):
+                state, z = _splitmix64(state)
+                x = (row + _to_uniform(z)) / k
+                state, z = _splitmix64(state)
+                y = (column + _to_uniform(z)) / k
+                if x * x + y * y < 1:
+                    cell_inside += 1
+            row_inside += cell_inside
+            if cell_inside == 1:
+                row_different += 1
+        inside += row_inside
+        different += row_different
+    cells = k * k
+    return 4 * inside / (2 * cells), 2 * math.sqrt(different) / cells
+
+
+@nb.njit(inline="always", cache=NUMBA_CACHE)
+def _radical_inverse_step(digits, numerator, weights, base):
+    # the next index's radical inverse, as numerator / base ** len(weights): add one to the lowest
+    # digit and carry, which mirrored around the point is adding the digit's weight
+    digit = 0
+    while digits[digit] == base - 1:
+        digits[digit] = 0
+        numerator -= (base - 1) * weights[digit]
+        digit += 1
+    digits[digit] += 1
+    return numerator + weights[digit]
+
+
+@nb.njit(cache=NUMBA_CACHE)
+def _radical_inverse_weights(base):
+    # as many digits as fit in an int64 numerator
+    num_digits = int(math.log(2.0**62) / math.log(base))
+    weights = np.empty(num_digits, dtype=np.int64)
+    weight = 1
+    for digit in range(num_digits - 1, -1, -1):
+        weights[digit] = weight
+        weight *= base
+    return weights, float(weight)
+
+
+@nb.njit(cache=NUMBA_CACHE)
+def _sobol_directions():
+    # direction numbers of both dimensions, the second from the primitive polynomial x + 1
+    directions = np.empty((2, 64), dtype=np.uint64)
+    second = np.uint64(1) << np.uint64(63)
+    for bit in range(64):
+        directions[0, bit] = np.uint64(1) << np.uint64(63 - bit)
+        directions[1, bit] = second
+        second ^= second >> np.uint64(1)
+    return directions
+
+
+@nb.njit(parallel=True, cache=NUMBA_CACHE)
+def _pi_qmc_kernel(points_per_replicate, num_replicates, sobol, seed):
+    # every replicate is the same point set under its own random shift
+    directions = _sobol_directions()
+    weights_2, denominator_2 = _radical_inverse_weights(2)
+    weights_3, denominator_3 = _radical_inverse_weights(3)
+    counts = np.zeros(num_replicates, dtype=np.int64)
+    for replicate in nb.prange(num_replicates):
+        state = _stream_state(seed, replicate)
+        state, z = _splitmix64(state)
+        shift_x = _to_uniform(z)
+        state, z = _splitmix64(state)
+        shift_y = _to_uniform(z)
+        count = 0
+        sobol_x = np.uint64(0)
+        sobol_y = np.uint64(0)
+        digits_2 = np.zeros(len(weights_2), dtype=np.int64)
+        digits_3 = np.zeros(len(weights_3), dtype=np.int64)
+        halton_x = 0
+        halton_y = 0
+        for index in range(points_per_replicate):
+            if sobol:
+                # gray code order: each point differs from the last in the direction of the lowest set
+                # bit, the same points as numpy_calculator.sobol_points
+                x = (_to_uniform(sobol_x) + shift_x) % 1.0
+                y = (_to_uniform(sobol_y) + shift_y) % 1.0
+                bit = 0
+                while (index >> bit) & 1:
+                    bit += 1
+                sobol_x ^= directions[0, bit]
+                sobol_y ^= directions[1, bit]
+            else:
+                x = (halton_x / denominator_2 + shift_x) % 1.0
+                y = (halton_y / denominator_3 + shift_y) % 1.0
+                halton_x = _radical_inverse_step(digits_2, halton_x, weights_2, 2)
+                halton_y = _radical_inverse_step(digits_3, halton_y, weights_3, 3)
+            if x * x + y * y < 1:
+                count += 1
+        counts[replicate] = count
+    return counts
+
+
+@nb.njit(inline="always", cache=NUMBA_CACHE)
+def _casino_turn(value, state, win_loss_diff):
+    if value > 0:
+        state, z = _splitmix64(state)
+        # roll in [0, 37), 18 winning numbers
+        if int(_to_uniform(z) * 37) >= 19:
+            value += win_loss_diff
+        else:
+            value -= win_loss_diff
+        if value < 0:
+            value = 0
+    return value, state
+
+
+@nb.njit(parallel=True, cache=NUMBA_CACHE)
+def _casino_kernel(num_samples, turn_limit, starting_value, win_loss_diff, seed):
+    values = np.empty((num_samples, turn_limit + 1), dtype=np.int64)
+    for sample in nb.prange(num_samples):
+        state = _stream_state(seed, sample)
+        value = starting_value
+        values[sample, 0] = value
+        for turn in range(1, turn_limit + 1):
+            value, state = _casino_turn(value, state, win_loss_diff)
+            values[sample, turn] = value
+    return values
+
+
+@nb.njit(parallel=True, cache=NUMBA_CACHE)
+def _casino_aggregated_kernel(num_samples, turn_limit, starting_value, win_loss_diff, seed, num_blocks):
+    # one row of partial sums per block, reduced after the parallel loop.
+    # integer sums keep the result independent of the block layout.
+    sums = np.zeros((num_blocks, turn_limit + 1), dtype=np.int64)
+    sums_sq = np.zeros((num_blocks, turn_limit + 1), dtype=np.int64)
+    block_size = (num_samples + num_blocks - 1) // num_blocks
+    for block in nb.prange(num_blocks):
+        for sample in range(block * block_size, min(num_samples, (block + 1) * block_size)):
+            state = _stream_state(seed, sample)
+            value = starting_value
+            sums[block, 0] += value
+            sums_sq[block, 0] += value * value
+            for turn in range(1, turn_limit + 1):
+                value, state = _casino_turn(value, state, win_loss_diff)
+                sums[block, turn] += value
+                sums_sq[block, turn] += value * value
+    return sums.sum(axis=0), sums_sq.sum(axis=0)
+
+
+@nb.njit(parallel=True, cache=NUMBA_CACHE)
+def _casino_active_set_kernel(num_samples, turn_limit, starting_value, win_loss_diff, seed, num_blocks):
+    # like _casino_aggregated_kernel, but a sample stops being simulated on the
+    # turn it goes bust: every later turn would only add 0 to the sums
+    sums = np.zeros((num_blocks, turn_limit + 1), dtype=np.int64)
+    sums_sq = np.zeros((num_blocks, turn_limit + 1), dtype=np.int64)
+    block_size = (num_samples + num_blocks - 1) // num_blocks
+    for block in nb.prange(num_blocks):
+        for sample in range(block * block_size, min(num_samples, (block + 1) * block_size)):
+            state = _stream_state(seed, sample)
+            value = starting_value
+            sums[block, 0] += value
+            sums_sq[block, 0] += value * value
+            for turn in range(1, turn_limit + 1):
+                value, state = _casino_turn(value, state, win_loss_diff)
+                if value == 0:
+                    break
+                sums[block, turn] += value
+                sums_sq[block, turn] += value * value
+    return sums.sum(axis=0), sums_sq.sum(axis=0)
+
+
+@nb.njit(inline="always", cache=NUMBA_CACHE)
+def _packed_wins(state):
+    # 64 Bernoulli(18/37) spins in one word, built from raw random words
+    # (see numpy_calculator._packed_wins)
+    wins = np.uint64(0)
+    for bit in range(WIN_PROBABILITY_BITS):
+        state, z = _splitmix64(state)
+        if (_WIN_THRESHOLD >> bit) & 1:
+            wins |= z
+        else:
+            wins &= z
+    return state, wins
+
+
+@nb.njit(inline="always", cache=NUMBA_CACHE)
+def _casino_compact_sample(sample, turn_limit, starting_value, win_loss_diff, seed, out):
+    # writes turns 0..turn_limit of one sample into out, which can be any integer dtype
+    state = _stream_state(seed, sample)
+    value = starting_value
+    out[0] = value
+    for first_turn in range(1, turn_limit + 1, 64):
+        block = min(64, turn_limit + 1 - first_turn)
+        if value == 0:
+            out[first_turn:first_turn + block] = 0
+            continue
+        state, wins = _packed_wins(state)
+        for bit in range(block):
+            if value > 0:
+                if (wins >> np.uint64(bit)) & np.uint64(1):
+                    value += win_loss_diff
+                else:
+                    value -= win_loss_diff
+                if value < 0:
+                    value = 0
+            out[first_turn + bit] = value
+
+
+@nb.njit(parallel=True, cache=NUMBA_CACHE)
+def _casino_compact_kernel(turn_limit, starting_value, win_loss_diff, seed, values):
+    for sample in nb.prange(values.shape[0]):
+        _casino_compact_sample(sample, turn_limit, starting_value, win_loss_diff, seed, values[sample])
+    return values
+
+
+@nb.njit(parallel=True, cache=NUMBA_CACHE)
+def _casino_aggregated_compact_kernel(num_samples, turn_limit, starting_value, win_loss_diff, seed, scratch):
+    # scratch holds one narrow row per block, so nothing of size num_samples x turn_limit is allocated
+    num_blocks = scratch.shape[0]
+    sums = np.zeros((num_blocks, turn_limit + 1), dtype=np.int64)
+    sums_sq = np.zeros((num_blocks, turn_limit + 1), dtype=np.int64)
+    block_size = (num_samples + num_blocks - 1) // num_blocks
+    for block in nb.prange(num_blocks):
+        row = scratch[block]
+        for sample in range(block * block_size, min(num_samples, (block + 1) * block_size)):
+            _casino_compact_sample(sample, turn_limit, starting_value, win_loss_diff, seed, row)
+            for turn in range(turn_limit + 1):
+                value = np.int64(row[turn])
+                sums[block, turn] += value
+                sums_sq[block, turn] += value * value
+    return sums.sum(axis=0), sums_sq.sum(axis=0)
+
+
+_prob_win = nb.njit(inline="always", cache=NUMBA_CACHE)(elo.prob_win)
+_prob_draw = nb.njit(inline="always", cache=NUMBA_CACHE)(elo.prob_draw)
+
+
+@nb.njit(parallel=True, cache=NUMBA_CACHE)
+def _elo_kernel(num_samples, num_players, num_rounds, seed):
+    elos = np.empty((num_samples, num_players))
+    scores = np.zeros((num_samples, num_players))
+    for tournament in nb.prange(num_samples):
+        state = _stream_state(seed, tournament)
+        for player in range(num_players):
+            state, z = _splitmix64(state)
+            elos[tournament, player] = elo.INITIAL_ELO + elo.ELO_RANGE * _to_uniform(z)
+
+        t_elos = elos[tournament]
+        t_scores = scores[tournament]
+        for _ in range(num_rounds):
+            # score first, elo to break ties (elos are far below 1e6), both descending
+            order = np.argsort(-(t_scores * 1e6 + t_elos))
+            group_start = 0
+            while group_start < num_players:
+                group_end = group_start + 1
+                while group_end < num_players and t_scores[order[group_end]] == t_scores[order[group_start]]:
+                    group_end += 1
+                half = (group_end - group_start + 1) // 2
+                for left in range(group_start, group_start + half):
+                    right = left + half
+                    if right >= group_end:
+                        # bye
+                        t_scores[order[left]] += 1
+                        continue
+                    left_elo = t_elos[order[left]]
+                    right_elo = t_elos[order[right]]
+                    pw = _prob_win(left_elo, right_elo)
+                    pd = _prob_draw(left_elo, right_elo)
+                    state, z = _splitmix64(state)
+                    roll = _to_uniform(z)
+                    if roll < pw:
+                        result = 1.0
+                    elif roll < pw + pd:
+                        result = 0.5
+                    else:
+                        result = 0.0
+                    t_scores[order[left]] += result
+                    t_scores[order[right]] += 1 - result
+                group_start = group_end
+    return elos, scores
+
+
+def _set_num_threads(num_threads):
+    # numba can't use more threads than it started with (NUMBA_NUM_THREADS, the number of cores by
+    # default), so scenarios sweeping past that run on all of them. Blocks still follow num_threads,
+    # so results don't depend on the machine.
+    nb.set_num_threads(max(1, min(num_threads, nb.config.NUMBA_NUM_THREADS)))
+
+
+def _resolve_seed(seed):
+    if seed is None:
+        return np.random.randint(0, 2**63 - 1, dtype=np.int64)
+    return seed
 
 class NumbaCalculator(BaseCalculator):
+    LIBRARY = "numba"
     
     @staticmethod
-    @nb.jit(nopython=True)
+    @nb.jit(nopython=True, cache=NUMBA_CACHE)
     def pi_calculator(num_samples: int = 1000):
         return 4 * sum(
             [
@@ -20,7 +406,7 @@ class NumbaCalculator(BaseCalculator):
         ) / num_samples
 
     @staticmethod
-    @nb.jit(nopython=True)
+    @nb.jit(nopython=True, cache=NUMBA_CACHE)
     def casino_simulation(
         num_samples: int = 1000,
         turn_limit: int = 1000,
@@ -32,19 +418,19 @@ class NumbaCalculator(BaseCalculator):
         for sample in range(0, num_samples):
             values.append([starting_value])
             for _ in range(1, turn_limit+1):
-                # Generate random outcomes for each sample
-                outcome = random.randint(0, 37)
+                # Generate random outcomes for each sample, randint includes its upper bound
+                outcome = random.randint(0, 36)
                 if values[sample][-1] > 0 and outcome >= 19:
-                    values[sample].append(values[sample][-1] + 10)
+                    values[sample].append(values[sample][-1] + win_loss_diff)
                 elif values[sample][-1] > 0 and outcome < 19:
-                    values[sample].append(values[sample][-1] - 10)
+                    values[sample].append(max(values[sample][-1] - win_loss_diff, 0))
                 else:
                     values[sample].append(0)
 
         return values
 
     @staticmethod
-    @nb.jit(nopython=True)
+    @nb.jit(nopython=True, cache=NUMBA_CACHE)
     def casino_simulation_aggregated(
         num_samples: int = 1000,
         turn_limit: int = 1000,
@@ -56,12 +442,12 @@ class NumbaCalculator(BaseCalculator):
         for sample in range(0, num_samples):
             values.append([starting_value])
             for _ in range(1, turn_limit+1):
-                # Generate random outcomes for each sample
-                outcome = random.randint(0, 37)
+                # Generate random outcomes for each sample, randint includes its upper bound
+                outcome = random.randint(0, 36)
                 if values[sample][-1] > 0 and outcome >= 19:
-                    values[sample].append(values[sample][-1] + 10)
+                    values[sample].append(values[sample][-1] + win_loss_diff)
                 elif values[sample][-1] > 0 and outcome < 19:
-                    values[sample].append(values[sample][-1] - 10)
+                    values[sample].append(max(values[sample][-1] - win_loss_diff, 0))
                 else:
                     values[sample].append(0)
 
@@ -73,15 +459,124 @@ class NumbaCalculator(BaseCalculator):
             )
             turns.append(col_index)
 
+        # sample standard deviation (ddof=1) / sqrt(num_samples), as the other backends
         sem = []
         for col_index in range(len(values[0])):
             sem.append(
                 math.sqrt(
-                    (
-                        sum([sample[col_index]**2 for sample in values]) / len(values)
-                        - averages[col_index]**2
-                    ) / len(values[0])
+                    max(
+                        sum([sample[col_index]**2 for sample in values])
+                        - len(values) * averages[col_index]**2,
+                        0.0,
+                    ) / (len(values) - 1) / len(values)
                 )
             )
 
         return turns, averages, sem
+
+    @staticmethod
+    def pi_calculator_parallel(num_samples: int = 1000, num_threads: int = 1, seed: int = None):
+        _set_num_threads(num_threads)
+        return _pi_kernel(num_samples, _resolve_seed(seed))
+
+    @staticmethod
+    def pi_calculator_variance_reduced(
+        num_samples: int = 1000,
+        method: str = "antithetic",
+        num_threads: int = 1,
+        seed: int = None,
+        num_replicates: int = DEFAULT_QMC_REPLICATES,
+    ):
+        """(estimate, standard error) with points drawn by method, see NumpyCalculator.pi_calculator_variance_reduced."""
+        check_pi_arguments(num_samples, method, num_replicates)
+        _set_num_threads(num_threads)
+        seed = _resolve_seed(seed)
+        if method == "plain":
+            estimate = _pi_kernel(num_samples, seed)
+            p = estimate / 4
+            return estimate, 4 * math.sqrt(p * (1 - p) / (num_samples - 1))
+        if method == "antithetic":
+            return _pi_antithetic_kernel(num_samples // 2, seed)
+        if method == "stratified":
+            return _pi_stratified_kernel(int(math.sqrt(num_samples // 2)), seed)
+        if method in ("halton", "sobol"):
+            points_per_replicate = num_samples // num_replicates
+            counts = _pi_qmc_kernel(points_per_replicate, num_replicates, method == "sobol", seed)
+            return pi_from_qmc_replicates(counts, points_per_replicate)
+
+    @staticmethod
+    def casino_simulation_parallel(
+        num_samples: int = 1000,
+        turn_limit: int = 1000,
+        starting_value: int = 1000,
+        win_loss_diff: int = 10,
+        num_threads: int = 1,
+        seed: int = None,
+        compact: bool = False,
+    ):
+        _set_num_threads(num_threads)
+        if compact:
+            # packed spins and the narrowest value dtype, see numpy_calculator.compact_value_dtype
+            values = np.empty(
+                (num_samples, turn_limit + 1), dtype=compact_value_dtype(turn_limit + 1, starting_value, win_loss_diff)
+            )
+            return _casino_compact_kernel(turn_limit, starting_value, win_loss_diff, _resolve_seed(seed), values)
+        return _casino_kernel(num_samples, turn_limit, starting_value, win_loss_diff, _resolve_seed(seed))
+
+    @staticmethod
+    def casino_simulation_aggregated_parallel(
+        num_samples: int = 1000,
+        turn_limit: int = 1000,
+        starting_value: int = 1000,
+        win_loss_diff: int = 10,
+        num_threads: int = 1,
+        seed: int = None,
+        compact: bool = False,
+    ):
+        _set_num_threads(num_threads)
+        if compact:
+            scratch = np.empty(
+                (num_threads, turn_limit + 1), dtype=compact_value_dtype(turn_limit + 1, starting_value, win_loss_diff)
+            )
+            sums, sums_sq = _casino_aggregated_compact_kernel(
+                num_samples, turn_limit, starting_value, win_loss_diff, _resolve_seed(seed), scratch
+            )
+        else:
+            sums, sums_sq = _casino_aggregated_kernel(
+                num_samples, turn_limit, starting_value, win_loss_diff, _resolve_seed(seed), num_threads
+            )
+
+        averages = sums / num_samples
+        sem = np.sqrt((sums_sq - num_samples * averages**2) / (num_samples - 1) / num_samples)
+
+        return np.arange(turn_limit + 1), averages, sem
+
+    @staticmethod
+    def casino_simulation_aggregated_active_set(
+        num_samples: int = 1000,
+        turn_limit: int = 1000,
+        starting_value: int = 1000,
+        win_loss_diff: int = 10,
+        num_threads: int = 1,
+        seed: int = None,
+    ):
+        _set_num_threads(num_threads)
+        sums, sums_sq = _casino_active_set_kernel(
+            num_samples, turn_limit, starting_value, win_loss_diff, _resolve_seed(seed), num_threads
+        )
+
+        averages = sums / num_samples
+        sem = np.sqrt((sums_sq - num_samples * averages**2) / (num_samples - 1) / num_samples)
+
+        return np.arange(turn_limit + 1), averages, sem
+
+    @staticmethod
+    def elo_calculator(
+        num_samples: int = 1000,
+        num_players: int = 200,
+        num_rounds: int = 6,
+        num_threads: int = 1,
+        seed: int = None,
+    ):
+        _set_num_threads(num_threads)
+        return _elo_kernel(num_samples, num_players, num_rounds, _resolve_seed(seed))
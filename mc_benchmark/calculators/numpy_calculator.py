@@ -2,10 +2,131 @@ import concurrent.futures
 
 import numpy as np
 
+from mc_benchmark.calculators import elo
 from mc_benchmark.calculators.base_calculator import BaseCalculator
+from mc_benchmark.calculators.parallel import combine_moments, split_samples
 
-class NumpyCalculator(BaseCalculator):
+# number of samples held in memory at once by the streaming functions
+DEFAULT_PI_CHUNK_SIZE = 10_000_000
+DEFAULT_CASINO_CHUNK_SIZE = 10_000
+
+# turns between dropping busted samples from the active set
+DEFAULT_COMPACTION_INTERVAL = 16
+
+# ways of drawing the pi points, see pi_calculator_variance_reduced
+PI_METHODS = ("plain", "antithetic", "stratified", "halton", "sobol")
+# independent random shifts of the low discrepancy point sets, for their error estimate
+DEFAULT_QMC_REPLICATES = 16
+
+# P(win) = 18/37 as a binary fraction with this many bits, see _packed_wins
+WIN_PROBABILITY_BITS = 32
+_WIN_THRESHOLD = (18 << WIN_PROBABILITY_BITS) // 37
+
+
+def _packed_wins(num_samples: int) -> np.ndarray:
+    """One uint64 per sample, each bit an independent Bernoulli(18/37) spin."""
+    # Combining raw random words from the least significant bit of the threshold upwards,
+    # OR for a 1 bit and AND for a 0 bit, gives each output bit a probability of exactly
+    # _WIN_THRESHOLD / 2**WIN_PROBABILITY_BITS (18/37 to within 2**-32).
+    raw = np.frombuffer(
+        np.random.bytes(8 * num_samples * WIN_PROBABILITY_BITS), dtype=np.uint64
+    ).reshape(WIN_PROBABILITY_BITS, num_samples)
+    wins = np.zeros(num_samples, dtype=np.uint64)
+    for bit in range(WIN_PROBABILITY_BITS):
+        if (_WIN_THRESHOLD >> bit) & 1:
+            wins |= raw[bit]
+        else:
+            wins &= raw[bit]
+    return wins
+
+
+def radical_inverse(indices: np.ndarray, base: int) -> np.ndarray:
+    """The digits of each index in base, mirrored around the point: the van der Corput sequence."""
+    indices = indices.astype(np.uint64)
+    result = np.zeros(len(indices))
+    factor = 1 / base
+    while indices.any():
+        result += factor * (indices % base)
+        indices //= base
+        factor /= base
+    return result
+
+
+def sobol_second_dimension(indices: np.ndarray) -> np.ndarray:
+    """Second coordinate of the 2d Sobol sequence (the first is radical_inverse(indices, 2))."""
+    indices = indices.astype(np.uint64)
+    result = np.zeros(len(indices), dtype=np.uint64)
+    # direction numbers of the primitive polynomial x + 1
+    direction = 1 << 63
+    for bit in range(64):
+        result[(indices >> np.uint64(bit)) & np.uint64(1) == 1] ^= np.uint64(direction)
+        direction ^= direction >> 1
+    return (result >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+
+def sobol_points(num_points: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The first num_points points of the 2d Sobol sequence in gray code order, the order numba's
+    kernel steps through them in; unless num_points is a power of two that is a different set of
+    points than the first num_points indices.
+    """
+    indices = np.arange(num_points, dtype=np.uint64)
+    gray = indices ^ (indices >> np.uint64(1))
+    return radical_inverse(gray, 2), sobol_second_dimension(gray)
+
+
+def pi_from_qmc_replicates(counts: np.ndarray, points_per_replicate: int) -> tuple[float, float]:
+    """Estimate and standard error from the points inside the circle of each randomly shifted replicate."""
+    estimates = 4 * counts / points_per_replicate
+    return float(estimates.mean()), float(estimates.std(ddof=1) / np.sqrt(len(estimates)))
+
+
+def check_pi_arguments(num_samples: int, method: str, num_replicates: int) -> None:
+    """Raise a ValueError unless method can estimate pi and its standard error from num_samples points."""
+    if method not in PI_METHODS:
+        raise ValueError(f"Unknown method {method}, expected one of {', '.join(PI_METHODS)}.")
+    # the fewest points with a standard error: two samples, two antithetic pairs, one grid cell,
+    # or a point in each of two replicates
+    if method in ("halton", "sobol"):
+        if num_replicates < 2 or num_samples < num_replicates:
+            raise ValueError(
+                f"{method} needs at least 2 replicates and a point per replicate, got {num_samples} samples "
+                f"for {num_replicates} replicates."
+            )
+    elif num_samples < (4 if method == "antithetic" else 2):
+        raise ValueError(f"{method} needs at least {4 if method == 'antithetic' else 2} samples, got {num_samples}.")
 
+
+def compact_value_dtype(turn_limit: int, starting_value: int, win_loss_diff: int):
+    """Narrowest signed integer dtype that can hold any casino value for these arguments."""
+    largest = starting_value + win_loss_diff * turn_limit
+    for dtype in (np.int16, np.int32):
+        if largest <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _casino_compact_blocks(num_samples: int, turn_limit: int, starting_value: int, win_loss_diff: int):
+    """Yield (first_turn, values) for blocks of up to 64 turns of the compact casino simulation."""
+    dtype = compact_value_dtype(turn_limit, starting_value, win_loss_diff)
+    value = np.full(num_samples, starting_value, dtype=dtype)
+    yield 0, value[:, None]
+
+    steps = np.arange(1, 65, dtype=dtype)
+    for first_turn in range(1, turn_limit, 64):
+        block = min(64, turn_limit - first_turn)
+        wins = _packed_wins(num_samples)
+        bits = np.unpackbits(wins.view(np.uint8).reshape(num_samples, 8), axis=1, bitorder="little")[:, :block]
+        # prefix popcount: wins so far in this block, per turn
+        prefix_wins = np.cumsum(bits, axis=1, dtype=dtype)
+        values = value[:, None] + win_loss_diff * (2 * prefix_wins - steps[:block])
+        values[np.maximum.accumulate(values <= 0, axis=1) | (value == 0)[:, None]] = 0
+        value = values[:, -1].copy()
+        yield first_turn, values
+
+
+class NumpyCalculator(BaseCalculator):
+    LIBRARY = "numpy"
     
     @staticmethod
     def pi_calculator(num_samples: int = 1000, num_threads: int = 1):
@@ -24,8 +145,8 @@ class NumpyCalculator(BaseCalculator):
             with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
                 # Using a dictionary comprehension to map future to its sequence number
                 future_to_number = {
-                    executor.submit(_get_results, num_samples // num_threads): number
-                    for number in range(1, num_threads + 1)
+                    executor.submit(_get_results, samples): number
+                    for number, samples in enumerate(split_samples(num_samples, num_threads), start=1)
                 }
 
                 result_data = {}
@@ -41,14 +162,91 @@ class NumpyCalculator(BaseCalculator):
 
             return 4 * total_in_circle / total_points
 
+    @staticmethod
+    def pi_calculator_streaming(num_samples: int = 1000, chunk_size: int = DEFAULT_PI_CHUNK_SIZE):
+        # only ever holds two chunk_size arrays, regardless of num_samples
+        num_in_circle = 0
+        for chunk_start in range(0, num_samples, chunk_size):
+            samples = min(chunk_size, num_samples - chunk_start)
+            x = np.random.random(size=samples)
+            y = np.random.random(size=samples)
+            np.square(x, out=x)
+            np.square(y, out=y)
+            x += y
+            num_in_circle += np.count_nonzero(x < 1)
+        return 4 * num_in_circle / num_samples
+
+
+    @staticmethod
+    def pi_calculator_variance_reduced(
+        num_samples: int = 1000,
+        method: str = "antithetic",
+        seed: int = None,
+        num_replicates: int = DEFAULT_QMC_REPLICATES,
+    ):
+        """
+        Estimate pi with num_samples points drawn by method, returning (estimate, standard error).
+
+        - plain: independent uniform points
+        - antithetic: each point (x, y) is paired with (1 - x, 1 - y)
+        - stratified: the unit square is split into a k by k grid with two points per cell
+        - halton / sobol: a low discrepancy point set, randomly shifted (mod 1) num_replicates
+          times; the error comes from the spread of the replicates' estimates
+        """
+        check_pi_arguments(num_samples, method, num_replicates)
+        rng = np.random.default_rng(seed)
+        if method == "plain":
+            x, y = rng.random(num_samples), rng.random(num_samples)
+            p = np.count_nonzero(x * x + y * y < 1) / num_samples
+            return 4 * p, 4 * np.sqrt(p * (1 - p) / (num_samples - 1))
+        if method == "antithetic":
+            num_pairs = num_samples // 2
+            x, y = rng.random(num_pairs), rng.random(num_pairs)
+            pairs = ((x * x + y * y < 1).astype(np.float64) + ((1 - x) ** 2 + (1 - y) ** 2 < 1)) / 2
+            return 4 * pairs.mean(), 4 * pairs.std(ddof=1) / np.sqrt(num_pairs)
+        if method == "stratified":
+            k = int(np.sqrt(num_samples // 2))
+            cells = k * k
+            corner_x = np.repeat(np.arange(k), k)
+            corner_y = np.tile(np.arange(k), k)
+            inside = [
+                ((corner_x + rng.random(cells)) / k) ** 2 + ((corner_y + rng.random(cells)) / k) ** 2 < 1
+                for _ in range(2)
+            ]
+            # the variance within a cell is estimated from its two points
+            different = np.count_nonzero(inside[0] != inside[1])
+            return 4 * (np.count_nonzero(inside[0]) + np.count_nonzero(inside[1])) / (2 * cells), 2 * np.sqrt(different) / cells
+        if method in ("halton", "sobol"):
+            points_per_replicate = num_samples // num_replicates
+            if method == "halton":
+                indices = np.arange(points_per_replicate)
+                x, y = radical_inverse(indices, 2), radical_inverse(indices, 3)
+            else:
+                x, y = sobol_points(points_per_replicate)
+            shifts = rng.random((num_replicates, 2))
+            counts = np.array([
+                np.count_nonzero(((x + shift_x) % 1) ** 2 + ((y + shift_y) % 1) ** 2 < 1)
+                for shift_x, shift_y in shifts
+            ])
+            return pi_from_qmc_replicates(counts, points_per_replicate)
 
     @staticmethod
     def casino_simulation(
         num_samples=1,
         turn_limit=1000,
         starting_value=1000,
-        win_loss_diff=10
+        win_loss_diff=10,
+        compact=False,
     ):
+        if compact:
+            # one bit per spin and a narrow value dtype instead of int64 throughout
+            values = np.empty(
+                (num_samples, turn_limit), dtype=compact_value_dtype(turn_limit, starting_value, win_loss_diff)
+            )
+            for first_turn, block in _casino_compact_blocks(num_samples, turn_limit, starting_value, win_loss_diff):
+                values[:, first_turn:first_turn + block.shape[1]] = block
+            return values
+
         # Generate all random outcomes at once
         outcomes = np.random.randint(0, 37, size=(num_samples, turn_limit))
         change = np.where(outcomes >= 19, win_loss_diff, -win_loss_diff)
@@ -72,8 +270,22 @@ class NumpyCalculator(BaseCalculator):
         num_samples=1,
         turn_limit=1000,
         starting_value=1000,
-        win_loss_diff=10
+        win_loss_diff=10,
+        compact=False,
     ):
+        if compact:
+            # reduce each block of turns as it is simulated, the full matrix is never held
+            sums = np.empty(turn_limit)
+            sums_sq = np.empty(turn_limit)
+            for first_turn, block in _casino_compact_blocks(num_samples, turn_limit, starting_value, win_loss_diff):
+                sums[first_turn:first_turn + block.shape[1]] = block.sum(axis=0, dtype=np.int64)
+                sums_sq[first_turn:first_turn + block.shape[1]] = np.square(block, dtype=np.int64).sum(axis=0)
+
+            avg_values = sums / num_samples
+            sem = np.sqrt((sums_sq - num_samples * avg_values**2) / (num_samples - 1)) / np.sqrt(num_samples)
+
+            return np.column_stack((np.arange(turn_limit), avg_values, np.full(turn_limit, num_samples), sem))
+
         # Generate all random outcomes at once
         outcomes = np.random.randint(0, 37, size=(num_samples, turn_limit))
         change = np.where(outcomes >= 19, win_loss_diff, -win_loss_diff)
@@ -99,6 +311,76 @@ class NumpyCalculator(BaseCalculator):
 
         return np.column_stack((np.arange(turn_limit), avg_values, np.full(turn_limit, sample), sem))
 
+    @staticmethod
+    def casino_simulation_aggregated_streaming(
+        num_samples=1,
+        turn_limit=1000,
+        starting_value=1000,
+        win_loss_diff=10,
+        chunk_size=DEFAULT_CASINO_CHUNK_SIZE,
+    ):
+        count = 0
+        mean = np.zeros(turn_limit)
+        m2 = np.zeros(turn_limit)
+
+        # simulate chunk_size samples at a time, merging per-turn moments as we go
+        for chunk_start in range(0, num_samples, chunk_size):
+            values = NumpyCalculator.casino_simulation(
+                num_samples=min(chunk_size, num_samples - chunk_start),
+                turn_limit=turn_limit,
+                starting_value=starting_value,
+                win_loss_diff=win_loss_diff,
+            )
+            chunk_count = values.shape[0]
+            count, mean, m2 = combine_moments(
+                count, mean, m2,
+                chunk_count, values.mean(axis=0), values.var(axis=0) * chunk_count,
+            )
+
+        # same output as casino_simulation_aggregated: sample std (ddof=1) / sqrt(n)
+        sem = np.sqrt(m2 / (count - 1)) / np.sqrt(count)
+
+        return np.column_stack((np.arange(turn_limit), mean, np.full(turn_limit, count), sem))
+
+    @staticmethod
+    def casino_simulation_aggregated_active_set(
+        num_samples=1,
+        turn_limit=1000,
+        starting_value=1000,
+        win_loss_diff=10,
+        compaction_interval=DEFAULT_COMPACTION_INTERVAL,
+    ):
+        sums = np.zeros(turn_limit)
+        sums_sq = np.zeros(turn_limit)
+
+        # only samples that are still solvent are simulated. a busted sample is 0
+        # from then on, so it adds nothing to the per-turn sums and is only ever
+        # needed through num_samples in the denominator
+        active = np.full(num_samples, starting_value, dtype=np.int64)
+        sums[0] = active.sum()
+        sums_sq[0] = active @ active
+
+        for turn in range(1, turn_limit):
+            if active.size == 0:
+                break
+            outcomes = np.random.randint(0, 37, size=active.size)
+            change = np.where(outcomes >= 19, win_loss_diff, -win_loss_diff)
+            # samples that went bust since the last compaction stay at 0
+            change[active <= 0] = 0
+            active += change
+            np.maximum(active, 0, out=active)
+
+            sums[turn] = active.sum()
+            sums_sq[turn] = active @ active
+
+            if turn % compaction_interval == 0:
+                active = active[active > 0]
+
+        avg_values = sums / num_samples
+        sem = np.sqrt((sums_sq - num_samples * avg_values**2) / (num_samples - 1)) / np.sqrt(num_samples)
+
+        return np.column_stack((np.arange(turn_limit), avg_values, np.full(turn_limit, num_samples), sem))
+
     @staticmethod
     def casino_simulation_iterative(
         num_samples: int = 1000,
@@ -152,3 +434,50 @@ class NumpyCalculator(BaseCalculator):
         sem = std_dev / np.sqrt(num_samples)
 
         return np.column_stack((np.arange(turn_limit), avg_values, np.full(turn_limit, sample), sem))
+
+    @staticmethod
+    def elo_calculator(num_samples: int = 1000, num_players: int = 200, num_rounds: int = 6):
+        # every row is an independent tournament, all of them are paired and played at once
+        elos = elo.INITIAL_ELO + elo.ELO_RANGE * np.random.random((num_samples, num_players))
+        scores = np.zeros((num_samples, num_players))
+        positions = np.broadcast_to(np.arange(num_players), (num_samples, num_players))
+
+        for _ in range(num_rounds):
+            # sort by score then elo, both descending
+            order = np.lexsort((-elos, -scores), axis=1)
+            sorted_scores = np.take_along_axis(scores, order, axis=1)
+            sorted_elos = np.take_along_axis(elos, order, axis=1)
+
+            # [group_start, group_end) of the score group at each position
+            group_first = np.ones((num_samples, num_players), dtype=bool)
+            group_first[:, 1:] = sorted_scores[:, 1:] != sorted_scores[:, :-1]
+            group_last = np.ones((num_samples, num_players), dtype=bool)
+            group_last[:, :-1] = group_first[:, 1:]
+            group_start = np.maximum.accumulate(np.where(group_first, positions, 0), axis=1)
+            group_end = np.minimum.accumulate(
+                np.where(group_last, positions, num_players - 1)[:, ::-1], axis=1
+            )[:, ::-1] + 1
+
+            # top half of each group plays the bottom half, in order
+            half = (group_end - group_start + 1) // 2
+            is_left = positions - group_start < half
+            partner = np.where(is_left, positions + half, positions - half)
+            has_partner = partner < group_end
+            partner_elos = np.take_along_axis(sorted_elos, np.minimum(partner, num_players - 1), axis=1)
+
+            pw = elo.prob_win(sorted_elos, partner_elos)
+            pd = elo.prob_draw(sorted_elos, partner_elos)
+            rolls = np.random.random((num_samples, num_players))
+            left_result = np.where(rolls < pw, 1.0, np.where(rolls < pw + pd, 0.5, 0.0))
+            # a left player without a partner has a bye
+            left_result[is_left & ~has_partner] = 1.0
+
+            round_scores = np.where(
+                is_left,
+                left_result,
+                1 - np.take_along_axis(left_result, np.minimum(partner, num_players - 1), axis=1),
+            )
+            sorted_scores += round_scores
+            np.put_along_axis(scores, order, sorted_scores, axis=1)
+
+        return elos, scores
@@ -0,0 +1,163 @@
+import concurrent.futures
+import functools
+import inspect
+import random
+import typing
+from multiprocessing import resource_tracker, shared_memory, util
+
+import numpy as np
+
+
+def split_samples(num_samples: int, num_shards: int) -> list[int]:
+    """Split num_samples into num_shards sizes, spreading the remainder instead of dropping it."""
+    base, remainder = divmod(num_samples, num_shards)
+    return [base + (1 if shard < remainder else 0) for shard in range(num_shards)]
+
+
+def combine_moments(count, mean, m2, other_count, other_mean, other_m2):
+    """Merge two (count, mean, sum of squared deviations) triples (Chan et al. / Welford)."""
+    total = count + other_count
+    delta = other_mean - mean
+    mean = mean + delta * (other_count / total)
+    m2 = m2 + other_m2 + delta**2 * (count * other_count / total)
+    return total, mean, m2
+
+
+class SharedArray(typing.NamedTuple):
+    name: str
+    shape: tuple
+    dtype: str
+
+
+def _to_shared(result):
+    # arrays are written to shared memory so only a handle goes back through the pool's pipe
+    if isinstance(result, np.ndarray) and result.nbytes > 0:
+        shm = shared_memory.SharedMemory(create=True, size=result.nbytes)
+        np.ndarray(result.shape, dtype=result.dtype, buffer=shm.buf)[...] = result
+        handle = SharedArray(shm.name, result.shape, result.dtype.str)
+        shm.close()
+        # ownership passes to the parent, which unlinks the segment once it is merged
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return handle
+    if isinstance(result, tuple):
+        return tuple(_to_shared(r) for r in result)
+    return result
+
+
+def _from_shared(result, opened: list):
+    if isinstance(result, SharedArray):
+        shm = shared_memory.SharedMemory(name=result.name)
+        opened.append(shm)
+        return np.ndarray(result.shape, dtype=np.dtype(result.dtype), buffer=shm.buf)
+    if isinstance(result, tuple):
+        return tuple(_from_shared(r, opened) for r in result)
+    return result
+
+
+@functools.lru_cache(maxsize=None)
+def _numba_seeder():
+    # numba keeps its own generator state, which can only be seeded from jitted code
+    import numba as nb
+
+    @nb.njit
+    def _seed(seed):
+        np.random.seed(seed)
+        random.seed(seed)
+
+    return _seed
+
+
+def _run_shard(function, arguments: dict, seed_sequence: np.random.SeedSequence):
+    # seed every generator the calculators draw from with this shard's child stream
+    seed = int(seed_sequence.generate_state(1)[0])
+    np.random.seed(seed_sequence.generate_state(4))
+    random.seed(seed)
+    if hasattr(function, "py_func"):
+        _numba_seeder()(seed & 0xFFFFFFFF)
+    if "seed" in inspect.signature(getattr(function, "py_func", function)).parameters:
+        arguments = {**arguments, "seed": seed}
+    return _to_shared(function(**arguments))
+
+
+def merge_mean(results: list, sizes: list[int]):
+    """Sample-weighted mean of scalar estimates, e.g. pi."""
+    return sum(r * n for r, n in zip(results, sizes)) / sum(sizes)
+
+
+def merge_concatenate(results: list, sizes: list[int]):
+    """Stack per-sample outputs, e.g. the full casino value matrix."""
+    return np.concatenate(results, axis=0)
+
+
+def merge_moments(results: list, sizes: list[int]):
+    """Combine (turn, avg, n, sem) tables as returned by NumpyCalculator.casino_simulation_aggregated."""
+    count, mean, m2 = 0, 0.0, 0.0
+    for result in results:
+        shard_count = result[0, 2]
+        shard_m2 = result[:, 3]**2 * shard_count * (shard_count - 1)
+        count, mean, m2 = combine_moments(count, mean, m2, shard_count, result[:, 1], shard_m2)
+    sem = np.sqrt(m2 / (count - 1)) / np.sqrt(count)
+    turns = results[0][:, 0]
+    return np.column_stack((turns, mean, np.full(len(turns), count), sem))
+
+
+MERGES = {
+    "mean": merge_mean,
+    "concatenate": merge_concatenate,
+    "moments": merge_moments,
+}
+
+
+class ProcessPoolFunction:
+    """
+    Shard a calculator function over num_samples across a process pool.
+
+    Every shard gets a child of np.random.SeedSequence(seed), so a run is reproducible for a
+    given (seed, num_processes). Array results come back through shared memory and are merged
+    with one of MERGES. The pool is kept between calls so repeated profiler iterations do not
+    pay for process start up. DuckDB's random() is not seeded by this.
+    """
+    def __init__(
+            self,
+            function: typing.Callable,
+            num_processes: int = 1,
+            merge: str = "mean",
+            seed: typing.Optional[int] = None,
+        ) -> None:
+        self.function = function
+        self.num_processes = num_processes
+        self.merge = merge
+        self.seed = seed
+        self.__name__ = f"{function.__name__}_process_pool"
+        self._executor = None
+
+    def __getstate__(self):
+        return {**self.__dict__, "_executor": None}
+
+    def __call__(self, num_samples: int = 1000, **function_arguments):
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.num_processes)
+            # multiprocessing joins child processes on exit, so the pool has to be shut down
+            # before that, and before its own queues are closed by their finalizers
+            util.Finalize(self, self._executor.shutdown, exitpriority=100)
+
+        sizes = [n for n in split_samples(num_samples, self.num_processes) if n > 0]
+        seed_sequences = np.random.SeedSequence(self.seed).spawn(len(sizes))
+        futures = [
+            self._executor.submit(
+                _run_shard, self.function, {**function_arguments, "num_samples": n}, seed_sequence
+            )
+            for n, seed_sequence in zip(sizes, seed_sequences)
+        ]
+
+        opened = []
+        results = []
+        try:
+            results = [_from_shared(f.result(), opened) for f in futures]
+            return MERGES[self.merge](results, sizes)
+        finally:
+            # views into the shared buffers have to go before the segments are closed
+            del results
+            for shm in opened:
+                shm.close()
+                shm.unlink()
@@ -1,9 +1,66 @@
+import typing
+
 import numpy as np
 import polars as pl
 
+from mc_benchmark.calculators import elo
 from mc_benchmark.calculators.base_calculator import BaseCalculator
 
+DEFAULT_CASINO_BATCH_SIZE = 10_000
+
+
+def _splitmix64(key: pl.Expr, seed: int) -> pl.Expr:
+    # splitmix64 of a unique UInt64 key, relying on wrapping UInt64 arithmetic.
+    # Expr.hash is not usable here: neighbouring keys and seeds give correlated hashes
+    z = key * pl.lit(0x9E3779B97F4A7C15, dtype=pl.UInt64) + pl.lit(seed, dtype=pl.UInt64)
+    z = (z ^ (z // 2**30)) * pl.lit(0xBF58476D1CE4E5B9, dtype=pl.UInt64)
+    z = (z ^ (z // 2**27)) * pl.lit(0x94D049BB133111EB, dtype=pl.UInt64)
+    return z ^ (z // 2**31)
+
+
+def _uniform(key: pl.Expr, seed: int) -> pl.Expr:
+    # uniform [0, 1) from a unique integer key
+    return _splitmix64(key, seed) / 2.0**64
+
+
+def _casino_lazy(
+    first_sample: int,
+    num_samples: int,
+    turn_limit: int,
+    starting_value: int,
+    win_loss_diff: int,
+    seed: int,
+) -> pl.LazyFrame:
+    turns = turn_limit + 1
+    return pl.LazyFrame().select(
+        # one row per (sample, turn), turn 0 included, without a cross join
+        pl.int_range(first_sample * turns, (first_sample + num_samples) * turns, dtype=pl.UInt64).alias("row")
+    ).with_columns(
+        (pl.col("row") // turns).alias("sample"),
+        (pl.col("row") % turns).alias("turn"),
+    ).with_columns(
+        # mixing the global row number gives the roll natively in polars,
+        # and keeps rolls independent of the batching
+        pl.when(pl.col("turn") == 0)
+        .then(0)
+        .when(_splitmix64(pl.col("row"), seed) % 37 >= 19)
+        .then(win_loss_diff)
+        .otherwise(-win_loss_diff)
+        .alias("value_diff")
+    ).with_columns(
+        (starting_value + pl.col("value_diff").cum_sum().over("sample")).alias("value")
+    ).with_columns(
+        # absorbed from the first turn the value reaches 0
+        (pl.col("value") <= 0).cast(pl.UInt8).cum_max().over("sample").alias("busted")
+    ).select(
+        pl.col("sample"),
+        pl.col("turn"),
+        pl.when(pl.col("busted") == 1).then(0).otherwise(pl.col("value")).alias("value"),
+    )
+
+
 class PolarsCalculator(BaseCalculator):
+    LIBRARY = "polars"
 
     @staticmethod
     def pi_calculator(num_samples: int = 1000):
@@ -21,62 +78,50 @@ class PolarsCalculator(BaseCalculator):
         turn_limit: int = 1000,
         starting_value: int = 1000,
         win_loss_diff: int = 10,
-        aggregate: bool = True
+        aggregate: bool = True,
+        seed: typing.Optional[int] = None,
+        batch_size: int = DEFAULT_CASINO_BATCH_SIZE,
     ):
-        lf_samples = pl.LazyFrame({"sample": np.arange(1, num_samples+1)})
-        lf_turns = pl.LazyFrame({"turn": np.arange(1, turn_limit+1)})  # TODO include turn 0
-
-        lf_joined = lf_samples.join(lf_turns, how="cross")
-
-        lf_joined = lf_joined.with_columns(
-            pl.Series("roll", np.random.randint(0, 37, size=(turn_limit)*num_samples))
-        )
-
-        lf_joined = lf_joined.with_columns(
-            pl.lit(starting_value).alias('value'),
-            pl.when(pl.col('roll')>=19)
-            .then(win_loss_diff)
-            .otherwise(-win_loss_diff)
-            .alias('value_diff')
-        )
-
-        # ERROR WITH ONE OF THESE TYPES
-        lf_zero_turn = lf_samples.with_columns(
-            pl.lit(0).cast(pl.Int64).alias('turn'),
-            pl.lit(0).cast(pl.Int64).alias('roll'),
-            pl.lit(starting_value).cast(pl.Int32).alias('value'),
-            pl.lit(0).cast(pl.Int32).alias('value_diff')
-        )
-        
-        lf_joined = pl.concat([lf_zero_turn, lf_joined])
-
-        lf_joined = lf_joined.select(
-            pl.col(["sample", "turn", "value", "value_diff"]),
-            pl.col("value_diff").cum_sum().over(["sample"]).alias("cum_value_diff"),
-        )
+        if seed is None:
+            seed = np.random.randint(0, 2**32)
 
-        # Identify the first turn where cum_value_diff reaches -starting_value for each sample
-        mask = (lf_joined.filter(pl.col("cum_value_diff") == -starting_value)
-                .group_by("sample")
-                .agg(pl.min("turn").alias("out_of_money_turn")))
-        lf_joined = lf_joined.join(mask, on=["sample"], how="left")
-
-        lf_joined = lf_joined.with_columns(
-            pl.when(pl.col("turn") >= pl.col("out_of_money_turn"))
-            .then(-1000)
-            .otherwise(pl.col("cum_value_diff"))
-            .alias("cum_value_diff_adjusted")
-        ).with_columns(
-            (pl.col("value") + pl.col("cum_value_diff_adjusted")).alias("value")
-        )
+        # window functions are not supported by the streaming engine, so collect
+        # batch_size samples at a time to keep memory bounded
+        batches = []
+        for first_sample in range(0, num_samples, batch_size):
+            lf = _casino_lazy(
+                first_sample,
+                min(batch_size, num_samples - first_sample),
+                turn_limit,
+                starting_value,
+                win_loss_diff,
+                seed,
+            )
+            if aggregate:
+                lf = lf.group_by("turn").agg(
+                    pl.col("value").sum().alias("value_sum"),
+                    (pl.col("value")**2).sum().alias("value_sum_sq"),
+                    pl.col("value").count().alias("value_count"),
+                )
+            batches.append(lf.collect(streaming=True))
 
-        resolved = lf_joined.collect()[["sample", "turn", "value"]]
+        resolved = pl.concat(batches)
 
         if aggregate:
-            resolved = resolved.group_by("turn").agg([
-                pl.col("value").mean().alias("avg_value"),
-                (pl.col("value").std() / (pl.count("value")**0.5)).alias("avg_value_error")
-            ]).sort("turn")
+            resolved = resolved.group_by("turn").agg(
+                pl.col("value_sum").sum(),
+                pl.col("value_sum_sq").sum(),
+                pl.col("value_count").sum(),
+            ).select(
+                pl.col("turn"),
+                (pl.col("value_sum") / pl.col("value_count")).alias("avg_value"),
+                (
+                    (
+                        (pl.col("value_sum_sq") - pl.col("value_sum")**2 / pl.col("value_count"))
+                        / (pl.col("value_count") - 1)
+                    ).sqrt() / pl.col("value_count").sqrt()
+                ).alias("avg_value_error"),
+            ).sort("turn")
         return resolved
 
     @staticmethod
@@ -86,7 +131,7 @@ class PolarsCalculator(BaseCalculator):
         starting_value: int = 1000,
         win_loss_diff: int = 10
     ):
-        PolarsCalculator.casino_simulation_base(
+        return PolarsCalculator.casino_simulation_base(
             num_samples=num_samples,
             turn_limit=turn_limit,
             starting_value=starting_value,
@@ -101,10 +146,79 @@ class PolarsCalculator(BaseCalculator):
         starting_value: int = 1000,
         win_loss_diff: int = 10
     ):
-        PolarsCalculator.casino_simulation_base(
+        return PolarsCalculator.casino_simulation_base(
             num_samples=num_samples,
             turn_limit=turn_limit,
             starting_value=starting_value,
             win_loss_diff=win_loss_diff,
             aggregate=True
         )
+
+    @staticmethod
+    def elo_calculator(
+        num_samples: int = 1000,
+        num_players: int = 200,
+        num_rounds: int = 6,
+        seed: typing.Optional[int] = None,
+    ):
+        if seed is None:
+            seed = np.random.randint(0, 2**32)
+
+        players = pl.LazyFrame().select(
+            pl.int_range(0, num_samples * num_players, dtype=pl.UInt64).alias("row")
+        ).select(
+            (pl.col("row") // num_players).alias("tournament"),
+            (pl.col("row") % num_players).alias("player_id"),
+            (elo.INITIAL_ELO + elo.ELO_RANGE * _uniform(pl.col("row"), seed)).alias("elo"),
+            pl.lit(0.0).alias("score"),
+        ).collect()
+
+        for round_number in range(1, num_rounds + 1):
+            ranked = players.lazy().with_columns(
+                pl.col("elo").rank("ordinal", descending=True).over(["tournament", "score"]).cast(pl.Int64).alias("group_rank"),
+                ((pl.col("elo").count().over(["tournament", "score"]).cast(pl.Int64) + 1) // 2).alias("half"),
+            )
+
+            # top half of each score group plays the bottom half, in elo order
+            left = ranked.filter(pl.col("group_rank") <= pl.col("half"))
+            right = ranked.filter(pl.col("group_rank") > pl.col("half")).select(
+                pl.col("tournament"),
+                pl.col("score"),
+                (pl.col("group_rank") - pl.col("half")).alias("group_rank"),
+                pl.col("player_id").alias("r_player_id"),
+                pl.col("elo").alias("r_elo"),
+            )
+
+            games = left.join(right, on=["tournament", "score", "group_rank"], how="left").with_columns(
+                _uniform(pl.col("tournament") * num_players + pl.col("player_id"), seed + round_number).alias("_rand"),
+                elo.prob_win(pl.col("elo"), pl.col("r_elo")).alias("pw"),
+                elo.prob_draw(pl.col("elo"), pl.col("r_elo")).alias("pd"),
+            ).with_columns(
+                pl.when(pl.col("r_player_id").is_null()).then(1.0)
+                .when(pl.col("_rand") < pl.col("pw")).then(1.0)
+                .when(pl.col("_rand") < pl.col("pw") + pl.col("pd")).then(0.5)
+                .otherwise(0.0)
+                .alias("l_score_diff")
+            )
+
+            score_diffs = pl.concat([
+                games.select(
+                    pl.col("tournament"),
+                    pl.col("player_id"),
+                    pl.col("l_score_diff").alias("score_diff"),
+                ),
+                games.filter(pl.col("r_player_id").is_not_null()).select(
+                    pl.col("tournament"),
+                    pl.col("r_player_id").alias("player_id"),
+                    (1 - pl.col("l_score_diff")).alias("score_diff"),
+                ),
+            ])
+
+            players = players.lazy().join(score_diffs, on=["tournament", "player_id"]).select(
+                pl.col("tournament"),
+                pl.col("player_id"),
+                pl.col("elo"),
+                pl.col("score") + pl.col("score_diff"),
+            ).collect()
+
+        return players.sort(["tournament", "player_id"])
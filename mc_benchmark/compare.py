@@ -0,0 +1,211 @@
+"""
+Regression detection between two runs in the store (see store.py).
+
+Scenarios are matched on backend, function, scenario type and arguments (not on their cache key,
+which changes with library versions), and the per iteration times and peak memory of the two runs
+are compared with a one sided Mann-Whitney U test plus a bootstrap confidence interval of the
+ratio of medians. A metric regressed when both runs have at least min_runs values, the lower end
+of the interval is more than threshold slower (or bigger) and the test is significant at alpha.
+Runs of the same code differ by more than their spread within a run (other load, frequency
+scaling, what else is cached), so the defaults only flag changes well above that.
+"""
+import math
+import statistics
+import typing
+
+import duckdb
+import numpy as np
+import pandas
+
+from mc_benchmark import analysis_folder, store_folder
+from mc_benchmark.store import MEASUREMENTS_GLOB
+
+METRICS = ["time", "peak_rss"]
+# fewer values than this in either run are not enough to tell noise from a change
+MIN_RUNS = 10
+MATCH_COLUMNS = [
+    "type",
+    "function",
+    "scenario_type",
+    "num_samples",
+    "num_threads",
+    "turn_limit",
+    "extra_arguments",
+    "profiler_arguments",
+    "metric",
+]
+
+
+def mann_whitney(baseline: list[float], candidate: list[float]) -> float:
+    """
+    One sided p-value of candidate values tending to be larger than baseline values, from the
+    normal approximation to the U statistic with tie and continuity corrections.
+    """
+    n1, n2 = len(candidate), len(baseline)
+    values = np.concatenate([candidate, baseline])
+    # average ranks for ties
+    order = values.argsort(kind="mergesort")
+    ranks = np.empty(len(values))
+    sorted_values = values[order]
+    _, starts, counts = np.unique(sorted_values, return_index=True, return_counts=True)
+    for start, count in zip(starts, counts):
+        ranks[order[start:start + count]] = start + (count + 1) / 2
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    tie_term = (counts ** 3 - counts).sum() / (n * (n - 1))
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term))
+    if sigma == 0:
+        return 0.5
+    z = (u - n1 * n2 / 2 - 0.5) / sigma
+    return 1 - statistics.NormalDist().cdf(z)
+
+
+def bootstrap_ratio_ci(
+        baseline: list[float],
+        candidate: list[float],
+        confidence: float = 0.95,
+        resamples: int = 2000,
+        seed: int = 0,
+    ) -> tuple[float, float]:
+    """Percentile bootstrap interval of median(candidate) / median(baseline)."""
+    rng = np.random.default_rng(seed)
+    baseline, candidate = np.asarray(baseline), np.asarray(candidate)
+    baseline_medians = np.median(rng.choice(baseline, (resamples, len(baseline))), axis=1)
+    candidate_medians = np.median(rng.choice(candidate, (resamples, len(candidate))), axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = candidate_medians / baseline_medians
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.nanpercentile(ratios, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def latest_runs(con, scenario: str) -> list[str]:
+    """Run ids of scenario's runs, newest first."""
+    return [
+        run_id for (run_id,) in con.execute(
+            f"""
+            select distinct run_id
+            from read_parquet('{store_folder / MEASUREMENTS_GLOB}', hive_partitioning = true)
+            where scenario_name = $scenario
+            order by run_id desc
+            """,
+            {"scenario": scenario},
+        ).fetchall()
+    ]
+
+
+def matched_samples(con, baseline: str, candidate: str) -> pandas.DataFrame:
+    """One row per scenario and metric found in both runs, with both runs' values as lists."""
+    match = " and ".join(f"b.{column} is not distinct from c.{column}" for column in MATCH_COLUMNS)
+    return con.execute(
+        f"""
+        with samples as (
+            select
+                run_id,
+                {", ".join(MATCH_COLUMNS)},
+                list(value) as values
+            from read_parquet('{store_folder / MEASUREMENTS_GLOB}', hive_partitioning = true)
+            where run_id in ($baseline, $candidate)
+                and status = 'ok'
+                and metric in ({", ".join(f"'{metric}'" for metric in METRICS)})
+            group by all
+        )
+
+        select
+            {", ".join(f"b.{column}" for column in MATCH_COLUMNS)},
+            b.values as baseline_values,
+            c.values as candidate_values
+        from samples as b
+        inner join samples as c on {match}
+        where b.run_id = $baseline and c.run_id = $candidate
+        order by all
+        """,
+        {"baseline": baseline, "candidate": candidate},
+    ).df()
+
+
+def compare_samples(
+        baseline: list[float],
+        candidate: list[float],
+        threshold: float = 0.25,
+        alpha: float = 0.001,
+        confidence: float = 0.95,
+        min_runs: int = MIN_RUNS,
+    ) -> dict:
+    """
+    Compare one metric's values in two runs. change is the relative change of the median, and
+    verdict is regression, improvement, unchanged or too few runs (under min_runs in either).
+    """
+    change = statistics.median(candidate) / statistics.median(baseline) - 1
+    low, high = bootstrap_ratio_ci(baseline, candidate, confidence)
+    p_slower = mann_whitney(baseline, candidate)
+    p_faster = mann_whitney(candidate, baseline)
+    if min(len(baseline), len(candidate)) < min_runs:
+        verdict = "too few runs"
+    elif low - 1 > threshold and p_slower < alpha:
+        verdict = "regression"
+    elif high - 1 < -threshold and p_faster < alpha:
+        verdict = "improvement"
+    else:
+        verdict = "unchanged"
+    return {
+        "baseline_runs": len(baseline),
+        "candidate_runs": len(candidate),
+        "baseline_median": statistics.median(baseline),
+        "candidate_median": statistics.median(candidate),
+        "change": change,
+        "change_ci_low": low - 1,
+        "change_ci_high": high - 1,
+        "p_slower": p_slower,
+        "p_faster": p_faster,
+        "verdict": verdict,
+    }
+
+
+def compare_runs(baseline: str, candidate: str, **kwargs) -> pandas.DataFrame:
+    """Compare every matched scenario and metric of two runs, kwargs as for compare_samples."""
+    con = duckdb.connect()
+    samples = matched_samples(con, baseline, candidate)
+    rows = []
+    for row in samples.itertuples(index=False):
+        rows.append({
+            **{column: getattr(row, column) for column in MATCH_COLUMNS},
+            **compare_samples(list(row.baseline_values), list(row.candidate_values), **kwargs),
+        })
+    return pandas.DataFrame(rows, columns=[
+        *MATCH_COLUMNS,
+        "baseline_runs",
+        "candidate_runs",
+        "baseline_median",
+        "candidate_median",
+        "change",
+        "change_ci_low",
+        "change_ci_high",
+        "p_slower",
+        "p_faster",
+        "verdict",
+    ])
+
+
+def run_compare(
+        scenario: typing.Optional[str] = None,
+        baseline: typing.Optional[str] = None,
+        candidate: typing.Optional[str] = None,
+        **kwargs,
+    ) -> pandas.DataFrame:
+    """
+    Compare two runs and write the report to analysis_data. Without run ids, the latest run of
+    scenario is the candidate and the one before it the baseline.
+    """
+    if baseline is None or candidate is None:
+        if scenario is None:
+            raise ValueError("Give a scenario, or both a baseline and a candidate run id.")
+        runs = latest_runs(duckdb.connect(), scenario)
+        if len(runs) < 2:
+            raise FileNotFoundError(f"Need two runs of {scenario} in the store to compare, found {len(runs)}.")
+        candidate = candidate or runs[0]
+        baseline = baseline or next(run for run in runs if run != candidate)
+    report = compare_runs(baseline, candidate, **kwargs)
+    analysis_folder.mkdir(exist_ok=True)
+    report.to_csv(analysis_folder / f"compare_{baseline}_{candidate}.csv", index=False)
+    return report
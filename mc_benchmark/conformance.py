@@ -0,0 +1,228 @@
+"""
+Statistical conformance of the backends, checked before a suite is benchmarked, so a backend
+cannot be fast because it is wrong.
+
+Every distinct (backend, function, arguments) of a suite is called once at a validation size (see
+VALIDATION_SIZES), in parallel, and its output checked against what the model says it should be:
+
+- pi: the estimate is within Z_LIMIT standard errors of pi
+- casino: the average value of every turn is within Z_LIMIT standard errors of the exact average
+  (see exact_calculator.py), and a reported standard error is within SEM_RATIO of the exact one
+- elo: the average starting elo is within Z_LIMIT standard errors of its exact mean, and the
+  average final score of the top elo quartile and the variance of the final scores are within
+  Z_LIMIT standard errors of the median of every backend's (of the other backend's, when there are
+  only two). Every game hands out one point, so the average score itself is the same whatever the
+  game model and pairings
+
+A function's family comes from its name (casino_simulation_aggregated is casino), or for sql
+queries from the family key of their scenario. Each check ends up ok, failed (with what failed in
+detail), error (the call raised) or unchecked (no family, so nothing to check it against).
+"""
+import concurrent.futures
+import math
+import multiprocessing
+import traceback
+import typing
+
+import numpy as np
+
+from mc_benchmark.calculators import elo
+from mc_benchmark.calculators.exact_calculator import casino_value_moments
+from mc_benchmark.transport import output_to_table
+
+# the most of each argument a validation call gets, by function family
+VALIDATION_SIZES = {
+    "pi": {"num_samples": 100_000},
+    "casino": {"num_samples": 2_000, "turn_limit": 200},
+    "elo": {"num_samples": 20},
+}
+# with hundreds of checks (and a casino check being one per turn) a 5 sigma bound keeps false
+# alarms rare, while bugs like a 19/38 win probability are still hundreds of sigma out
+Z_LIMIT = 5.0
+SEM_RATIO = (0.8, 1.25)
+
+
+def function_family(function_name: str) -> typing.Optional[str]:
+    for family in VALIDATION_SIZES:
+        if function_name.startswith(family):
+            return family
+    return None
+
+
+def validation_arguments(family: typing.Optional[str], function_arguments: dict) -> dict:
+    """function_arguments with every size capped at the validation size of the family."""
+    arguments = dict(function_arguments)
+    for argument, size in VALIDATION_SIZES.get(family, {}).items():
+        arguments[argument] = min(arguments.get(argument, size), size)
+    return arguments
+
+
+def _failed(detail: str, max_z: float = None) -> dict:
+    return {"status": "failed", "max_z": max_z, "detail": detail}
+
+
+def _ok(max_z: float = None) -> dict:
+    return {"status": "ok", "max_z": max_z, "detail": None}
+
+
+def check_pi(output, num_samples: int) -> dict:
+    # the variance reduced estimators return (estimate, standard error)
+    estimate = float(output[0] if isinstance(output, tuple) else output)
+    # plain monte carlo's error, which the other estimators only improve on
+    standard_error = 4 * math.sqrt(math.pi / 4 * (1 - math.pi / 4) / num_samples)
+    z = abs(estimate - math.pi) / standard_error
+    if z > Z_LIMIT:
+        return _failed(f"estimate {estimate:.6f} is {z:.1f} standard errors from pi", z)
+    return _ok(z)
+
+
+def _casino_averages(output, aggregated: bool) -> tuple[np.ndarray, np.ndarray, typing.Optional[np.ndarray]]:
+    """(turns, average value, reported standard error or None) of any backend's casino output."""
+    if isinstance(output, tuple):
+        # numba: (turns, averages, standard errors)
+        turns, averages, errors = (np.asarray(o, dtype=np.float64) for o in output)
+        return turns, averages, errors
+    if isinstance(output, (np.ndarray, list)):
+        values = np.asarray(output, dtype=np.float64)
+        if aggregated:
+            # numpy: (turn, average, samples, standard error) columns
+            return values[:, 0], values[:, 1], values[:, 3]
+        # a row per sample, a column per turn
+        return np.arange(values.shape[1], dtype=np.float64), values.mean(axis=0), None
+    table = output_to_table(output).to_pandas()
+    if "avg_value" in table.columns:
+        errors = table["avg_value_error"].to_numpy(np.float64) if "avg_value_error" in table.columns else None
+        return table["turn"].to_numpy(np.float64), table["avg_value"].to_numpy(np.float64), errors
+    # long format, a row per sample and turn
+    averages = table.groupby("turn")["value"].mean()
+    return averages.index.to_numpy(np.float64), averages.to_numpy(np.float64), None
+
+
+def check_casino(output, function_name: str, arguments: dict) -> dict:
+    num_samples = arguments.get("num_samples", 1)
+    turns, averages, errors = _casino_averages(output, "aggregated" in function_name)
+    means, deviations = casino_value_moments(
+        int(turns.max()) + 1, arguments.get("starting_value", 1000), arguments.get("win_loss_diff", 10),
+    )
+    index = turns.astype(np.int64)
+    means, deviations = means[index], deviations[index]
+    expected_errors = deviations / math.sqrt(num_samples)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # turn 0 has no spread, it has to be exactly the starting value
+        z = np.where(expected_errors > 0, np.abs(averages - means) / expected_errors, np.where(np.isclose(averages, means), 0.0, np.inf))
+    worst = int(np.argmax(z))
+    if z[worst] > Z_LIMIT:
+        return _failed(
+            f"turn {int(turns[worst])} averages {averages[worst]:.3f}, exactly {means[worst]:.3f} ({z[worst]:.1f} standard errors)",
+            float(z[worst]),
+        )
+    if errors is not None:
+        ratio = math.sqrt(np.mean(np.square(errors)) / np.mean(np.square(expected_errors)))
+        if not SEM_RATIO[0] <= ratio <= SEM_RATIO[1]:
+            return _failed(f"reported standard errors are {ratio:.2f} times the exact ones", float(z[worst]))
+    return _ok(float(z[worst]))
+
+
+def _elo_tables(output) -> tuple[np.ndarray, np.ndarray]:
+    """(starting elos, final scores) of any backend's elo output, a row per tournament and a column per player."""
+    if isinstance(output, tuple):
+        # numpy and numba: (elos, scores)
+        elos, scores = (np.asarray(o, dtype=np.float64) for o in output)
+        return elos, scores
+    table = output_to_table(output).to_pandas().sort_values(["tournament", "player_id"])
+    num_tournaments = table["tournament"].nunique()
+    return (
+        table["elo"].to_numpy(np.float64).reshape(num_tournaments, -1),
+        table["score"].to_numpy(np.float64).reshape(num_tournaments, -1),
+    )
+
+
+def _mean_and_error(values: np.ndarray) -> tuple[float, float]:
+    return float(values.mean()), float(values.std(ddof=1) / math.sqrt(len(values)))
+
+
+def check_elo(output) -> tuple[dict, typing.Optional[dict]]:
+    """
+    The starting elo check, and statistics that depend on the game model and the pairings, as
+    {name: (mean, standard error)} over tournaments, to compare across backends.
+    """
+    elos, scores = _elo_tables(output)
+    # starting elos are uniform on [INITIAL_ELO, INITIAL_ELO + ELO_RANGE)
+    standard_error = elo.ELO_RANGE / math.sqrt(12 * elos.size)
+    z = abs(elos.mean() - (elo.INITIAL_ELO + elo.ELO_RANGE / 2)) / standard_error
+    summaries = None
+    if len(elos) > 1:
+        strongest = np.argsort(-elos, axis=1)[:, :max(1, elos.shape[1] // 4)]
+        summaries = {
+            # how many points the strongest players take depends on prob_win and who they are paired with
+            "top quartile score": _mean_and_error(np.take_along_axis(scores, strongest, axis=1).mean(axis=1)),
+            # draws (prob_draw) pull scores together
+            "score variance": _mean_and_error(scores.var(axis=1, ddof=1)),
+        }
+    if z > Z_LIMIT:
+        return _failed(f"starting elos average {elos.mean():.2f} ({z:.1f} standard errors out)", z), summaries
+    return _ok(z), summaries
+
+
+def run_check(function: typing.Callable, function_name: str, family: typing.Optional[str], arguments: dict) -> dict:
+    """Call function once with arguments and check its output as family. summary is set for cross backend checks."""
+    try:
+        output = function(**arguments)
+        if family == "pi":
+            return check_pi(output, arguments.get("num_samples", 1000))
+        if family == "casino":
+            return check_casino(output, function_name, arguments)
+        if family == "elo":
+            result, summary = check_elo(output)
+            return {**result, "summary": summary}
+        return {"status": "unchecked", "max_z": None, "detail": None}
+    except Exception:
+        return {"status": "error", "max_z": None, "detail": traceback.format_exc(limit=-3)}
+
+
+def compare_summaries(results: dict) -> None:
+    """
+    Fail checks whose summaries ({name: (mean, standard error)}) disagree with the other backends'
+    for the same function and arguments. results are by (type, function, arguments json).
+
+    With three or more backends the reference is the median of all of them, so one wrong backend
+    fails on its own instead of pulling the reference away from the right ones.
+    """
+    groups: dict[tuple, list] = {}
+    for key, result in results.items():
+        if result.get("summary") is not None:
+            groups.setdefault(key[1:], []).append(key)
+    for keys in groups.values():
+        for key in keys:
+            if len(keys) < 2 or results[key]["status"] != "ok":
+                continue
+            for name, (mean, error) in results[key]["summary"].items():
+                others = [results[k]["summary"][name] for k in keys if k != key]
+                reference = float(np.median([mean, *(m for m, _ in others)])) if len(others) > 1 else others[0][0]
+                # the reference is about as uncertain as the other backends' inverse variance weighted mean
+                weights = np.array([1 / max(e, 1e-12) ** 2 for _, e in others])
+                z = abs(mean - reference) / math.sqrt(error**2 + 1 / weights.sum())
+                results[key]["max_z"] = max(results[key]["max_z"] or 0.0, z)
+                if z > Z_LIMIT:
+                    results[key].update(_failed(
+                        f"{name} {mean:.4f} disagrees with the backends' {reference:.4f} ({z:.1f} standard errors)", z,
+                    ))
+                    break
+
+
+def run_conformance(checks: dict, max_workers: int = 1) -> dict:
+    """
+    Run every check, given as {(type, function name, arguments json): (function, family, arguments)},
+    on a process pool and return their results by the same keys.
+    """
+    # fresh interpreters, forked ones can inherit locks held by numba's or duckdb's threads
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        futures = {
+            key: executor.submit(run_check, function, key[1], family, arguments)
+            for key, (function, family, arguments) in checks.items()
+        }
+        results = {key: future.result() for key, future in futures.items()}
+    compare_summaries(results)
+    return results
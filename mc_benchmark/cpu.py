@@ -0,0 +1,142 @@
+import ctypes
+import ctypes.util
+import os
+import platform
+import resource
+import struct
+import threading
+import time
+import typing
+
+# linux perf_event_open(2)
+PERF_EVENT_OPEN_SYSCALL = {"x86_64": 298, "aarch64": 241, "arm64": 241}
+PERF_TYPE_HARDWARE = 0
+HARDWARE_EVENTS = {
+    "cycles": 0,
+    "instructions": 1,
+    "cache_misses": 3,
+    "branch_misses": 5,
+}
+PERF_EVENT_IOC_ENABLE = 0x2400
+PERF_EVENT_IOC_DISABLE = 0x2401
+# perf_event_attr flags: disabled, inherit, exclude_kernel, exclude_hv
+PERF_FLAGS = 1 << 0 | 1 << 1 | 1 << 5 | 1 << 6
+PERF_ATTR_SIZE = 64
+
+
+def _thread_ids() -> list[int]:
+    if os.path.isdir("/proc/self/task"):
+        return [int(tid) for tid in os.listdir("/proc/self/task")]
+    return []
+
+
+def _thread_count() -> int:
+    return len(_thread_ids()) or threading.active_count()
+
+
+class PerfCounters:
+    """
+    Hardware counters for this process (user space only) through perf_event_open, if the kernel and
+    perf_event_paranoid allow it. A counter is opened on every existing thread with inherit set, so
+    threads started later are counted too. available is False when any counter cannot be opened.
+    """
+    def __init__(self) -> None:
+        self.fds: dict[str, list[int]] = {}
+        self.available = False
+        syscall_number = PERF_EVENT_OPEN_SYSCALL.get(platform.machine())
+        if syscall_number is None or not os.path.isdir("/proc/self/task"):
+            return
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._ioctl = libc.ioctl
+        try:
+            for name, config in HARDWARE_EVENTS.items():
+                self.fds[name] = []
+                for tid in _thread_ids():
+                    attr = ctypes.create_string_buffer(PERF_ATTR_SIZE)
+                    # type, size, config, sample_period, sample_type, read_format, flags
+                    struct.pack_into("IIQQQQQ", attr, 0, PERF_TYPE_HARDWARE, PERF_ATTR_SIZE, config, 0, 0, 0, PERF_FLAGS)
+                    fd = libc.syscall(syscall_number, attr, tid, -1, -1, 0)
+                    if fd < 0:
+                        raise OSError(ctypes.get_errno(), f"perf_event_open failed for {name}")
+                    self.fds[name].append(fd)
+            self.available = True
+        except OSError:
+            self.close()
+
+    def _all_fds(self):
+        return [fd for fds in self.fds.values() for fd in fds]
+
+    def start(self):
+        for fd in self._all_fds():
+            self._ioctl(fd, PERF_EVENT_IOC_ENABLE, 0)
+
+    def stop(self) -> dict:
+        for fd in self._all_fds():
+            self._ioctl(fd, PERF_EVENT_IOC_DISABLE, 0)
+        return {
+            name: sum(struct.unpack("Q", os.read(fd, 8))[0] for fd in fds)
+            for name, fds in self.fds.items()
+        }
+
+    def close(self):
+        for fd in self._all_fds():
+            os.close(fd)
+        self.fds = {}
+
+
+class ThreadCounter:
+    """Track the largest number of threads this process has while the body of the with block runs."""
+    def __init__(self, interval: float = 0.001) -> None:
+        self.interval = interval
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        # the counting thread itself is not part of the measurement
+        self.peak_threads = max(self.peak_threads, _thread_count() - 1)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._sample()
+        self._thread.join()
+        return False
+
+
+def cpu_usage(function: typing.Callable, arguments: dict, interval: float = 0.001, perf: bool = True) -> dict:
+    """
+    CPU resources used by one call: wall, user and system time (seconds), context switches and page
+    faults from getrusage of this process (all threads; process pool workers are not included),
+    the peak thread count, and with perf the hardware counters (None where unavailable).
+    """
+    counters = PerfCounters() if perf else None
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    with ThreadCounter(interval) as thread_counter:
+        if counters is not None and counters.available:
+            counters.start()
+        start = time.perf_counter()
+        function(**arguments)
+        end = time.perf_counter()
+        hardware = counters.stop() if counters is not None and counters.available else {}
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    if counters is not None:
+        counters.close()
+    return {
+        "wall_time": end - start,
+        "user_time": after.ru_utime - before.ru_utime,
+        "system_time": after.ru_stime - before.ru_stime,
+        "voluntary_switches": after.ru_nvcsw - before.ru_nvcsw,
+        "involuntary_switches": after.ru_nivcsw - before.ru_nivcsw,
+        "minor_faults": after.ru_minflt - before.ru_minflt,
+        "major_faults": after.ru_majflt - before.ru_majflt,
+        "peak_threads": thread_counter.peak_threads,
+        **{name: hardware.get(name) for name in HARDWARE_EVENTS},
+    }
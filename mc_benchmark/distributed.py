@@ -0,0 +1,277 @@
+"""
+Running scenarios on other machines.
+
+`python bm.py worker` listens on a TCP port and runs the scenarios a coordinator sends it (as the
+dicts Scenario.from_dict takes) in fresh processes with the normal profilers, several at once on
+the cores the coordinator picks. `python bm.py benchmark --workers host:port,...` makes the
+benchmark process a coordinator: it schedules scenarios onto its workers' cores instead of its own
+and records what comes back in its own duckdb file. Result and output files travel back as bytes.
+
+Connections use multiprocessing.connection, so messages are pickles: workers only accept
+coordinators that know their authkey (MC_BENCHMARK_AUTHKEY), listen on localhost by default, and
+refuse to listen anywhere else without MC_BENCHMARK_AUTHKEY set.
+"""
+import ipaddress
+import os
+import pathlib
+import socket
+import struct
+import tempfile
+import time
+import typing
+import multiprocessing
+import multiprocessing.connection
+
+from mc_benchmark import DEFAULT_PORT
+from mc_benchmark.benchmark import Scenario, available_cores, exit_on_termination, kill_scenario_process
+
+# the fallback is public, so it is only good enough for workers on localhost
+DEFAULT_AUTHKEY = b"mc-benchmark"
+AUTHKEY = os.environ.get("MC_BENCHMARK_AUTHKEY", "").encode() or DEFAULT_AUTHKEY
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    if not host:
+        return port, DEFAULT_PORT
+    return host, int(port)
+
+
+def is_loopback(host: str) -> bool:
+    """True if every address host resolves to is a loopback address."""
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except socket.gaierror:
+        return False
+    return bool(addresses) and all(ipaddress.ip_address(address.split("%")[0]).is_loopback for address in addresses)
+
+
+def connect(address: tuple[str, int], authkey: bytes, timeout: float):
+    """
+    multiprocessing.connection.Client, with a timeout on connecting and on the authkey handshake,
+    e.g. for a worker still busy with another coordinator. Returns the connection and the worker's
+    hello message.
+    """
+    sock = socket.create_connection(address, timeout=timeout)
+    # Connection reads from a blocking socket, which times out with SO_RCVTIMEO instead
+    sock.settimeout(None)
+    seconds = int(timeout)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, struct.pack("ll", seconds, int((timeout - seconds) * 1e6)))
+    connection = multiprocessing.connection.Connection(sock.detach())
+    try:
+        multiprocessing.connection.answer_challenge(connection, authkey)
+        multiprocessing.connection.deliver_challenge(connection, authkey)
+        hello = connection.recv()
+        with socket.socket(fileno=os.dup(connection.fileno())) as duplicate:
+            duplicate.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, struct.pack("ll", 0, 0))
+    except BaseException:
+        connection.close()
+        raise
+    return connection, hello
+
+
+def _read_files(paths: list[str]) -> dict[str, bytes]:
+    files = {}
+    for path in paths:
+        files[pathlib.Path(path).name] = pathlib.Path(path).read_bytes()
+        os.remove(path)
+    return files
+
+
+def serve_coordinator(connection, cores: list[int]) -> None:
+    """Run scenarios for one coordinator until it disconnects, then kill whatever is still running."""
+    connection.send({"hostname": socket.gethostname(), "cores": cores})
+    running = {}
+    with tempfile.TemporaryDirectory() as folder, exit_on_termination():
+        try:
+            while True:
+                receivers = {run["receiver"]: i for i, run in running.items()}
+                ready = multiprocessing.connection.wait([connection, *receivers])
+                if connection in ready:
+                    message = connection.recv()
+                    if message[0] == "run":
+                        _, i, spec, task = message
+                        paths = {
+                            "result_path": pathlib.Path(folder) / f"{i}.arrow",
+                            "output_path": pathlib.Path(folder) / "outputs" / f"{i}.arrow" if task["retain_output"] else None,
+                        }
+                        receiver, sender = multiprocessing.Pipe(duplex=False)
+                        p = Scenario.from_dict(spec).to_process(
+                            sender, cores=task["cores"], max_memory=task["max_memory"], timeout=task["timeout"], **paths
+                        )
+                        p.start()
+                        sender.close()
+                        running[i] = {"process": p, "receiver": receiver}
+                    elif message[0] == "kill" and message[1] in running:
+                        run = running.pop(message[1])
+                        kill_scenario_process(run["process"])
+                        run["receiver"].close()
+
+                for receiver, i in receivers.items():
+                    # already killed, or still running
+                    if i not in running or receiver not in ready:
+                        continue
+                    run = running.pop(i)
+                    try:
+                        result, exec_time, profile = receiver.recv()
+                    except EOFError:
+                        run["process"].join()
+                        connection.send(("exited", i, run["process"].exitcode))
+                        continue
+                    finally:
+                        receiver.close()
+                    run["process"].join()
+                    result = _read_files([result])[pathlib.Path(result).name] if result is not None else None
+                    outputs = _read_files(profile.pop("output_paths", []))
+                    connection.send(("done", i, result, exec_time, profile, outputs))
+        except (EOFError, OSError):
+            pass
+        finally:
+            for run in running.values():
+                kill_scenario_process(run["process"])
+
+
+def serve(host: str = "localhost", port: int = DEFAULT_PORT, cores: typing.Optional[list[int]] = None, authkey: bytes = AUTHKEY) -> None:
+    """Serve coordinators one after another, forever."""
+    if authkey == DEFAULT_AUTHKEY and not is_loopback(host):
+        raise ValueError(
+            f"Refusing to listen on {host} with the default authkey, anyone who can reach it could run code here. "
+            "Set MC_BENCHMARK_AUTHKEY to a secret shared with the coordinator."
+        )
+    cores = cores if cores is not None else available_cores()
+    with multiprocessing.connection.Listener((host, port), authkey=authkey) as listener:
+        print(f"Worker listening on {host}:{port} with cores {cores}")
+        while True:
+            try:
+                connection = listener.accept()
+            except (multiprocessing.AuthenticationError, OSError) as error:
+                print(f"Rejected a connection: {error}")
+                continue
+            print(f"Coordinator connected from {listener.last_accepted}")
+            serve_coordinator(connection, cores)
+            connection.close()
+            print("Coordinator disconnected")
+
+
+class RemoteWorker:
+    """
+    The coordinator's end of a connection to a worker. A worker that cannot be reached or drops
+    its connection is reconnected to, up to retries times in total, retry_delay seconds apart.
+    Connecting gives up after timeout seconds.
+    """
+    def __init__(
+            self,
+            address: str,
+            authkey: bytes = AUTHKEY,
+            retries: int = 3,
+            retry_delay: float = 1.0,
+            timeout: float = 10.0,
+        ) -> None:
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.connection = None
+        self.cores: list[int] = []
+        self.failures = 0
+        self._next_attempt = 0.0
+        # messages for scenarios that finished on the worker, by scenario number
+        self.finished: dict[int, tuple] = {}
+
+    @property
+    def alive(self) -> bool:
+        return self.connection is not None
+
+    @property
+    def given_up(self) -> bool:
+        return not self.alive and self.failures > self.retries
+
+    @property
+    def next_attempt(self) -> typing.Optional[float]:
+        """time.monotonic() at which connect will try again, None if connected or given up."""
+        return None if self.alive or self.given_up else self._next_attempt
+
+    def connect(self) -> bool:
+        """Connect if not connected, unless it is too early to retry. Never waits for the retry delay."""
+        if self.alive:
+            return True
+        if self.given_up or time.monotonic() < self._next_attempt:
+            return False
+        try:
+            self.connection, hello = connect(self.address, self.authkey, self.timeout)
+            self.cores = hello["cores"]
+            return True
+        except (OSError, EOFError, multiprocessing.AuthenticationError) as error:
+            print(f"Could not connect to worker {self}: {error}")
+            self._failed()
+            return False
+
+    def _failed(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = None
+        self.failures += 1
+        self._next_attempt = time.monotonic() + self.retry_delay
+
+    def disconnect(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = None
+
+    def run(
+            self,
+            i: int,
+            scenario: Scenario,
+            cores: list[int],
+            max_memory: typing.Optional[float],
+            timeout: typing.Optional[float] = None,
+        ) -> None:
+        if scenario.spec is None:
+            raise ValueError("Only scenarios made with Scenario.from_dict can run on a worker")
+        task = {"cores": cores, "max_memory": max_memory, "timeout": timeout, "retain_output": scenario.retain_output}
+        try:
+            self.connection.send(("run", i, scenario.spec, task))
+        except OSError:
+            self._failed()
+
+    def kill(self, i: int) -> None:
+        try:
+            self.connection.send(("kill", i))
+        except (OSError, AttributeError):
+            pass
+
+    def receive(self) -> None:
+        """Read every message waiting on the connection into finished."""
+        try:
+            while self.connection.poll():
+                message = self.connection.recv()
+                self.finished[message[1]] = message
+        except (EOFError, OSError):
+            print(f"Lost the connection to worker {self}")
+            self._failed()
+
+    def collect(self, i: int, result_path: pathlib.Path, output_path: typing.Optional[pathlib.Path]):
+        """
+        A finished scenario as (result, exec_time, profile, exited), like a local one, with its result
+        written to result_path and its outputs next to output_path. exec_time is None if it exited.
+        """
+        message = self.finished.pop(i)
+        if message[0] == "exited":
+            return None, None, {}, True
+        _, _, result, exec_time, profile, outputs = message
+        if result is not None:
+            result_path.write_bytes(result)
+            result = str(result_path)
+        if outputs:
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            profile["output_paths"] = []
+            for name, data in outputs.items():
+                # the worker named them after the scenario number, keep the rest (e.g. _0 for tuples)
+                path = output_path.with_name(output_path.stem + name[len(str(i)):])
+                path.write_bytes(data)
+                profile["output_paths"].append(str(path))
+        return result, exec_time, profile, False
+
+    def __repr__(self) -> str:
+        return f"{self.address[0]}:{self.address[1]}"
@@ -0,0 +1,101 @@
+import functools
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import typing
+
+MIB = 1024 * 1024
+# ru_maxrss is in KiB on linux and in bytes on macos
+MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+@functools.lru_cache(maxsize=None)
+def _rss_reader(pid: int) -> typing.Callable[[], int]:
+    """Returns a function giving the resident set size of process pid in bytes, as cheaply as possible."""
+    if os.path.exists(f"/proc/{pid}/statm"):
+        # keep the file open and pread it, the second field is resident pages
+        fd = os.open(f"/proc/{pid}/statm", os.O_RDONLY)
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        return lambda: int(os.pread(fd, 128, 0).split()[1]) * page_size
+    import psutil  # installed with memory_profiler
+
+    process = psutil.Process(pid)
+    return lambda: process.memory_info().rss
+
+
+def _reset_peak_rss() -> bool:
+    # writing 5 to clear_refs resets the high water mark getrusage reports (linux >= 4.0)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class MemorySampler:
+    """
+    Sample this process' resident memory from a background thread while the body of the with block runs.
+
+    Samples are (seconds since start, MiB) pairs taken every interval seconds. Sampling needs the
+    GIL, so while pure python code holds it the effective interval is the interpreter's switch
+    interval (5ms by default); numpy, numba, duckdb and polars release it for their heavy lifting.
+    peak_rss is the kernel's high water mark from getrusage, which also sees peaks between
+    samples. Where the high water mark cannot be reset it falls back to the largest sample.
+    With trace_allocations, traced_peak is tracemalloc's peak of python and numpy allocations.
+    """
+    def __init__(self, interval: float = 0.0005, trace_allocations: bool = False) -> None:
+        self.interval = interval
+        self.trace_allocations = trace_allocations
+        self.timestamps: list[float] = []
+        self.samples: list[float] = []
+        self.peak_rss: typing.Optional[float] = None
+        self.traced_peak: typing.Optional[float] = None
+        # keyed on the pid, as a forked child would otherwise read its parent's open file
+        self._read_rss = _rss_reader(os.getpid())
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        self.timestamps.append(time.perf_counter() - self._start)
+        self.samples.append(self._read_rss() / MIB)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._peak_reset = _reset_peak_rss()
+        if self.trace_allocations:
+            tracemalloc.start()
+        self._start = time.perf_counter()
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        if self.trace_allocations:
+            self.traced_peak = tracemalloc.get_traced_memory()[1] / MIB
+            tracemalloc.stop()
+        if self._peak_reset:
+            self.peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT / MIB
+        else:
+            self.peak_rss = max(self.samples)
+        return False
+
+
+def memory_usage(function: typing.Callable, arguments: dict, interval: float = 0.0005, trace_allocations: bool = False) -> dict:
+    with MemorySampler(interval, trace_allocations) as sampler:
+        function(**arguments)
+    return {
+        "data": sampler.samples,
+        "timestamps": sampler.timestamps,
+        "peak_rss": sampler.peak_rss,
+        "traced_peak": sampler.traced_peak,
+    }
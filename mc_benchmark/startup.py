@@ -0,0 +1,50 @@
+"""
+Cold start measurement for the startup scenario type.
+
+Run as `python -m mc_benchmark.startup [library]` in a fresh interpreter, with a pickled
+(function, arguments) pair on stdin. Prints a json line of timings in seconds: importing the
+backend library (null without one), unpickling the function (which imports the calculators), the first call, the
+part of the first call numba spent compiling, and a second call for comparison.
+"""
+import contextlib
+import importlib
+import json
+import pickle
+import sys
+import time
+import typing
+
+
+def measure(library: typing.Optional[str], payload: bytes) -> dict:
+    timings = {"library_import": None}
+
+    if library is not None:
+        start = time.perf_counter()
+        importlib.import_module(library)
+        timings["library_import"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    function, arguments = pickle.loads(payload)
+    timings["calculator_import"] = time.perf_counter() - start
+
+    compile_times = []
+    timer = contextlib.nullcontext()
+    if "numba" in sys.modules:
+        from numba.core import event
+        # only counts the outermost compilation, nested ones are part of it
+        timer = event.install_timer("numba:compile", compile_times.append)
+    start = time.perf_counter()
+    with timer:
+        function(**arguments)
+    timings["first_call"] = time.perf_counter() - start
+    timings["jit_compile"] = sum(compile_times)
+
+    start = time.perf_counter()
+    function(**arguments)
+    timings["second_call"] = time.perf_counter() - start
+    return timings
+
+
+if __name__ == "__main__":
+    timings = measure(sys.argv[1] if len(sys.argv) > 1 else None, sys.stdin.buffer.read())
+    print(json.dumps(timings))
@@ -0,0 +1,94 @@
+import math
+import statistics
+import typing
+
+
+def relative_ci(values: list[float], statistic: str = "mean", confidence: float = 0.95) -> float:
+    """Half width of the confidence interval of the statistic, relative to the statistic."""
+    n = len(values)
+    if n < 2:
+        return math.inf
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    if statistic == "mean":
+        centre = statistics.fmean(values)
+        half_width = z * statistics.stdev(values) / math.sqrt(n)
+    elif statistic == "median":
+        # distribution free: the interval between the order statistics either side of the median
+        ordered = sorted(values)
+        centre = statistics.median(ordered)
+        offset = z * math.sqrt(n) / 2
+        low = max(0, math.floor(n / 2 - offset))
+        high = min(n - 1, math.ceil(n / 2 + offset))
+        half_width = (ordered[high] - ordered[low]) / 2
+    else:
+        raise ValueError(f"Unknown statistic {statistic}, expected mean or median.")
+    if centre == 0:
+        return math.inf if half_width else 0.0
+    return half_width / abs(centre)
+
+
+def warmup_runs(values: list[float], threshold: float = 5.0) -> int:
+    """
+    Number of leading runs that are slow outliers compared to the rest, e.g. jit compilation or cold
+    caches. A run is an outlier when it is more than threshold (scaled) median absolute deviations
+    above the median. At most half of the runs are ever counted as warm up.
+    """
+    if len(values) < 3:
+        return 0
+    median = statistics.median(values)
+    mad = 1.4826 * statistics.median(abs(v - median) for v in values)
+    # constant measurements (e.g. peak memory) have no spread, so allow 1% before calling it warm up
+    limit = median + threshold * max(mad, 0.01 * abs(median))
+    count = 0
+    for value in values[:len(values) // 2]:
+        if value <= limit:
+            break
+        count += 1
+    return count
+
+
+class AdaptiveStopping:
+    """
+    Stopping rule for the profilers: keep running until the confidence interval of the statistic
+    (mean or median) of the runs after warm up is within target_relative_ci of it, or until
+    max_runs or max_time (seconds) is used up.
+    """
+    def __init__(
+            self,
+            target_relative_ci: float = 0.02,
+            statistic: str = "mean",
+            confidence: float = 0.95,
+            min_runs: int = 5,
+            max_runs: int = 1000,
+            max_time: float = 60,
+            warmup_threshold: float = 5.0,
+        ) -> None:
+        self.target_relative_ci = target_relative_ci
+        self.statistic = statistic
+        self.confidence = confidence
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+        self.max_time = max_time
+        self.warmup_threshold = warmup_threshold
+
+    @classmethod
+    def from_config(cls, config: typing.Union[bool, dict, None]) -> typing.Optional["AdaptiveStopping"]:
+        # profiler_arguments: {adaptive: true} or {adaptive: {target_relative_ci: 0.01, ...}}
+        if not config:
+            return None
+        if config is True:
+            return cls()
+        return cls(**config)
+
+    def check(self, values: list[float], elapsed: float) -> tuple[typing.Optional[str], int, float]:
+        """Returns (stop reason or None to keep going, number of warm up runs, relative ci)."""
+        warmup = warmup_runs(values, self.warmup_threshold)
+        kept = values[warmup:]
+        ci = relative_ci(kept, self.statistic, self.confidence)
+        if len(kept) >= self.min_runs and ci <= self.target_relative_ci:
+            return "converged", warmup, ci
+        if len(values) >= self.max_runs:
+            return "max_runs", warmup, ci
+        if elapsed >= self.max_time:
+            return "max_time", warmup, ci
+        return None, warmup, ci
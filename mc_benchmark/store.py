@@ -0,0 +1,235 @@
+"""
+Long format, hive partitioned parquet store of every benchmark run.
+
+    store/runs/run_id=<run>/run.parquet
+        one row per run: the scenario file, when it started and the environment it ran in
+    store/measurements/run_id=<run>/type=<backend>/function=<function>/scenario_<n>.parquet
+        one row per measurement: per iteration for time, startup and cpu scenarios (one row per
+        metric), per sample for memory scenarios. Over budget scenarios get a single row without one.
+
+Files are only ever added, a scenario's file is written as soon as its result is recorded.
+"""
+import datetime
+import functools
+import hashlib
+import json
+import os
+import platform
+import socket
+import subprocess
+import typing
+import uuid
+
+from mc_benchmark import store_folder
+from mc_benchmark.cache import library_versions
+
+# the fields of each scenario type's result structs that become metrics
+STRUCT_METRICS = {
+    "memory": ["peak_rss", "traced_peak"],
+    "startup": ["library_import", "calculator_import", "first_call", "jit_compile", "second_call", "process_total"],
+    "cpu": [
+        "wall_time",
+        "user_time",
+        "system_time",
+        "voluntary_switches",
+        "involuntary_switches",
+        "minor_faults",
+        "major_faults",
+        "peak_threads",
+        "cycles",
+        "instructions",
+        "cache_misses",
+        "branch_misses",
+    ],
+}
+
+MEASUREMENTS_GLOB = "measurements/*/*/*/*.parquet"
+
+
+def _cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=store_folder.parent.parent,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def environment() -> dict:
+    """What the measurements depend on besides the code: machine, operating system and library versions."""
+    return {
+        "hostname": socket.gethostname(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_model": _cpu_model(),
+        "cpu_count": os.cpu_count(),
+        "memory_mib": os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2**20 if hasattr(os, "sysconf") else None,
+        "git_commit": _git_commit(),
+        "libraries": library_versions(),
+    }
+
+
+def environment_fingerprint() -> str:
+    return hashlib.sha256(json.dumps(environment(), sort_keys=True).encode()).hexdigest()[:16]
+
+
+def partition_value(value: str) -> str:
+    # query names are paths, e.g. roulette/reccte
+    return value.replace("/", ".")
+
+
+COMMON_COLUMNS = """
+    $run_id as run_id,
+    $scenario_name as scenario_name,
+    $fingerprint as fingerprint,
+    cache_key,
+    scenario_number,
+    scenario_type,
+    num_samples,
+    num_threads,
+    function_arguments.roulette_sim.turn_limit as turn_limit,
+    extra_arguments,
+    profiler_arguments,
+    total_time,
+    stop_reason,
+    warmup_runs,
+    relative_ci,
+    status
+"""
+
+
+def measurement_query(scenario_type: typing.Optional[str]) -> str:
+    """
+    The long format rows of the result_cache row with cache_key $cache_key, as the common columns
+    then iteration, metric, value and time_s. scenario_type None is for rows without a result.
+    """
+    scenario = "scenario as (select * from result_cache where cache_key = $cache_key)"
+    if scenario_type is None:
+        return f"""
+            with {scenario}
+            select {COMMON_COLUMNS}, null::integer as iteration, null::text as metric, null::double as value, null::double as time_s
+            from scenario
+        """
+    if scenario_type == "time":
+        return f"""
+            with {scenario}
+            select
+                {COMMON_COLUMNS},
+                cast(unnest(range(1, len(result.time_result) + 1)) as integer) as iteration,
+                'time' as metric,
+                unnest(result.time_result) as value,
+                null::double as time_s
+            from scenario
+        """
+    metrics = STRUCT_METRICS[scenario_type]
+    query = f"""
+        with {scenario},
+        iterations as (
+            select *, unnest(result.{scenario_type}_result) as r from scenario
+        )
+        select *, null::double as time_s
+        from (
+            unpivot (
+                select
+                    {COMMON_COLUMNS},
+                    r.function_iteration as iteration,
+                    {", ".join(f"cast(r.{metric} as double) as {metric}" for metric in metrics)}
+                from iterations
+            )
+            on {", ".join(metrics)}
+            into name metric value value
+        )
+    """
+    if scenario_type == "memory":
+        query += f"""
+            union all
+            select
+                {COMMON_COLUMNS},
+                r.function_iteration as iteration,
+                'rss_mib' as metric,
+                unnest(r.data) as value,
+                unnest(r.timestamps) as time_s
+            from iterations
+        """
+    return query
+
+
+class ResultStore:
+    """One benchmark run's part of the store."""
+    def __init__(self, scenario_name: str, folder=store_folder) -> None:
+        self.scenario_name = scenario_name
+        self.folder = folder
+        # sortable by start time
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.run_id = f"{self.started_at:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.fingerprint = environment_fingerprint()
+
+    def start_run(self, con) -> None:
+        folder = self.folder / "runs" / f"run_id={self.run_id}"
+        folder.mkdir(parents=True, exist_ok=True)
+        con.execute(
+            f"""
+            copy (
+                select
+                    $scenario_name as scenario_name,
+                    $started_at::timestamptz as started_at,
+                    $fingerprint as fingerprint,
+                    $environment::json as environment
+            ) to '{folder / "run.parquet"}' (format parquet)
+            """,
+            {
+                "scenario_name": self.scenario_name,
+                "started_at": self.started_at.isoformat(),
+                "fingerprint": self.fingerprint,
+                "environment": json.dumps(environment()),
+            },
+        )
+
+    def stored_keys(self, con) -> set:
+        """Cache keys of this scenario file that are in the store from any run."""
+        if not any(self.folder.glob(MEASUREMENTS_GLOB)):
+            return set()
+        return {
+            key for (key,) in con.execute(
+                f"""
+                select distinct cache_key
+                from read_parquet('{self.folder / MEASUREMENTS_GLOB}', hive_partitioning = true)
+                where scenario_name = $scenario_name
+                """,
+                {"scenario_name": self.scenario_name},
+            ).fetchall()
+        }
+
+    def append(self, con, cache_key: str) -> None:
+        """Write the result_cache row of cache_key to this run's part of the store."""
+        type, function, scenario_number, scenario_type, status = con.execute(
+            "select type, function, scenario_number, scenario_type, status from result_cache where cache_key = $cache_key",
+            {"cache_key": cache_key},
+        ).fetchone()
+        folder = (
+            self.folder / "measurements" / f"run_id={self.run_id}" / f"type={type}" / f"function={partition_value(function)}"
+        )
+        folder.mkdir(parents=True, exist_ok=True)
+        # over budget (and none) scenarios have no measurements, they get a row with the rest
+        has_measurements = status == "ok" and (scenario_type == "time" or scenario_type in STRUCT_METRICS)
+        query = measurement_query(scenario_type if has_measurements else None)
+        con.execute(
+            f"""
+            copy (
+                {query}
+            ) to '{folder / f"scenario_{scenario_number}.parquet"}' (format parquet)
+            """,
+            {"cache_key": cache_key, "run_id": self.run_id, "scenario_name": self.scenario_name, "fingerprint": self.fingerprint},
+        )
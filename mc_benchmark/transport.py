@@ -0,0 +1,68 @@
+"""
+Moving results from scenario processes to the benchmark process as Arrow IPC files.
+
+A scenario writes its profiler result (and optionally the calculator's own output) to a file and
+only sends the path back over its pipe, so nothing big goes through the pipe or gets pickled. The
+benchmark process memory maps the file and hands it to duckdb as Arrow.
+"""
+import pathlib
+import typing
+
+import numpy as np
+import pyarrow as pa
+
+
+def _list_to_arrow(values: list) -> pa.Array:
+    if values and isinstance(values[0], dict):
+        # build the struct from the dicts' own key order (the column order of the results
+        # schema); letting pyarrow infer it would sort the fields by name
+        keys = list(values[0])
+        fields = [pa.array([v[k] for v in values]) for k in keys]
+        return pa.StructArray.from_arrays(fields, names=keys)
+    return pa.array(values)
+
+
+def write_result(result: list, path: pathlib.Path) -> None:
+    """Write a profiler result (a list of timings or of per-iteration dicts) as a one row table."""
+    values = _list_to_arrow(result)
+    table = pa.table({"result": pa.ListArray.from_arrays(pa.array([0, len(values)], pa.int32()), values)})
+    with pa.ipc.new_file(str(path), table.schema) as writer:
+        writer.write_table(table)
+
+
+def read_table(path: typing.Union[str, pathlib.Path]) -> pa.Table:
+    # memory mapped, the buffers are not copied until duckdb reads them
+    return pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+
+
+def output_to_table(output) -> pa.Table:
+    """Calculator outputs (arrow or polars tables, numpy arrays, lists, scalars) as an Arrow table."""
+    if isinstance(output, pa.Table):
+        return output
+    if hasattr(output, "to_arrow"):
+        # polars
+        return output.to_arrow()
+    if hasattr(output, "to_numpy") and hasattr(output, "columns"):
+        # pandas
+        return pa.Table.from_pandas(output)
+    array = np.asarray(output)
+    if array.ndim == 0:
+        return pa.table({"value": [array.item()]})
+    if array.ndim == 1:
+        return pa.table({"value": array})
+    array = array.reshape(len(array), -1)
+    return pa.table({f"column_{j}": array[:, j] for j in range(array.shape[1])})
+
+
+def write_output(output, path: pathlib.Path) -> list[str]:
+    """Write a calculator's output next to path; tuples (e.g. elo ratings and scores) get a file per element."""
+    if isinstance(output, tuple):
+        outputs = {path.with_name(f"{path.stem}_{n}{path.suffix}"): o for n, o in enumerate(output)}
+    else:
+        outputs = {path: output}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    for output_path, o in outputs.items():
+        table = output_to_table(o)
+        with pa.ipc.new_file(str(output_path), table.schema) as writer:
+            writer.write_table(table)
+    return [str(p) for p in outputs]
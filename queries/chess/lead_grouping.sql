@@ -1,10 +1,16 @@
-with result as (
+-- one swiss round for every tournament in players(tournament, player_id, elo, score),
+-- returns the score each player gains this round.
+-- needs the prob_win / prob_draw macros (see DuckDBCalculator.elo_calculator)
+-- materialized, so both players of a game see the same random draw rather than the
+-- cte being evaluated once for each side of the union below
+with result as materialized (
     select
+        tournament,
         score,
         player_id as l_player_id,
         elo as l_elo,
-        lead(player_id, ceil(num_in_group / 2)) over (partition by score order by elo desc) as r_player_id,
-        lead(elo, ceil(num_in_group / 2)) over (partition by score order by elo desc) as r_elo,
+        lead(player_id, ceil(num_in_group / 2)) over (partition by tournament, score order by elo desc) as r_player_id,
+        lead(elo, ceil(num_in_group / 2)) over (partition by tournament, score order by elo desc) as r_elo,
         prob_win(l_elo, r_elo) as pw,
         prob_draw(l_elo, r_elo) as pd,
         case
@@ -15,6 +21,7 @@ with result as (
         end as l_score_diff
     from (
         select
+            tournament,
             player_id,
             score,
             elo,
@@ -23,21 +30,24 @@ with result as (
     )
     inner join (
         select
+            tournament,
             score,
             count(*) as num_in_group
         from players
-        group by score
-    ) using (score)
-    qualify row_number() over (partition by score order by elo desc) <= ceil(num_in_group / 2)
+        group by tournament, score
+    ) using (tournament, score)
+    qualify row_number() over (partition by tournament, score order by elo desc) <= ceil(num_in_group / 2)
 ),
 
 scores as (
     select
+        tournament,
         l_player_id as player_id,
         l_score_diff as score_diff
     from result
     union all
     select
+        tournament,
         r_player_id as player_id,
         1 - l_score_diff as score_diff
     from result
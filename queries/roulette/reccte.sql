@@ -1,26 +1,27 @@
 -- this one is pretty quick!
-explain analyze
+-- parameters: $num_samples, $turn_limit, $starting_value, $win_loss_diff
 with recursive casino as (
     select
         cast(generate_series as int) as sample,
-        cast(1000 as int) as value,
+        cast($starting_value as int) as value,
         cast(0 as int) as turn
-    from generate_series(1, 1000)
+    from generate_series(1, $num_samples)
     union all
     select
         casino.sample,
         case
             when casino.value = 0 then 0
-        else casino.value + (
+        -- a bet bigger than what is left takes it to 0, not below
+        else greatest(casino.value + (
             case
-                when floor(random() * (37)) >= 19 then 10
-                else -10
+                when floor(random() * (37)) >= 19 then $win_loss_diff
+                else -$win_loss_diff
             end
-        )
+        ), 0)
         end as value,
         casino.turn + 1 as turn
     from casino
-    where value >= 0 and casino.turn < 100
+    where value >= 0 and casino.turn < $turn_limit
 )
 
 select * from casino
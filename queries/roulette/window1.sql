@@ -1,27 +1,36 @@
 -- slower
-explain analyze
+-- parameters: $num_samples, $turn_limit, $starting_value, $win_loss_diff
 with setup as (
     select
         samples.generate_series as sample,
         turns.generate_series as turn,
-        1000 as value,
-    from generate_series(1, 1000) as samples
-    cross join generate_series(1, 1000) as turns
+        $starting_value as value,
+    from generate_series(1, $num_samples) as samples
+    cross join generate_series(1, $turn_limit) as turns
 ),
 
 randoms as (
     select
         *,
-        case when floor(random() * (37)) >= 19 then 10 else -10 end as value_diff,
+        case when floor(random() * (37)) >= 19 then $win_loss_diff else -$win_loss_diff end as value_diff,
     from setup
 ),
 
-calc as (
+walk as (
     select
         sample,
         turn,
         value + sum(value_diff) over (partition by sample order by turn) as value
     from randoms
+),
+
+calc as (
+    select
+        sample,
+        turn,
+        -- 0 from the first turn the walk gets to 0
+        case when min(value) over (partition by sample order by turn) <= 0 then 0 else value end as value
+    from walk
 )
 
 select * from calc
@@ -1,17 +1,23 @@
 -- slowest
-explain analyze
+-- parameters: $num_samples, $turn_limit, $starting_value, $win_loss_diff
+with walk as (
+    select
+        samples.generate_series as sample,
+        turns.generate_series as turn,
+        $starting_value + sum(
+            case
+                when floor(random() * (37)) >= 19
+                then $win_loss_diff else -$win_loss_diff end
+        ) over (
+            partition by sample order by turn
+        ) as value
+    from generate_series(1, $num_samples) as samples
+    cross join generate_series(1, $turn_limit) as turns
+)
+
 select
-    samples.generate_series as sample,
-    turns.generate_series as turn,
-    1000 + sum(
-        -- this doesn't account for negative values
-        -- but that doesn't matter for speed purposes
-        -- as that would be one extra window function!
-        case
-            when floor(random() * (37)) >= 19
-            then 10 else -10 end
-    ) over (
-        partition by sample order by turn
-    ) as value
-from generate_series(1, 1000) as samples
-cross join generate_series(1, 100) as turns
+    sample,
+    turn,
+    -- 0 from the first turn the walk gets to 0, one extra window function
+    case when min(value) over (partition by sample order by turn) <= 0 then 0 else value end as value
+from walk
@@ -0,0 +1,78 @@
+import math
+
+import numpy as np
+import pytest
+
+from mc_benchmark.compare import MIN_RUNS, bootstrap_ratio_ci, compare_samples, mann_whitney
+
+
+def test_mann_whitney_matches_scipy_asymptotic():
+    # scipy.stats.mannwhitneyu's documented example, two sided asymptotic p-value 0.11134688653314041
+    males = [19, 22, 16, 29, 24]
+    females = [20, 11, 17, 12]
+    assert mann_whitney(females, males) == pytest.approx(0.11134688653314041 / 2)
+
+
+def test_mann_whitney_separated_samples():
+    # U = 25 of 25, z = (25 - 12.5 - 0.5) / sqrt(25 * 11 / 12)
+    assert mann_whitney([1, 2, 3, 4, 5], [6, 7, 8, 9, 10]) == pytest.approx(0.00609289, abs=1e-8)
+    # U = 0, the continuity correction moves z away from the candidate being larger
+    assert mann_whitney([6, 7, 8, 9, 10], [1, 2, 3, 4, 5]) == pytest.approx(0.99669232, abs=1e-8)
+
+
+def test_mann_whitney_ties():
+    # average ranks 3 and 6 for the three 2s and 3s: U = 13, tie term 48 / 56
+    assert mann_whitney([1, 2, 2, 3], [2, 3, 3, 4]) == pytest.approx(0.08601685, abs=1e-8)
+
+
+def test_mann_whitney_constant_samples():
+    assert mann_whitney([1.0, 1.0, 1.0], [1.0, 1.0, 1.0]) == 0.5
+
+
+def test_mann_whitney_is_one_sided():
+    rng = np.random.default_rng(1)
+    baseline = rng.normal(1.0, 0.05, 30)
+    slower = baseline * 1.2
+    assert mann_whitney(baseline, slower) < 1e-6
+    assert mann_whitney(slower, baseline) > 1 - 1e-6
+
+
+def test_bootstrap_ratio_ci_covers_the_ratio():
+    rng = np.random.default_rng(2)
+    baseline = rng.normal(1.0, 0.05, 50)
+    low, high = bootstrap_ratio_ci(baseline, 2 * baseline)
+    # every resample's median doubles too, but the two are resampled independently
+    assert low < 2 < high
+    assert low > 1.8 and high < 2.2
+    low, high = bootstrap_ratio_ci(baseline, rng.normal(1.0, 0.05, 50))
+    assert low < 1 < high
+
+
+def test_bootstrap_ratio_ci_is_deterministic_and_ordered():
+    baseline, candidate = [1.0, 1.1, 0.9, 1.05], [1.2, 1.3, 1.1, 1.25]
+    assert bootstrap_ratio_ci(baseline, candidate, seed=3) == bootstrap_ratio_ci(baseline, candidate, seed=3)
+    low, high = bootstrap_ratio_ci(baseline, candidate, confidence=0.5)
+    wide_low, wide_high = bootstrap_ratio_ci(baseline, candidate, confidence=0.99)
+    assert wide_low <= low <= high <= wide_high
+    assert not math.isnan(low)
+
+
+def test_same_distribution_is_not_a_regression():
+    # reruns of unchanged code: lognormal timings, with the second run as a whole shifted a little
+    rng = np.random.default_rng(4)
+    for _ in range(200):
+        num_runs = rng.integers(MIN_RUNS, 40)
+        baseline = rng.lognormal(0.0, 0.3, num_runs)
+        candidate = rng.lognormal(rng.normal(0.0, 0.05), 0.3, num_runs)
+        assert compare_samples(list(baseline), list(candidate))["verdict"] != "regression"
+
+
+def test_clear_slowdown_is_a_regression():
+    rng = np.random.default_rng(5)
+    baseline = rng.lognormal(0.0, 0.1, 20)
+    assert compare_samples(list(baseline), list(2 * rng.lognormal(0.0, 0.1, 20)))["verdict"] == "regression"
+    assert compare_samples(list(baseline), list(0.5 * rng.lognormal(0.0, 0.1, 20)))["verdict"] == "improvement"
+
+
+def test_too_few_runs_are_not_flagged():
+    assert compare_samples([1.0, 1.1, 1.2], [3.0, 3.1, 3.2])["verdict"] == "too few runs"
@@ -0,0 +1,95 @@
+import json
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from mc_benchmark.conformance import Z_LIMIT, check_casino, compare_summaries
+
+ARGUMENTS = {"num_samples": 2000, "turn_limit": 100, "starting_value": 100, "win_loss_diff": 10}
+# "aggregated" in a function name is what tells check_casino numpy's aggregated array from a row per sample
+SHAPES = [
+    "casino_simulation",
+    "casino_simulation_aggregated",
+    "casino_simulation_tuple",
+    "casino_simulation_arrow",
+    "casino_simulation_long",
+]
+
+
+def simulate(p_win: float = 18 / 37, seed: int = 0) -> np.ndarray:
+    """Casino values, a row per sample and a column per turn from 0, stuck at 0 once a walk gets there."""
+    rng = np.random.default_rng(seed)
+    num_samples, turn_limit = ARGUMENTS["num_samples"], ARGUMENTS["turn_limit"]
+    steps = np.where(rng.random((num_samples, turn_limit)) < p_win, ARGUMENTS["win_loss_diff"], -ARGUMENTS["win_loss_diff"])
+    values = ARGUMENTS["starting_value"] + np.concatenate([np.zeros((num_samples, 1)), np.cumsum(steps, axis=1)], axis=1)
+    return np.where(np.minimum.accumulate(values, axis=1) <= 0, 0, values)
+
+
+def aggregated(values: np.ndarray, error_scale: float = 1.0) -> np.ndarray:
+    # numpy's aggregated shape: (turn, average, samples, standard error) columns
+    errors = values.std(axis=0, ddof=1) / np.sqrt(len(values)) * error_scale
+    return np.column_stack([np.arange(values.shape[1]), values.mean(axis=0), np.full(values.shape[1], len(values)), errors])
+
+
+def output_shapes(values: np.ndarray) -> dict:
+    """The same simulation in every output shape the backends return."""
+    table = aggregated(values)
+    num_samples, num_turns = values.shape
+    return {
+        "casino_simulation": values,
+        "casino_simulation_aggregated": table,
+        "casino_simulation_tuple": (table[:, 0], table[:, 1], table[:, 3]),
+        "casino_simulation_arrow": pa.table({"turn": table[:, 0], "avg_value": table[:, 1], "avg_value_error": table[:, 3]}),
+        "casino_simulation_long": pa.table({
+            "sample": np.repeat(np.arange(num_samples), num_turns),
+            "turn": np.tile(np.arange(num_turns), num_samples),
+            "value": values.ravel(),
+        }),
+    }
+
+
+@pytest.mark.parametrize("function_name", SHAPES)
+def test_check_casino_passes_a_correct_output(function_name):
+    result = check_casino(output_shapes(simulate())[function_name], function_name, ARGUMENTS)
+    assert result["status"] == "ok", result["detail"]
+    assert result["max_z"] < Z_LIMIT
+
+
+@pytest.mark.parametrize("function_name", SHAPES)
+def test_check_casino_fails_a_wrong_win_probability(function_name):
+    result = check_casino(output_shapes(simulate(p_win=19 / 38))[function_name], function_name, ARGUMENTS)
+    assert result["status"] == "failed"
+    assert result["max_z"] > Z_LIMIT
+
+
+def test_check_casino_fails_too_small_standard_errors():
+    result = check_casino(aggregated(simulate(), error_scale=1 / 3), "casino_simulation_aggregated", ARGUMENTS)
+    assert result["status"] == "failed"
+    assert "standard errors" in result["detail"]
+
+
+def summary_results(means: dict) -> dict:
+    arguments = json.dumps({"num_samples": 20}, sort_keys=True)
+    return {
+        (type, "elo_calculator", arguments): {"status": "ok", "max_z": 1.0, "detail": None, "summary": {"score variance": (mean, 0.01)}}
+        for type, mean in means.items()
+    }
+
+
+def test_compare_summaries_flags_the_disagreeing_backend():
+    results = summary_results({"numpy": 1.23, "numba": 1.235, "duckdb": 1.225, "polars": 1.5})
+    compare_summaries(results)
+    statuses = {key[0]: result["status"] for key, result in results.items()}
+    assert statuses == {"numpy": "ok", "numba": "ok", "duckdb": "ok", "polars": "failed"}
+    assert "score variance" in results[("polars", "elo_calculator", '{"num_samples": 20}')]["detail"]
+
+
+def test_compare_summaries_passes_agreeing_backends():
+    results = summary_results({"numpy": 1.23, "numba": 1.24})
+    compare_summaries(results)
+    assert all(result["status"] == "ok" for result in results.values())
+    results = summary_results({"numpy": 1.23, "numba": 1.5})
+    compare_summaries(results)
+    # with two backends there is no telling which one is wrong
+    assert all(result["status"] == "failed" for result in results.values())
@@ -0,0 +1,42 @@
+import subprocess
+import sys
+
+import duckdb
+import numpy as np
+import pytest
+
+from mc_benchmark.calculators import elo
+from mc_benchmark.calculators.duckdb_calculator import DuckDBCalculator, _create_elo_macros
+
+
+def test_elo_macros_match_the_game_model():
+    con = duckdb.connect()
+    _create_elo_macros(con)
+    elos = np.array([800.0, 950.0, 1000.0, 1199.0])
+    opponent_elos = np.array([1199.0, 1000.0, 1000.0, 800.0])
+    win, draw = con.execute(
+        "select list(prob_win(e, o)), list(prob_draw(e, o)) from (select unnest(?) as e, unnest(?) as o)",
+        [elos.tolist(), opponent_elos.tolist()],
+    ).fetchone()
+    assert win == pytest.approx(elo.prob_win(elos, opponent_elos))
+    assert draw == pytest.approx(elo.prob_draw(elos, opponent_elos))
+
+
+def test_elo_calculator_repeated_calls_finish():
+    # the round queries used to call python udfs, which hung now and then;
+    # a subprocess so a hang fails the test instead of the run
+    code = (
+        "from mc_benchmark.calculators.duckdb_calculator import DuckDBCalculator\n"
+        "for _ in range(30):\n"
+        "    assert DuckDBCalculator.elo_calculator(num_samples=20, num_players=50, num_rounds=6).num_rows == 1000\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True, timeout=120)
+
+
+def test_elo_calculator_scores():
+    table = DuckDBCalculator.elo_calculator(num_samples=10, num_players=20, num_rounds=6).to_pandas()
+    totals = table.groupby("tournament")["score"].sum()
+    # every game hands out one point between its two players, and a bye is a win on top
+    assert (totals == totals.round()).all()
+    assert (totals >= 20 * 6 / 2).all()
+    assert table["elo"].between(elo.INITIAL_ELO, elo.INITIAL_ELO + elo.ELO_RANGE).all()
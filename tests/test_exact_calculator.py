@@ -0,0 +1,46 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from mc_benchmark.calculators.exact_calculator import WIN_PROBABILITY, ExactCalculator, casino_value_moments
+
+
+def enumerated_moments(turn_limit: int, starting_value: int, win_loss_diff: int):
+    """Mean and standard deviation at each turn from every sequence of wins and losses."""
+    means, deviations = [], []
+    for turns in range(turn_limit):
+        values, probabilities = [], []
+        for wins in itertools.product([True, False], repeat=turns):
+            value = starting_value
+            for win in wins:
+                # bust is absorbing, and a bet bigger than what is left takes it to 0
+                value = 0 if value == 0 else max(value + (win_loss_diff if win else -win_loss_diff), 0)
+            values.append(value)
+            probabilities.append(np.prod([WIN_PROBABILITY if win else 1 - WIN_PROBABILITY for win in wins]))
+        values, probabilities = np.array(values, dtype=np.float64), np.array(probabilities)
+        mean = probabilities @ values
+        means.append(mean)
+        deviations.append(np.sqrt(probabilities @ np.square(values - mean)))
+    return np.array(means), np.array(deviations)
+
+
+@pytest.mark.parametrize("starting_value", [30, 25, 10, 200])
+def test_casino_value_moments_match_enumeration(starting_value):
+    means, deviations = casino_value_moments(10, starting_value, 10)
+    expected_means, expected_deviations = enumerated_moments(10, starting_value, 10)
+    assert means == pytest.approx(expected_means, abs=1e-12)
+    assert deviations == pytest.approx(expected_deviations, abs=1e-12)
+
+
+def test_casino_simulation_aggregated_standard_errors():
+    table = ExactCalculator.casino_simulation_aggregated(num_samples=400, turn_limit=10, starting_value=30)
+    means, deviations = enumerated_moments(10, 30, 10)
+    assert table[:, 0] == pytest.approx(np.arange(10))
+    assert table[:, 1] == pytest.approx(means)
+    assert table[:, 3] == pytest.approx(deviations / 20)
+
+
+def test_missing_models_raise():
+    with pytest.raises(NotImplementedError):
+        ExactCalculator.elo_calculator()
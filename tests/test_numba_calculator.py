@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from mc_benchmark.calculators.numba_calculator import _sobol_directions, _to_uniform
+from mc_benchmark.calculators.numpy_calculator import sobol_points
+
+
+def numba_sobol_points(num_points: int) -> tuple[np.ndarray, np.ndarray]:
+    """The points _pi_qmc_kernel steps through before shifting them, in plain python."""
+    directions = _sobol_directions.py_func()
+    x, y = np.uint64(0), np.uint64(0)
+    xs, ys = [], []
+    for index in range(num_points):
+        xs.append(_to_uniform.py_func(x))
+        ys.append(_to_uniform.py_func(y))
+        bit = 0
+        while (index >> bit) & 1:
+            bit += 1
+        x ^= directions[0, bit]
+        y ^= directions[1, bit]
+    return np.array(xs), np.array(ys)
+
+
+@pytest.mark.parametrize("num_points", [1, 7, 64, 100, 1000])
+def test_sobol_points_match_numba(num_points):
+    # the same points in the same order, so both backends integrate the same set for any num_samples
+    x, y = sobol_points(num_points)
+    expected_x, expected_y = numba_sobol_points(num_points)
+    assert x == pytest.approx(expected_x, abs=1e-15)
+    assert y == pytest.approx(expected_y, abs=1e-15)